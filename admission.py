@@ -0,0 +1,262 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+# Load environment variables at startup
+load_dotenv()
+
+# Provider quotas, enforced per model since that is how they are granted.
+# 0 turns a limit off.
+LLM_REQUESTS_PER_SECOND = float(os.getenv('LLM_REQUESTS_PER_SECOND', '5'))
+LLM_TOKENS_PER_MINUTE = float(os.getenv('LLM_TOKENS_PER_MINUTE', '1000000'))
+# Seconds of quota that may be spent in one burst after an idle spell
+LLM_BURST_SECONDS = float(os.getenv('LLM_BURST_SECONDS', '2'))
+# Completion size assumed when admitting a call; corrected from the
+# response's usage once it returns
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv('LLM_EXPECTED_OUTPUT_TOKENS', '400'))
+# Pause after the provider throttles us, doubling on repeats up to the max
+LLM_THROTTLE_BACKOFF_SECONDS = float(os.getenv('LLM_THROTTLE_BACKOFF_SECONDS', '1'))
+LLM_THROTTLE_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_THROTTLE_BACKOFF_MAX_SECONDS', '30'))
+# How often a queued caller re-checks the buckets and its deadline
+TICK_SECONDS = 0.25
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+# Lower is served first
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# Only errors that mean "slow down"; a bare 503 or a billing quota error is
+# not fixed by waiting
+THROTTLE_MARKERS = ('429', 'resource_exhausted', 'resourceexhausted', 'rate limit', 'overloaded')
+
+
+def estimate_tokens(messages):
+    # ~4 characters per token is close enough for admission; the bucket is
+    # corrected with the real count afterwards
+    characters = sum(len(content if isinstance(content, str) else str(content))
+                     for _, content in messages)
+    return characters // 4 + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def is_throttled(error):
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+def used_tokens(response):
+    usage = getattr(response, 'usage_metadata', None) or {}
+    return usage.get('total_tokens') or (usage.get('input_tokens', 0) + usage.get('output_tokens', 0)) or None
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Calls larger than the bucket go through once it is full
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when a call used more than estimated; the debt is
+        # paid off before anyone else is admitted
+        self.level -= amount
+
+
+class Waiter:
+    def __init__(self, owner, priority, tokens, start, seq):
+        self.owner = owner
+        self.rank = PRIORITIES.get(priority, 0)
+        self.priority = priority if priority in PRIORITIES else INTERACTIVE
+        self.tokens = tokens
+        self.start = start
+        self.seq = seq
+        self.enqueued = time.monotonic()
+
+    @property
+    def key(self):
+        return (self.rank, self.start, self.seq)
+
+
+class Ticket:
+    # Returned by acquire(); settle() squares the token bucket with what the
+    # call actually used
+
+    def __init__(self, controller, tokens):
+        self.controller = controller
+        self.tokens = tokens
+
+    def settle(self, response):
+        actual = used_tokens(response) if response is not None else None
+        if actual is not None and self.controller.tokens is not None:
+            with self.controller.cond:
+                self.controller.tokens.take(actual - self.tokens)
+
+
+class AdmissionController:
+    # Calls wait here until both buckets have room. Interactive callers go
+    # before batch ones; within a priority, owners (user sessions) share
+    # capacity by start-time fair queuing, so one analyst firing off many
+    # questions can't push everyone else to the back.
+
+    def __init__(self, name, requests_per_second=None, tokens_per_minute=None):
+        requests_per_second = LLM_REQUESTS_PER_SECOND if requests_per_second is None else requests_per_second
+        tokens_per_minute = LLM_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        self.name = name
+        self.requests = (TokenBucket(requests_per_second, requests_per_second * LLM_BURST_SECONDS)
+                         if requests_per_second > 0 else None)
+        self.tokens = (TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60 * LLM_BURST_SECONDS)
+                       if tokens_per_minute > 0 else None)
+        self.cond = threading.Condition()
+        self.waiters = []
+        self.finish_tags = {}
+        self.clock = 0.0
+        self.sequence = itertools.count()
+        self.blocked_until = 0.0
+        self.backoff = LLM_THROTTLE_BACKOFF_SECONDS
+        # Metrics
+        self.max_queued = 0
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.abandoned = 0
+        self.throttled = 0
+        self.waits = deque(maxlen=1000)
+
+    def enqueue(self, owner, priority, tokens):
+        # An owner's next call starts where its previous one finished, or at
+        # the current clock if it has been idle (idle time earns no credit)
+        start = max(self.finish_tags.get(owner, 0.0), self.clock)
+        self.finish_tags[owner] = start + tokens
+        waiter = Waiter(owner, priority, tokens, start, next(self.sequence))
+        self.waiters.append(waiter)
+        self.max_queued = max(self.max_queued, len(self.waiters))
+        return waiter
+
+    def withdraw(self, waiter):
+        # A caller that gives up hands back the virtual time it reserved, so
+        # its owner's next call is not pushed back for work never done
+        self.waiters.remove(waiter)
+        for other in self.waiters:
+            if other.owner == waiter.owner and other.start > waiter.start:
+                other.start = max(other.start - waiter.tokens, self.clock)
+        if waiter.owner in self.finish_tags:
+            self.finish_tags[waiter.owner] = max(self.finish_tags[waiter.owner] - waiter.tokens, self.clock)
+        self.abandoned += 1
+        self.cond.notify_all()
+
+    def delay(self, waiter, now):
+        # Seconds until waiter may go, or None while others are ahead of it
+        if min(self.waiters, key=lambda w: w.key) is not waiter:
+            return None
+        delays = [self.blocked_until - now, 0.0]
+        for bucket, amount in ((self.requests, 1), (self.tokens, waiter.tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                delays.append(bucket.wait_time(amount))
+        return max(delays)
+
+    def position(self, waiter):
+        return 1 + sum(1 for other in self.waiters if other.key < waiter.key)
+
+    def admit(self, waiter, now):
+        self.waiters.remove(waiter)
+        self.clock = waiter.start
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(waiter.tokens)
+        self.admitted[waiter.priority] += 1
+        self.waits.append(now - waiter.enqueued)
+        if len(self.finish_tags) > 1000:
+            self.finish_tags = {owner: tag for owner, tag in self.finish_tags.items() if tag > self.clock}
+        # The next in line re-evaluates against the updated buckets
+        self.cond.notify_all()
+
+    def acquire(self, tokens, owner=None, priority=INTERACTIVE, deadline=None):
+        with self.cond:
+            waiter = self.enqueue(owner, priority, tokens)
+        try:
+            while True:
+                with self.cond:
+                    now = time.monotonic()
+                    delay = self.delay(waiter, now)
+                    if delay == 0:
+                        self.admit(waiter, now)
+                        return Ticket(self, tokens)
+                    if deadline is not None:
+                        deadline.waiting = f"queued for the model ({self.position(waiter)} of {len(self.waiters)})"
+                    self.cond.wait(TICK_SECONDS if delay is None else min(delay, TICK_SECONDS))
+                if deadline is not None:
+                    # Raises once the deadline passes or the request is cancelled
+                    deadline.tick()
+        except BaseException:
+            with self.cond:
+                if waiter in self.waiters:
+                    self.withdraw(waiter)
+            raise
+        finally:
+            if deadline is not None:
+                deadline.waiting = None
+
+    def record_throttle(self):
+        # The provider pushed back anyway: stop admitting for a while and
+        # start the token bucket from empty
+        with self.cond:
+            self.throttled += 1
+            self.blocked_until = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, LLM_THROTTLE_BACKOFF_MAX_SECONDS)
+            if self.tokens is not None:
+                self.tokens.level = min(self.tokens.level, 0.0)
+
+    def record_success(self):
+        with self.cond:
+            self.backoff = LLM_THROTTLE_BACKOFF_SECONDS
+
+    def snapshot(self):
+        with self.cond:
+            waits = list(self.waits)
+            return {
+                'queued': len(self.waiters),
+                'max_queued': self.max_queued,
+                'admitted': dict(self.admitted),
+                'abandoned': self.abandoned,
+                'throttled': self.throttled,
+                'wait_p50_ms': round(percentile(waits, 50) * 1000, 1),
+                'wait_p95_ms': round(percentile(waits, 95) * 1000, 1),
+                'wait_max_ms': round(max(waits, default=0.0) * 1000, 1),
+            }
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def controller(model):
+    # One per model and process, shared by every session
+    with _controllers_lock:
+        if model not in _controllers:
+            _controllers[model] = AdmissionController(model)
+        return _controllers[model]
+
+
+def snapshot():
+    with _controllers_lock:
+        controllers = dict(_controllers)
+    return {model: gate.snapshot() for model, gate in controllers.items()}
@@ -0,0 +1,473 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import admission
+import db
+import export
+import model_router
+import rollups
+from deadline import Deadline, DeadlineExceeded, REQUEST_DEADLINE_SECONDS
+from llm import get_sql_query, get_improved_sql_query, warm_up
+
+# Load environment variables at startup
+load_dotenv()
+
+# Blocking LLM and DB calls run on separate bounded pools so a slow database
+# cannot starve generation (and vice versa).
+LLM_WORKERS = int(os.getenv('API_LLM_WORKERS', '16'))
+# Batch-priority generation gets its own smaller pool: batch calls wait
+# longest in the admission queue and must not hold interactive workers
+BATCH_LLM_WORKERS = int(os.getenv('API_BATCH_LLM_WORKERS', '4'))
+DB_WORKERS = int(os.getenv('API_DB_WORKERS', '32'))
+# Requests allowed to wait for a worker before we start shedding load with 503s
+MAX_QUEUE = int(os.getenv('API_MAX_QUEUE', '256'))
+FETCH_BATCH_SIZE = int(os.getenv('API_FETCH_BATCH_SIZE', '1000'))
+# Bytes buffered by an export before a chunk is handed to the response
+EXPORT_CHUNK_BYTES = int(os.getenv('API_EXPORT_CHUNK_BYTES', str(256 * 1024)))
+# Finished exports whose progress is still reported by /exports/{id}
+MAX_TRACKED_EXPORTS = 100
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BoundedPool:
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if self.slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.name} queue is full")
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.slots.release()
+
+    async def call(self, fn, *args):
+        # Run fn on a worker thread once the caller already holds a slot
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def run(self, fn, *args):
+        await self.acquire()
+        try:
+            return await self.call(fn, *args)
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class QueueSink:
+    # File-like object an export thread writes to. Chunks go through a bounded
+    # asyncio queue, so a slow client slows the export down instead of
+    # letting it buffer the whole file in memory.
+    def __init__(self, loop, chunks):
+        self.loop = loop
+        self.chunks = chunks
+        self.buffer = bytearray()
+        self.cancelled = False
+
+    def put(self, item):
+        future = asyncio.run_coroutine_threadsafe(self.chunks.put(item), self.loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                if self.cancelled:
+                    future.cancel()
+                    raise export.ExportCancelled("Client disconnected")
+
+    def write(self, data):
+        if self.cancelled:
+            raise export.ExportCancelled("Client disconnected")
+        self.buffer.extend(data)
+        if len(self.buffer) >= EXPORT_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def finish(self):
+        self.put(None)
+
+
+def json_default(value):
+    # Decimal, datetime and bytes values from pymysql are not JSON serializable
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+def dumps(payload):
+    return json.dumps(payload, default=json_default)
+
+
+async def read_json(request, *required):
+    try:
+        body = await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text=dumps({'error': 'Request body must be JSON'}),
+                                 content_type='application/json')
+    missing = [key for key in required if not body.get(key)]
+    if missing:
+        raise web.HTTPBadRequest(text=dumps({'error': f"Missing fields: {', '.join(missing)}"}),
+                                 content_type='application/json')
+    return body
+
+
+@web.middleware
+async def overload_middleware(request, handler):
+    try:
+        return await handler(request)
+    except Overloaded as e:
+        return web.json_response({'error': str(e)}, status=503, headers={'Retry-After': '1'},
+                                 dumps=dumps)
+
+
+def request_deadline(request, body):
+    # Clients may ask for a tighter budget than the server default, never a looser one
+    seconds = REQUEST_DEADLINE_SECONDS
+    if body.get('timeout_seconds') is not None:
+        try:
+            seconds = min(seconds, float(body['timeout_seconds']))
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text=dumps({'error': "timeout_seconds must be a number"}),
+                                     content_type='application/json')
+    # Scripted and bulk callers send "priority": "batch" and queue behind
+    # interactive users; fair sharing is per session_id, else per client address
+    priority = body.get('priority', admission.INTERACTIVE)
+    if priority not in admission.PRIORITIES:
+        raise web.HTTPBadRequest(text=dumps({'error': f"priority must be one of {sorted(admission.PRIORITIES)}"}),
+                                 content_type='application/json')
+    return Deadline(seconds, owner=str(body.get('session_id') or request.remote), priority=priority)
+
+
+async def run_llm(request, deadline, fn, *args):
+    try:
+        pool = request.app['batch_llm_pool' if deadline.priority == admission.BATCH else 'llm_pool']
+        return await pool.run(fn, *args, deadline)
+    except asyncio.CancelledError:
+        # Client disconnected: the worker thread notices on its next tick and
+        # cancels the in-flight model call instead of running to completion
+        deadline.cancel()
+        raise
+
+
+async def generate(request):
+    body = await read_json(request, 'question')
+    deadline = request_deadline(request, body)
+    try:
+        sql_query = await run_llm(request, deadline, get_sql_query, body['question'])
+    except Overloaded:
+        raise
+    except DeadlineExceeded as e:
+        return web.json_response({'error': str(e)}, status=504, dumps=dumps)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=502, dumps=dumps)
+    return web.json_response({'question': body['question'], 'sql': sql_query}, dumps=dumps)
+
+
+async def regenerate(request):
+    body = await read_json(request, 'question', 'sql')
+    deadline = request_deadline(request, body)
+    try:
+        sql_query = await run_llm(request, deadline, get_improved_sql_query,
+                                  body['question'], body['sql'], body.get('error'))
+    except Overloaded:
+        raise
+    except DeadlineExceeded as e:
+        return web.json_response({'error': str(e)}, status=504, dumps=dumps)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=502, dumps=dumps)
+    return web.json_response({'question': body['question'], 'sql': sql_query}, dumps=dumps)
+
+
+async def open_cursor(pool, deadline, sql_query):
+    # If the client goes away while the statement is still starting, the
+    # worker kills it through deadline.cancel(); a connection that was
+    # returned anyway is closed once it arrives instead of leaking.
+    opening = asyncio.ensure_future(pool.call(
+        db.open_streaming_cursor, sql_query, db.execution_budget_ms(deadline.remaining_ms()),
+        lambda: deadline.cancelled))
+    try:
+        return await asyncio.shield(opening)
+    except asyncio.CancelledError:
+        deadline.cancel()
+
+        def close_opened(done):
+            if not done.cancelled() and done.exception() is None:
+                conn = done.result()[0]
+                pool.executor.submit(conn.close)
+
+        opening.add_done_callback(close_opened)
+        raise
+
+
+async def execute(request):
+    body = await read_json(request, 'sql')
+    output_format = body.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'json'):
+        return web.json_response({'error': "format must be 'ndjson' or 'json'"}, status=400)
+    deadline = request_deadline(request, body)
+
+    pool = request.app['db_pool']
+    # The slot is held for the whole stream because the server-side cursor
+    # keeps its connection busy until the last row is fetched.
+    await pool.acquire()
+    conn = None
+    try:
+        try:
+            db.check_read_only(body['sql'])
+            executed_sql, from_rollup = await pool.call(rollups.route, body['sql'])
+            # Whatever budget is left after queueing, within the usual cap,
+            # becomes the statement's max_execution_time
+            deadline.check()
+            started = time.monotonic()
+            conn, cursor, columns = await open_cursor(pool, deadline, executed_sql)
+            # Logged runtime is time spent in the database, not time spent
+            # waiting on the client to read the stream
+            db_seconds = time.monotonic() - started
+        except DeadlineExceeded as e:
+            return web.json_response({'error': str(e)}, status=504, dumps=dumps)
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=400, dumps=dumps)
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/x-ndjson' if output_format == 'ndjson' else 'application/json',
+            'X-Served-From': 'rollup' if from_rollup else 'raw',
+        })
+        await response.prepare(request)
+
+        if output_format == 'ndjson':
+            await response.write((dumps({'columns': columns}) + '\n').encode())
+        else:
+            await response.write(('{"columns": ' + dumps(columns) + ', "rows": [').encode())
+
+        first = True
+        row_count = 0
+        try:
+            while True:
+                fetch_started = time.monotonic()
+                rows = await pool.call(cursor.fetchmany, FETCH_BATCH_SIZE)
+                db_seconds += time.monotonic() - fetch_started
+                if not rows:
+                    break
+                row_count += len(rows)
+                if output_format == 'ndjson':
+                    chunk = ''.join(dumps(list(row)) + '\n' for row in rows)
+                else:
+                    chunk = ('' if first else ',') + ','.join(dumps(list(row)) for row in rows)
+                first = False
+                await response.write(chunk.encode())
+            trailer = {'row_count': row_count}
+        except (ConnectionResetError, asyncio.CancelledError):
+            # Client went away: stop the statement on the server, not just the socket
+            try:
+                await pool.call(db.kill_query, conn)
+            except Exception as e:
+                print("Failed to kill query:", e)
+            raise
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            trailer = {'row_count': row_count, 'error': str(e)}
+        await pool.call(db.log_execution, executed_sql, db_seconds, row_count,
+                        trailer.get('error'), 'api')
+
+        if output_format == 'ndjson':
+            await response.write((dumps(trailer) + '\n').encode())
+        else:
+            await response.write(('], ' + dumps(trailer)[1:]).encode())
+        await response.write_eof()
+        return response
+    finally:
+        if conn is not None:
+            await pool.call(conn.close)
+        pool.release()
+
+
+async def export_results(request):
+    body = await read_json(request, 'sql')
+    output_format = body.get('format', 'csv.gz')
+    if output_format not in export.FORMATS:
+        return web.json_response({'error': f"format must be one of {sorted(export.FORMATS)}"}, status=400)
+    try:
+        db.check_read_only(body['sql'])
+    except db.ReadOnlyViolation as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    exports = request.app['exports']
+    export_id = uuid.uuid4().hex
+    progress = export.ExportProgress()
+    exports[export_id] = progress
+    while len(exports) > MAX_TRACKED_EXPORTS:
+        exports.pop(next(iter(exports)))
+
+    pool = request.app['db_pool']
+    await pool.acquire()
+    loop = asyncio.get_running_loop()
+    sink = QueueSink(loop, asyncio.Queue(maxsize=8))
+
+    def produce():
+        try:
+            export.export(body['sql'], sink, output_format, progress=progress)
+            sink.flush()
+        except export.ExportCancelled:
+            progress.error = 'cancelled'
+            return
+        except Exception as e:
+            print("Export failed:", e)
+        try:
+            sink.finish()
+        except export.ExportCancelled:
+            pass
+
+    producer = loop.run_in_executor(pool.executor, produce)
+    try:
+        response = web.StreamResponse(headers={
+            'Content-Type': export.FORMATS[output_format]['mime'],
+            'Content-Disposition': f'attachment; filename="export-{export_id}{export.FORMATS[output_format]["extension"]}"',
+            'X-Export-Id': export_id,
+        })
+        await response.prepare(request)
+        while True:
+            chunk = await sink.chunks.get()
+            if chunk is None:
+                break
+            await response.write(chunk)
+        if progress.error:
+            # Headers are gone; dropping the connection is the only way to
+            # tell the client the file is incomplete
+            raise ConnectionResetError(progress.error)
+        await response.write_eof()
+        return response
+    finally:
+        # Stops the producer wherever it is: waiting on the client, writing,
+        # or still waiting for MySQL to run the statement (which is killed)
+        sink.cancelled = True
+        progress.cancelled = True
+        await producer
+        pool.release()
+
+
+async def export_status(request):
+    progress = request.app['exports'].get(request.match_info['export_id'])
+    if progress is None:
+        return web.json_response({'error': 'Unknown export'}, status=404)
+    return web.json_response(progress.as_dict())
+
+
+async def download_export(request):
+    # Files prepared by the app's "Prepare Export"; the random id is the
+    # only way to name one. Sent from disk in chunks, never read into memory.
+    prepared = export.find_prepared(request.match_info['export_id'])
+    if prepared is None:
+        return web.json_response({'error': 'Unknown export'}, status=404)
+    path, output_format = prepared
+    extension = export.FORMATS[output_format]['extension']
+    return web.FileResponse(path, chunk_size=EXPORT_CHUNK_BYTES, headers={
+        'Content-Type': export.FORMATS[output_format]['mime'],
+        'Content-Disposition': f'attachment; filename="query-results{extension}"',
+    })
+
+
+async def feedback(request):
+    body = await read_json(request, 'question', 'sql')
+    if 'is_good' not in body:
+        return web.json_response({'error': 'Missing fields: is_good'}, status=400)
+    try:
+        await request.app['db_pool'].run(db.save_query, body['question'], body['sql'],
+                                         bool(body['is_good']))
+    except Overloaded:
+        raise
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500, dumps=dumps)
+    return web.json_response({'saved': True})
+
+
+async def health(request):
+    app = request.app
+    return web.json_response({
+        'uptime_seconds': round(time.monotonic() - app['started_at'], 1),
+        'llm_pool': app['llm_pool'].stats(),
+        'batch_llm_pool': app['batch_llm_pool'].stats(),
+        'db_pool': app['db_pool'].stats(),
+        'models': model_router.stats.snapshot(),
+        'admission': admission.snapshot(),
+    })
+
+
+async def on_startup(app):
+    app['started_at'] = time.monotonic()
+    app['llm_pool'] = BoundedPool('llm', LLM_WORKERS, MAX_QUEUE)
+    app['batch_llm_pool'] = BoundedPool('llm_batch', BATCH_LLM_WORKERS, MAX_QUEUE)
+    app['db_pool'] = BoundedPool('db', DB_WORKERS, MAX_QUEUE)
+    app['exports'] = {}
+    # Model SDK imports and clients load while the server starts accepting requests
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+
+async def on_cleanup(app):
+    app['llm_pool'].shutdown()
+    app['batch_llm_pool'].shutdown()
+    app['db_pool'].shutdown()
+
+
+def create_app():
+    app = web.Application(middlewares=[overload_middleware])
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([
+        web.post('/generate', generate),
+        web.post('/regenerate', regenerate),
+        web.post('/execute', execute),
+        web.post('/export', export_results),
+        web.get('/exports/{export_id}', export_status),
+        web.get('/exports/{export_id}/download', download_export),
+        web.post('/feedback', feedback),
+        web.get('/health', health),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(),
+                host=os.getenv('API_HOST', '0.0.0.0'),
+                port=int(os.getenv('API_PORT', '8080')),
+                # Cancel handlers when their client disconnects, so LLM calls
+                # and queries for nobody are stopped (see run_llm, execute)
+                handler_cancellation=True)
@@ -1,10 +1,24 @@
 import streamlit as st
-from llm import get_sql_query, get_improved_sql_query
+from llm import get_sql_query, get_improved_sql_query, warm_up
 import pandas as pd
-import pymysql
+import db
+from deadline import Deadline, DeadlineExceeded, RequestCancelled
+import render
+import dashboard
+import export
+import rollups
+import sampling
+import model_router
+import admission
 from dotenv import load_dotenv
+import hashlib
+import io
 import os
+import pickle
+import threading
+import time
 import uuid
+import zlib
 
 # Load environment variables
 load_dotenv()
@@ -22,21 +36,48 @@ if 'current_improved_query' not in st.session_state:
     st.session_state.current_improved_query = None
 if 'saved_queries' not in st.session_state:
     st.session_state.saved_queries = []
+if 'query_results' not in st.session_state:
+    st.session_state.query_results = {}
+if 'export_files' not in st.session_state:
+    st.session_state.export_files = {}
+if 'session_id' not in st.session_state:
+    # Identifies this browser session to the LLM admission queue's fair sharing
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Executed results kept per session, most recently used last
+MAX_CACHED_RESULTS = int(os.getenv('MAX_CACHED_RESULTS', '5'))
+# Table pages kept per cached result
+MAX_CACHED_PAGES = int(os.getenv('MAX_CACHED_PAGES', '5'))
+
+# Shared across sessions and reruns: the pools are built once per process
+# instead of on every widget interaction.
+@st.cache_resource
+def get_connection_pool():
+    # Generated SQL runs on the replicas under a read-only, time-limited session
+    return db.ConnectionPool(connect=db.get_read_connection)
+
+@st.cache_resource
+def get_write_pool():
+    # Only feedback writes go to the primary
+    return db.ConnectionPool(max_size=2)
+
+@st.cache_resource
+def start_warm_up():
+    # Once per process, after the first page has been sent: the model SDK
+    # and clients load in the background instead of delaying the first paint
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
 
 # Database connection function - Move this to the top
 def get_database_connection():
-    connection_params = {
-        'host': os.getenv('DB_HOST'),
-        'user': os.getenv('DB_USER'),
-        'password': os.getenv('DB_PASSWORD'),
-        'db': os.getenv('DB_NAME')
-    }
+    connection_params = db.get_connection_params()
     
     # Debug connection parameters (optional)
     if st.sidebar.checkbox("Debug Connection Parameters", key='debug_params_connection'):
         st.sidebar.write({k: v for k, v in connection_params.items() if k != 'password'})
     
-    return pymysql.connect(**connection_params)
+    return db.get_database_connection()
 
 # Debug database connection - Move this after the function definition
 if st.sidebar.checkbox("Test Database Connection", key='test_db_connection'):
@@ -53,19 +94,314 @@ if st.sidebar.checkbox("Test Database Connection", key='test_db_connection'):
 
 def save_query(question, query, is_good):
     try:
-        conn = get_database_connection()
-        cursor = conn.cursor()
-        
-        sql = "INSERT INTO query_feedback (question, sql_query, feedback) VALUES (%s, %s, %s)"
-        cursor.execute(sql, (question, query, 1 if is_good else 0))
-        
-        conn.commit()
-        conn.close()
-        return True
+        with get_write_pool().connection() as conn:
+            return db.save_query(question, query, is_good, conn=conn)
     except Exception as e:
-        st.sidebar.error(f"Error saving query: {str(e)}")
+        st.error(f"Error saving query: {str(e)}")
         return False
 
+def result_key(sql_query):
+    return hashlib.sha1(sql_query.strip().encode('utf-8')).hexdigest()
+
+def compact(df):
+    # Keep frames compressed so several results fit comfortably in session state
+    try:
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, compression='zstd', index=False)
+        return ('parquet', buffer.getvalue())
+    except Exception:
+        # Object columns with mixed types can't always be written as parquet
+        return ('pickle', zlib.compress(pickle.dumps(df)))
+
+def expand(payload):
+    kind, data = payload
+    if kind == 'parquet':
+        return pd.read_parquet(io.BytesIO(data))
+    return pickle.loads(zlib.decompress(data))
+
+def store_result(sql_query, result_set):
+    entry = {
+        'executed_sql': result_set['executed_sql'],
+        'from_rollup': result_set['from_rollup'],
+        'preview': result_set['preview'],
+        'row_count': result_set['row_count'],
+        'page_size': result_set['page_size'],
+        'plan': result_set['plan'],
+        'chart_kind': result_set['chart_kind'],
+        'chart_bucketed': result_set['chart_bucketed'],
+        'chart': compact(result_set['chart']) if result_set['chart'] is not None else None,
+        'pages': {0: compact(result_set['first_page'])},
+    }
+    key = result_key(sql_query)
+    results = st.session_state.query_results
+    results.pop(key, None)
+    results[key] = entry
+    evicted = []
+    while len(results) > MAX_CACHED_RESULTS:
+        evicted_key = next(iter(results))
+        results.pop(evicted_key)
+        evicted.append(evicted_key)
+    if evicted:
+        discard_exports(evicted)
+
+def discard_exports(result_keys=None):
+    # Prepared export files are temp files on the server; they go away with
+    # the result they were made from (or all of them when result_keys is None)
+    exports = st.session_state.export_files
+    for key, prepared in list(exports.items()):
+        if result_keys is None or result_key(prepared['sql']) in result_keys:
+            del exports[key]
+            remove_export_file(prepared)
+
+def remove_export_file(prepared):
+    if prepared and os.path.exists(prepared['path']):
+        os.remove(prepared['path'])
+
+def load_result(sql_query):
+    key = result_key(sql_query)
+    results = st.session_state.query_results
+    if key not in results:
+        return None
+    # Mark as most recently used
+    entry = results.pop(key)
+    results[key] = entry
+    return entry
+
+def new_deadline(status, label):
+    # Per-request budget whose ticks redraw a status line. Redrawing is what
+    # lets Streamlit stop the script when the user clicks Clear, Stop or any
+    # other widget; in-flight LLM calls and queries are then cancelled.
+    def on_tick(deadline):
+        waiting = f", {deadline.waiting}" if deadline.waiting else ""
+        status.caption(f"{label}{waiting}... {deadline.elapsed():.1f}s of {deadline.budget:.0f}s")
+
+    return Deadline(on_tick=on_tick, owner=st.session_state.session_id, priority=admission.INTERACTIVE)
+
+def run_read(fn, sql_query):
+    # Runs fn(conn) on a replica within the request deadline; the statement
+    # is killed server-side if the deadline passes or the user interrupts.
+    db.check_read_only(sql_query)
+    status = st.empty()
+    deadline = new_deadline(status, "Running query")
+    try:
+        with get_connection_pool().connection() as conn:
+            db.set_execution_time(conn, db.execution_budget_ms(deadline.remaining_ms()))
+            return db.run_cancellable(conn, lambda: fn(conn), should_cancel=deadline.tick)
+    finally:
+        status.empty()
+
+def get_page(sql_query, entry, page):
+    pages = entry['pages']
+    if page not in pages:
+        executed_sql = entry['executed_sql']
+        df = run_read(lambda conn: render.fetch_page(conn, executed_sql, page, entry['page_size'],
+                                                             entry['plan']),
+                      executed_sql)
+        pages[page] = compact(df)
+        # Page 0 is always kept; other pages are evicted oldest first
+        while len(pages) > MAX_CACHED_PAGES:
+            pages.pop(next(p for p in pages if p != 0))
+    return expand(pages[page])
+
+def execute_query(sql_query, preview=False):
+    def load(conn):
+        # Funnel questions are answered from the daily rollups when possible
+        executed_sql, from_rollup = rollups.route(sql_query, conn)
+        sampled = None
+        if preview and not from_rollup:
+            # Otherwise a preview reads the session samples, with COUNT/SUM
+            # scaled back up to full-data estimates
+            sampled = sampling.preview(sql_query, conn)
+            executed_sql = sampled['sql']
+        result_set = render.load_result_set(conn, executed_sql)
+        result_set.update(executed_sql=executed_sql, from_rollup=from_rollup, preview=sampled)
+        return result_set
+
+    source = 'preview' if preview else 'app'
+    started = time.monotonic()
+    try:
+        result_set = run_read(load, sql_query)
+    except sampling.NotSampleable:
+        # Refused before anything ran; not a query failure
+        raise
+    except Exception as e:
+        db.log_execution(sql_query, time.monotonic() - started, error=str(e), source=source)
+        raise
+    # The main statement's own time; the count and chart queries aren't part of it
+    db.log_execution(result_set['executed_sql'], result_set['seconds'],
+                     rows=result_set['row_count'], source=source)
+    store_result(sql_query, result_set)
+    return result_set
+
+@st.fragment
+def results_section(sql_query, button_label, button_key, title, error_label, remember_error=False):
+    # Runs as a fragment: executing a query redraws only this block, and
+    # cached results are redrawn from session state without touching the DB.
+    # A preview runs on the session samples; the full scan only happens once
+    # the user asks for it.
+    def run(preview):
+        try:
+            execute_query(sql_query, preview=preview)
+            if remember_error and not preview:
+                st.session_state.pop('last_error', None)
+        except sampling.NotSampleable as e:
+            st.info(f"Preview isn't available for this query ({e}). Use {button_label} to run it on the full data.")
+        except Exception as e:
+            error_msg = str(e)
+            st.error(f"Error executing {error_label}: {error_msg}")
+            if remember_error:
+                st.session_state.last_error = error_msg
+
+    execute_col, preview_col = st.columns(2)
+    run_full = execute_col.button(button_label, key=button_key)
+    run_preview = preview_col.button("Preview on Sample", key=f"{button_key}_preview",
+                                     help="Runs on a sample of sessions; counts and sums are scaled up")
+    if run_full or run_preview:
+        run(preview=not run_full)
+
+    entry = load_result(sql_query)
+    if entry is not None and entry['preview'] and \
+            st.button("Run Full Query", key=f"{button_key}_promote", type='primary'):
+        run(preview=False)
+        entry = load_result(sql_query)
+    if entry is None:
+        return
+
+    st.subheader(title)
+    row_count, page_size = entry['row_count'], entry['page_size']
+    page_count = max(1, -(-row_count // page_size))
+    page = 0
+    if page_count > 1:
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1,
+                               key=f"{button_key}_page") - 1
+    try:
+        df = get_page(sql_query, entry, page)
+    except Exception as e:
+        st.error(f"Error fetching page: {str(e)}")
+        return
+    first_row = page * page_size + 1 if row_count else 0
+    st.dataframe(df)
+    st.caption(f"Rows {first_row:,}–{page * page_size + len(df):,} of {row_count:,}")
+    if entry['from_rollup']:
+        st.caption("Served from the daily funnel rollup")
+    sampled = entry['preview']
+    if sampled:
+        st.caption(f"Preview on a {sampled['permille'] / 10:g}% sample of sessions (refreshed {sampled['refreshed_at']}). "
+                   f"Counts and sums are scaled ×{sampled['factor']:g}"
+                   + ("; the ±95% columns are their error margins." if sampled['margins'] else "."))
+        for note in sampled['notes']:
+            st.caption(note)
+
+    if entry['chart'] is not None:
+        chart = expand(entry['chart'])
+        chart = chart.set_index(chart.columns[0])
+        if entry['chart_kind'] == 'series':
+            st.line_chart(chart)
+            if entry['chart_bucketed']:
+                st.caption(f"Chart averages all {row_count:,} rows into {len(chart):,} buckets along the x axis")
+            elif row_count > len(chart):
+                st.caption(f"Chart downsampled to {len(chart):,} of {row_count:,} points")
+        else:
+            st.bar_chart(chart)
+
+    if not sampled:
+        export_section(sql_query, entry, button_key)
+
+def export_to_file(sql_query, output_format, row_count):
+    # Streams the result into a file from a worker thread; rows never
+    # accumulate in memory. The progress bar redraw lets Streamlit stop the
+    # script, in which case the export is cancelled.
+    progress = export.ExportProgress()
+    export_id = uuid.uuid4().hex
+    os.makedirs(export.EXPORT_DIR, exist_ok=True)
+    handle = open(export.prepared_path(export_id, output_format), 'wb')
+    outcome = {}
+
+    def run():
+        try:
+            with handle:
+                export.export(sql_query, handle, output_format, progress=progress)
+        except Exception as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    bar = st.progress(0.0, text="Exporting...")
+    try:
+        while worker.is_alive():
+            worker.join(0.25)
+            done = min(progress.rows / row_count, 1.0) if row_count else 0.0
+            bar.progress(done, text=f"Exported {progress.rows:,} of {row_count:,} rows "
+                                    f"({progress.bytes / 1e6:.1f} MB)")
+    except BaseException:
+        progress.cancelled = True
+        worker.join(5)
+        os.remove(handle.name)
+        raise
+    bar.empty()
+    if 'error' in outcome:
+        os.remove(handle.name)
+        raise outcome['error']
+    return export_id, handle.name
+
+def export_section(sql_query, entry, key):
+    exports = st.session_state.export_files
+    export_col, download_col = st.columns([2, 1])
+    with export_col:
+        output_format = st.selectbox("Export format", list(export.FORMATS), index=1, key=f"{key}_export_format")
+        if st.button("Prepare Export", key=f"{key}_export"):
+            remove_export_file(exports.pop(key, None))
+            try:
+                export_id, path = export_to_file(entry['executed_sql'], output_format, entry['row_count'])
+                exports[key] = {'id': export_id, 'path': path, 'format': output_format, 'sql': sql_query}
+            except Exception as e:
+                st.error(f"Error exporting results: {str(e)}")
+    prepared = exports.get(key)
+    if prepared and prepared['sql'] != sql_query:
+        # Made for a query this section no longer shows
+        remove_export_file(exports.pop(key))
+        prepared = None
+    if prepared and os.path.exists(prepared['path']):
+        with download_col:
+            st.write("")
+            # A link to the API, which streams the file from disk; handing the
+            # file to st.download_button would load all of it into memory
+            st.link_button("Download", export.download_url(prepared['id']))
+
+@st.fragment
+def feedback_section(question, sql_query):
+    # Isolated from the results area so saving feedback only redraws these buttons
+    st.markdown("### Save Query")
+    col3, col4, col5 = st.columns(3)
+    with col3:
+        if st.button("👍 Save as Good Query", key="save_good_query"):
+            if save_query(question, sql_query, True):
+                st.success("Query saved successfully as good!")
+            else:
+                st.error("Failed to save query")
+    with col4:
+        if st.button("👎 Save as Bad Query", key="save_bad_query"):
+            if save_query(question, sql_query, False):
+                st.success("Query saved successfully as bad!")
+            else:
+                st.error("Failed to save query")
+    with col5:
+        if st.button("📌 Pin to Dashboard", key="pin_query"):
+            pinned = st.session_state.saved_queries
+            if not any(q['sql'] == sql_query for q in pinned):
+                pinned.append({'question': question, 'sql': sql_query})
+            st.success(f"Pinned ({len(pinned)} on dashboard)")
+
+@st.fragment
+def alternate_query_section(question):
+    st.markdown("### Save an Alternate Query")
+    alternate_query = st.text_area("Enter your alternate SQL query:")
+    if st.button("Save Alternate Query", key="save_alternate_query"):
+        if save_query(question, alternate_query, True):
+            st.success("Alternate query saved with feedback=1!")
+        else:
+            st.error("Failed to save alternate query")
+
 def save_feedback(question, sql_query, is_good):
     st.sidebar.write("Debug: save_feedback called with:", {
         "question": question[:50] + "...",
@@ -81,11 +417,11 @@ def save_feedback(question, sql_query, is_good):
         st.sidebar.write("Debug: Database connected")
         
         # Print the full SQL statement for debugging
-        sql = "INSERT INTO query_feedback (question, sql_query, feedback) VALUES (%s, %s, %s)"
+        sql = db.INSERT_FEEDBACK_SQL
         st.sidebar.write("Debug: Executing SQL:", sql)
         st.sidebar.write("Debug: Values:", (question[:50], sql_query[:50], is_good))
         
-        cursor.execute(sql, (question, sql_query, is_good))
+        cursor.execute(sql, (question, db.question_hash(question), sql_query, is_good))
         
         # Debug after execute
         st.sidebar.write("Debug: SQL executed")
@@ -111,6 +447,25 @@ def save_feedback(question, sql_query, is_good):
         st.sidebar.error(f"Debug: Full traceback:\n{traceback.format_exc()}")
         return False
 
+if st.sidebar.checkbox("Show model usage", key='show_model_usage'):
+    usage = model_router.stats.snapshot()
+    st.sidebar.caption(f"{usage['requests']} requests · {usage['verified']} from approved SQL · escalation rate "
+                       f"{usage['escalation_rate'] if usage['escalation_rate'] is not None else '-'}")
+    st.sidebar.dataframe(pd.DataFrame(usage['tiers']).T[
+        ['model', 'calls', 'errors', 'avg_latency_ms', 'input_tokens', 'output_tokens', 'cost']])
+    queues = admission.snapshot()
+    if queues:
+        st.sidebar.caption("Admission queue per model (shared by all sessions)")
+        st.sidebar.dataframe(pd.DataFrame(queues).T[
+            ['queued', 'max_queued', 'wait_p50_ms', 'wait_p95_ms', 'abandoned', 'throttled']])
+
+# Dashboard mode renders pinned queries side by side instead of the assistant
+mode = st.sidebar.radio("Mode", ["Query", "Dashboard"], key='app_mode')
+if mode == "Dashboard":
+    dashboard.render_dashboard()
+    start_warm_up()
+    st.stop()
+
 # Initialize Streamlit app
 st.title("SQL Query Assistant")
 
@@ -133,16 +488,31 @@ with clear_col:
         keys_to_clear = [
             'current_query', 'current_question', 'feedback_given',
             'improved_query_feedback_given', 'current_improved_query',
-            'improved_query', 'last_error', 'user_question', 'question_input'
+            'improved_query', 'last_error', 'user_question', 'question_input',
+            'query_results'
         ]
+        discard_exports()
         for key in keys_to_clear:
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
 
+start_warm_up()
+
 if user_question:
     if st.session_state.current_query is None:
-        st.session_state.current_query = get_sql_query(user_question)
+        status = st.empty()
+        try:
+            st.session_state.current_query = get_sql_query(
+                user_question, deadline=new_deadline(status, "Generating query"))
+        except (DeadlineExceeded, RequestCancelled) as e:
+            st.error(f"Query generation stopped: {str(e)}")
+            st.stop()
+        except Exception as e:
+            st.error(str(e))
+            st.stop()
+        finally:
+            status.empty()
     sql_query = st.session_state.current_query
 
     # Reset feedback state when a new query is generated
@@ -161,49 +531,25 @@ if user_question:
     
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("Execute Original Query", key='execute_main_query'):
-            try:
-                conn = get_database_connection()
-                df = pd.read_sql_query(sql_query, conn)
-                conn.close()
-                
-                # Display results
-                st.subheader("Query Results:")
-                st.dataframe(df)
-                
-                if not df.empty and len(df.columns) >= 2:
-                    st.bar_chart(df)
-                    
-            except Exception as e:
-                error_msg = str(e)
-                st.error(f"Error executing query: {error_msg}")
-                st.session_state.last_error = error_msg
+        results_section(sql_query, "Execute Original Query", 'execute_main_query',
+                        "Query Results:", "query", remember_error=True)
 
     with col2:
         if st.button("🔄 Regenerate Query", key="regenerate_query"):
+            regenerate_status = st.empty()
             try:
                 error_msg = st.session_state.get('last_error', None)
-                improved_query = get_improved_sql_query(user_question, sql_query, error_msg)
+                improved_query = get_improved_sql_query(
+                    user_question, sql_query, error_msg,
+                    deadline=new_deadline(regenerate_status, "Regenerating query"))
                 st.session_state.current_query = improved_query
                 st.rerun()
             except Exception as e:
                 st.error(f"Error regenerating query: {str(e)}")
+            finally:
+                regenerate_status.empty()
 
-    # Replace the expander section with:
-    st.markdown("### Save Query")
-    col3, col4 = st.columns(2)
-    with col3:
-        if st.button("👍 Save as Good Query", key="save_good_query"):
-            if save_query(user_question, sql_query, True):
-                st.success("Query saved successfully as good!")
-            else:
-                st.error("Failed to save query")
-    with col4:
-        if st.button("👎 Save as Bad Query", key="save_bad_query"):
-            if save_query(user_question, sql_query, False):
-                st.success("Query saved successfully as bad!")
-            else:
-                st.error("Failed to save query")
+    feedback_section(user_question, sql_query)
     
     # Check if there's an improved query in the session state
     if 'improved_query' in st.session_state:
@@ -211,28 +557,11 @@ if user_question:
         st.code(st.session_state.improved_query, language="sql")
         st.session_state.current_improved_query = st.session_state.improved_query
         
-        if st.button("Execute Improved Query", key='execute_improved_query_main'):
-            try:
-                conn = get_database_connection()
-                df = pd.read_sql_query(st.session_state.improved_query, conn)
-                conn.close()
-                
-                st.subheader("Improved Query Results:")
-                st.dataframe(df)
-                
-                if not df.empty and len(df.columns) >= 2:
-                    st.bar_chart(df)
-                
-            except Exception as e:
-                st.error(f"Error executing improved query: {str(e)}")
+        results_section(st.session_state.improved_query, "Execute Improved Query",
+                        'execute_improved_query_main', "Improved Query Results:",
+                        "improved query")
     
     # Store current query as previous query for next comparison
     st.session_state.previous_query = sql_query
 
-    st.markdown("### Save an Alternate Query")
-    alternate_query = st.text_area("Enter your alternate SQL query:")
-    if st.button("Save Alternate Query", key="save_alternate_query"):
-        if save_query(user_question, alternate_query, True):
-            st.success("Alternate query saved with feedback=1!")
-        else:
-            st.error("Failed to save alternate query")
+    alternate_query_section(user_question)
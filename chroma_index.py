@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import time
+
+from dotenv import load_dotenv
+
+# Load environment variables at startup
+load_dotenv()
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Per-collection HNSW settings live in a JSON file keyed by the persist
+# directory's name (e.g. "chroma_db_with_metadata"); anything not set there
+# falls back to these environment defaults.
+CHROMA_INDEX_CONFIG = os.getenv('CHROMA_INDEX_CONFIG', os.path.join(current_dir, 'chroma_index.json'))
+DEFAULT_HNSW = {
+    'space': os.getenv('CHROMA_HNSW_SPACE', 'l2'),
+    'M': int(os.getenv('CHROMA_HNSW_M', '16')),
+    'construction_ef': int(os.getenv('CHROMA_HNSW_CONSTRUCTION_EF', '100')),
+    'search_ef': int(os.getenv('CHROMA_HNSW_SEARCH_EF', '10')),
+}
+DEFAULT_COLLECTION = 'langchain'
+
+
+def load_config(path=None):
+    path = path or CHROMA_INDEX_CONFIG
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def hnsw_settings(persist_directory, config=None):
+    config = load_config() if config is None else config
+    settings = dict(DEFAULT_HNSW)
+    settings.update(config.get(os.path.basename(os.path.normpath(persist_directory)), {}))
+    return settings
+
+
+def collection_metadata(persist_directory, config=None):
+    # Pass as collection_metadata= when a collection is created. Only
+    # search_ef can change afterwards; the rest takes a rebuild.
+    return {f"hnsw:{key}": value for key, value in hnsw_settings(persist_directory, config).items()}
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def read_all(collection, batch_size):
+    ids, embeddings, documents, metadatas = [], [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(include=['embeddings', 'documents', 'metadatas'],
+                               limit=batch_size, offset=offset)
+        if not len(batch['ids']):
+            break
+        ids.extend(batch['ids'])
+        embeddings.extend(list(e) for e in batch['embeddings'])
+        documents.extend(batch['documents'])
+        metadatas.extend(batch['metadatas'])
+        offset += len(batch['ids'])
+    return ids, embeddings, documents, metadatas
+
+
+def exact_neighbours(np, vectors, query, k, space):
+    if space == 'ip':
+        scores = -(vectors @ query)
+    elif space == 'cosine':
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        scores = -(vectors @ query) / np.where(norms == 0, 1, norms)
+    else:
+        scores = ((vectors - query) ** 2).sum(axis=1)
+    return np.argsort(scores)[:k]
+
+
+def measure(collection, ids, embeddings, space, queries, k):
+    # Latency of the real index, and recall@k against a brute-force search
+    # over the same vectors, using stored embeddings as queries
+    import numpy as np
+
+    if not ids:
+        return {'queries': 0}
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    sample = random.Random(0).sample(range(len(ids)), min(queries, len(ids)))
+    k = min(k, len(ids))
+    latencies = []
+    hits = 0
+    for i in sample:
+        started = time.perf_counter()
+        result = collection.query(query_embeddings=[embeddings[i]], n_results=k, include=['distances'])
+        latencies.append(time.perf_counter() - started)
+        expected = {ids[j] for j in exact_neighbours(np, vectors, vectors[i], k, space)}
+        hits += len(expected & set(result['ids'][0]))
+    latencies.sort()
+    return {
+        'queries': len(sample),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0] * 1000, 2),
+        'recall_at_k': round(hits / (len(sample) * k), 4),
+    }
+
+
+SEGMENT_DIRECTORY_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def compact(persist_directory):
+    # Reclaims what the deleted collection leaves behind: free sqlite pages,
+    # and HNSW segment directories Chroma no longer references
+    conn = sqlite3.connect(os.path.join(persist_directory, 'chroma.sqlite3'))
+    try:
+        segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    for name in os.listdir(persist_directory):
+        path = os.path.join(persist_directory, name)
+        if os.path.isdir(path) and SEGMENT_DIRECTORY_PATTERN.match(name) and name not in segments:
+            shutil.rmtree(path)
+
+
+def report(label, persist_directory, count, metadata, metrics):
+    print(f"{label}: {count} vectors, {directory_size(persist_directory) / 1024 / 1024:.1f} MiB on disk")
+    print(f"  index: {json.dumps({k: v for k, v in (metadata or {}).items() if k.startswith('hnsw:')})}")
+    print(f"  latency: {json.dumps(metrics)}")
+
+
+def rebuild(persist_directory, collection_name=DEFAULT_COLLECTION, queries=200, k=10, dry_run=False):
+    # Offline: nothing else should have the store open while it is rewritten.
+    # Records are copied into a fresh collection built with the configured
+    # HNSW settings, which also drops the fragmentation left by appends.
+    import chromadb
+
+    client = chromadb.PersistentClient(path=persist_directory)
+    collection = client.get_collection(collection_name)
+    batch_size = client.get_max_batch_size() if hasattr(client, 'get_max_batch_size') else 5000
+
+    ids, embeddings, documents, metadatas = read_all(collection, batch_size)
+    old_space = (collection.metadata or {}).get('hnsw:space', 'l2')
+    report("before", persist_directory, len(ids), collection.metadata,
+           measure(collection, ids, embeddings, old_space, queries, k))
+
+    new_metadata = dict(collection.metadata or {})
+    new_metadata.update(collection_metadata(persist_directory))
+    if dry_run:
+        print(f"would rebuild with: {json.dumps(new_metadata)}")
+        return
+
+    temp_name = f"{collection_name}_rebuild"
+    try:
+        client.delete_collection(temp_name)
+    except Exception:
+        pass
+    rebuilt = client.create_collection(temp_name, metadata=new_metadata)
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        rebuilt.add(ids=ids[start:end], embeddings=embeddings[start:end],
+                    documents=documents[start:end], metadatas=metadatas[start:end])
+    if rebuilt.count() != len(ids):
+        raise RuntimeError(f"Rebuilt collection has {rebuilt.count()} records, expected {len(ids)}")
+
+    client.delete_collection(collection_name)
+    rebuilt.modify(name=collection_name)
+    del client, collection, rebuilt
+    compact(persist_directory)
+
+    client = chromadb.PersistentClient(path=persist_directory)
+    collection = client.get_collection(collection_name)
+    report("after", persist_directory, collection.count(), collection.metadata,
+           measure(collection, ids, embeddings, new_metadata.get('hnsw:space', 'l2'), queries, k))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild a persisted Chroma collection with the configured HNSW settings")
+    parser.add_argument('persist_directory', nargs='?',
+                        default=os.path.join(current_dir, 'db', 'chroma_db_with_metadata'))
+    parser.add_argument('--collection', default=DEFAULT_COLLECTION)
+    parser.add_argument('--queries', type=int, default=200, help="sampled queries for latency/recall")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--dry-run', action='store_true', help="only report the current index")
+    args = parser.parse_args()
+    rebuild(args.persist_directory, args.collection, queries=args.queries, k=args.k, dry_run=args.dry_run)
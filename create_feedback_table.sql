@@ -1,8 +1,16 @@
 CREATE TABLE query_feedback (
     auto_id BIGINT AUTO_INCREMENT,
     question TEXT NOT NULL,
+    -- SHA-256 of the normalized question (db.question_hash), used to look up verified SQL
+    question_hash CHAR(64) NULL,
     sql_query TEXT NOT NULL,
     feedback BOOLEAN NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    PRIMARY KEY (auto_id)
-);
\ No newline at end of file
+    PRIMARY KEY (auto_id),
+    KEY idx_question_hash (question_hash, feedback)
+);
+
+-- Existing tables: run `python db.py migrate-feedback`, which applies the
+-- statements below and backfills question_hash for older rows.
+-- ALTER TABLE query_feedback ADD COLUMN question_hash CHAR(64) NULL AFTER question;
+-- ALTER TABLE query_feedback ADD INDEX idx_question_hash (question_hash, feedback);
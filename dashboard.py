@@ -0,0 +1,203 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+
+import streamlit as st
+from dotenv import load_dotenv
+
+import db
+import render
+import rollups
+import sql_utils
+
+# Load environment variables at startup
+load_dotenv()
+
+# Process-wide bound on concurrently executing tiles, shared by all sessions
+DASHBOARD_WORKERS = int(os.getenv('DASHBOARD_WORKERS', '8'))
+DASHBOARD_TILE_TIMEOUT_SECONDS = float(os.getenv('DASHBOARD_TILE_TIMEOUT_SECONDS', '20'))
+DASHBOARD_REFRESH_SECONDS = int(os.getenv('DASHBOARD_REFRESH_SECONDS', '300'))
+# Extra time a tile may spend waiting for a free worker before it is given up on
+DASHBOARD_QUEUE_GRACE_SECONDS = float(os.getenv('DASHBOARD_QUEUE_GRACE_SECONDS', '10'))
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+
+
+def tile_key(sql_query):
+    return hashlib.sha1(sql_query.strip().encode('utf-8')).hexdigest()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_approved_queries(limit=50):
+    # Most recent approved SQL per question
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(db.APPROVED_QUERIES_SQL, (limit,))
+            return [{'question': question, 'sql': sql_query} for question, sql_query in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def table_versions(conn, tables):
+    # UPDATE_TIME and TABLE_ROWS per table; a tile is skipped only if every
+    # table it reads reports the same values as when it last ran
+    if not tables:
+        return {}
+    placeholders = ", ".join(["%s"] * len(tables))
+    with conn.cursor() as cursor:
+        # MySQL 8 caches these statistics for a day by default
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        cursor.execute(
+            "SELECT LOWER(TABLE_NAME), UPDATE_TIME, TABLE_ROWS FROM information_schema.TABLES "
+            f"WHERE TABLE_SCHEMA = DATABASE() AND LOWER(TABLE_NAME) IN ({placeholders})",
+            tuple(tables),
+        )
+        return {name: (str(update_time), rows) if update_time is not None else None
+                for name, update_time, rows in cursor.fetchall()}
+
+
+def tile_unchanged(cached, versions):
+    if cached is None or cached.get('error'):
+        return False
+    for table, version in cached['versions'].items():
+        if version is None or versions.get(table) != version:
+            return False
+    return bool(cached['versions'])
+
+
+def run_tile(sql_query, running):
+    key = tile_key(sql_query)
+    started = time.monotonic()
+    conn = db.get_read_connection(max_execution_ms=DASHBOARD_TILE_TIMEOUT_SECONDS * 1000)
+    running[key] = conn
+    try:
+        db.check_read_only(sql_query)
+        # Versions are read before the query so a concurrent write is picked up next time
+        try:
+            versions = table_versions(conn, sql_utils.referenced_tables(sql_query))
+        except Exception as e:
+            # Without versions the tile simply re-runs on every refresh
+            print("Could not read table versions:", e)
+            versions = {}
+        executed_sql, from_rollup = rollups.route(sql_query, conn)
+        result = render.load_result_set(conn, executed_sql)
+        # The log gets the statement's own time; the tile shows the whole refresh
+        db.log_execution(executed_sql, result['seconds'], rows=result['row_count'], source='dashboard')
+        result.update(versions=versions, from_rollup=from_rollup,
+                      seconds=time.monotonic() - started, refreshed_at=time.time())
+        return result
+    finally:
+        running.pop(key, None)
+        conn.close()
+
+
+def render_tile(container, tile, result, skipped):
+    with container.container(border=True):
+        st.markdown(f"**{tile['question']}**")
+        if result is None:
+            st.caption("Running...")
+            return
+        if result.get('error'):
+            st.error(result['error'])
+            return
+        notes = [f"{result['seconds'] * 1000:,.0f} ms", f"{result['row_count']:,} rows"]
+        if result['from_rollup']:
+            notes.append("rollup")
+        if skipped:
+            notes.append("unchanged since " + time.strftime('%H:%M:%S', time.localtime(result['refreshed_at'])))
+        st.caption(" · ".join(notes))
+        if result['chart'] is not None:
+            chart = result['chart'].set_index(result['chart'].columns[0])
+            if result['chart_kind'] == 'series':
+                st.line_chart(chart, height=220)
+            else:
+                st.bar_chart(chart, height=220)
+        else:
+            st.dataframe(result['first_page'], height=220)
+
+
+def refresh_tiles(tiles, cache, force=False):
+    columns = st.columns(2)
+    placeholders = {}
+    for i, tile in enumerate(tiles):
+        placeholders[tile_key(tile['sql'])] = columns[i % 2].empty()
+
+    # One metadata query decides which tiles can be served from the cache
+    versions = {}
+    if not force:
+        conn = db.get_read_connection()
+        try:
+            all_tables = sorted({t for tile in tiles for t in sql_utils.referenced_tables(tile['sql'])})
+            versions = table_versions(conn, all_tables)
+        except Exception as e:
+            print("Could not read table versions:", e)
+        finally:
+            conn.close()
+
+    running = {}
+    futures = {}
+    for tile in tiles:
+        key = tile_key(tile['sql'])
+        if not force and tile_unchanged(cache.get(key), versions):
+            render_tile(placeholders[key], tile, cache[key], skipped=True)
+            continue
+        render_tile(placeholders[key], tile, None, skipped=False)
+        futures[_executor.submit(run_tile, tile['sql'], running)] = tile
+
+    # Tiles are drawn as they finish, so the page takes as long as the slowest one
+    try:
+        for future in as_completed(futures, timeout=DASHBOARD_TILE_TIMEOUT_SECONDS + DASHBOARD_QUEUE_GRACE_SECONDS):
+            tile = futures[future]
+            key = tile_key(tile['sql'])
+            try:
+                cache[key] = future.result()
+            except Exception as e:
+                cache[key] = {'error': f"Error executing tile: {str(e)}"}
+            render_tile(placeholders[key], tile, cache[key], skipped=False)
+    except FutureTimeout:
+        for future, tile in futures.items():
+            if future.done():
+                continue
+            key = tile_key(tile['sql'])
+            future.cancel()
+            conn = running.get(key)
+            if conn is not None:
+                threading.Thread(target=db.kill_query, args=(conn,), daemon=True).start()
+            cache[key] = {'error': "Timed out"}
+            render_tile(placeholders[key], tile, cache[key], skipped=False)
+
+
+def render_dashboard():
+    st.title("Dashboard")
+    pinned = st.session_state.saved_queries
+    if 'dashboard_cache' not in st.session_state:
+        st.session_state.dashboard_cache = {}
+
+    with st.expander("Pinned queries", expanded=not pinned):
+        try:
+            approved = load_approved_queries()
+        except Exception as e:
+            approved = []
+            st.error(f"Could not load saved queries: {str(e)}")
+        options = {q['question']: q for q in approved}
+        for q in pinned:
+            options.setdefault(q['question'], q)
+        selected = st.multiselect("Queries marked good", list(options),
+                                  default=[q['question'] for q in pinned], key='dashboard_pins')
+        st.session_state.saved_queries = [options[question] for question in selected]
+
+    if not st.session_state.saved_queries:
+        st.info("Pin queries marked as good to build a dashboard.")
+        return
+
+    @st.fragment(run_every=DASHBOARD_REFRESH_SECONDS)
+    def tiles_fragment():
+        # Inside the fragment so scheduled reruns see the button as unclicked
+        force = st.button("Refresh now", key='dashboard_refresh')
+        refresh_tiles(st.session_state.saved_queries, st.session_state.dashboard_cache, force=force)
+        st.caption(f"Refreshes every {DASHBOARD_REFRESH_SECONDS}s; tiles whose tables are unchanged are not re-run.")
+
+    tiles_fragment()
@@ -0,0 +1,538 @@
+import argparse
+import bisect
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+import zlib
+
+from dotenv import load_dotenv
+
+import db
+import sql_utils
+from schema import COLUMNS
+
+# Load environment variables at startup
+load_dotenv()
+
+# Synthetic data never goes into the live tracker database
+DATAGEN_DATABASE = os.getenv('DATAGEN_DATABASE', 'tracker_synthetic')
+DATAGEN_SQLITE_PATH = os.getenv('DATAGEN_SQLITE_PATH', 'tracker_synthetic.sqlite3')
+# Rows per INSERT statement / executemany call
+DATAGEN_BATCH_SIZE = int(os.getenv('DATAGEN_BATCH_SIZE', '5000'))
+
+# Secondary indexes from model.txt, plus sessionId/timestamp on every child
+# table. Built after loading, which is much faster than maintaining them per row.
+INDEXES = {table: [('sessionId',), ('timestamp',)] for table in COLUMNS if table != 'sessions'}
+INDEXES['sessions'] = [('trackingId',), ('createdAt',)]
+
+# --- Distributions -----------------------------------------------------------
+
+# (utm_source, utm_medium, weight, campaigns, funnel multiplier); direct traffic has no UTM tags
+SOURCES = [
+    (None, None, 20, [], 1.2),
+    ('google', 'cpc', 30, ['brand_search', 'generic_search', 'shopping'], 1.1),
+    ('google', 'organic', 12, [], 1.0),
+    ('facebook', 'paid_social', 12, ['retargeting', 'lookalike', 'summer_sale'], 0.8),
+    ('instagram', 'paid_social', 8, ['influencer', 'stories'], 0.7),
+    ('tiktok', 'paid_social', 5, ['creator_collab'], 0.5),
+    ('newsletter', 'email', 6, ['weekly_digest', 'abandoned_cart'], 1.6),
+    ('bing', 'cpc', 3, ['generic_search'], 1.0),
+    ('partner_blog', 'referral', 4, ['affiliate'], 0.9),
+]
+SEARCH_TERMS = ['running shoes', 'wireless headphones', 'yoga mat', 'water bottle', 'backpack',
+                'smart watch', 'sunglasses', 'rain jacket', 'coffee grinder', 'desk lamp',
+                'phone case', 'bluetooth speaker', 'gift card', 'sale', 'kids shoes']
+
+# (device, weight, funnel multiplier, [(os, weight, [browsers])])
+DEVICES = [
+    ('mobile', 58, 0.8, [('Android', 55, ['Chrome', 'Samsung Internet', 'Firefox']),
+                         ('iOS', 45, ['Safari', 'Chrome'])]),
+    ('desktop', 36, 1.35, [('Windows', 65, ['Chrome', 'Edge', 'Firefox']),
+                           ('macOS', 30, ['Safari', 'Chrome', 'Firefox']),
+                           ('Linux', 5, ['Firefox', 'Chrome'])]),
+    ('tablet', 6, 1.0, [('iPadOS', 70, ['Safari']), ('Android', 30, ['Chrome'])]),
+]
+
+# (country, weight, currency, [(city, latitude, longitude)])
+COUNTRIES = [
+    ('United States', 38, 'USD', [('New York', 40.71, -74.01), ('Los Angeles', 34.05, -118.24),
+                                  ('Chicago', 41.88, -87.63), ('Austin', 30.27, -97.74)]),
+    ('United Kingdom', 12, 'GBP', [('London', 51.51, -0.13), ('Manchester', 53.48, -2.24)]),
+    ('India', 15, 'INR', [('Mumbai', 19.08, 72.88), ('Bengaluru', 12.97, 77.59), ('Delhi', 28.70, 77.10)]),
+    ('Germany', 8, 'EUR', [('Berlin', 52.52, 13.40), ('Munich', 48.14, 11.58)]),
+    ('France', 6, 'EUR', [('Paris', 48.86, 2.35), ('Lyon', 45.76, 4.84)]),
+    ('Canada', 7, 'CAD', [('Toronto', 43.65, -79.38), ('Vancouver', 49.28, -123.12)]),
+    ('Australia', 5, 'AUD', [('Sydney', -33.87, 151.21), ('Melbourne', -37.81, 144.96)]),
+    ('Brazil', 5, 'BRL', [('Sao Paulo', -23.55, -46.63)]),
+    ('Japan', 4, 'JPY', [('Tokyo', 35.68, 139.69)]),
+]
+CURRENCY_RATES = {'USD': 1.0, 'GBP': 0.79, 'INR': 83.0, 'EUR': 0.92, 'CAD': 1.36, 'AUD': 1.52,
+                  'BRL': 5.0, 'JPY': 150.0}
+
+PAGES = ['/', '/products', '/products/{id}', '/search', '/sale', '/blog', '/cart', '/account']
+
+# (eventName, eventType, weight)
+EVENT_TYPES = [
+    ('page_view', 'Navigation', 40), ('Click', 'UI Interaction', 25), ('Scroll', 'UI Interaction', 20),
+    ('video_play', 'Media', 3), ('filter_applied', 'UI Interaction', 6), ('share', 'Social', 1),
+    ('form_submit', 'Form', 2), ('error', 'System', 1), ('login', 'Account', 2),
+]
+
+# Funnel: share of sessions adding to cart, then the share of each stage
+# that reaches the next one; device and source multipliers scale the first step
+ADD_TO_CART_RATE = 0.12
+CHECKOUT_RATE = 0.45
+PAYMENT_RATE = 0.62
+CONVERSION_RATE = 0.80
+
+# Hour-of-day traffic shape (UTC), peaking in the evening
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 2, 3, 4, 5, 6, 6, 6, 7, 7, 6, 6, 6, 7, 8, 9, 9, 8, 6, 4]
+
+
+class Weighted:
+    # Fast weighted choice over a fixed list
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = list(itertools.accumulate(weights))
+        self.total = self.cumulative[-1]
+
+    def pick(self, rng):
+        return self.items[bisect.bisect_right(self.cumulative, rng.random() * self.total)]
+
+
+SOURCE_CHOICE = Weighted(SOURCES, [s[2] for s in SOURCES])
+DEVICE_CHOICE = Weighted(DEVICES, [d[1] for d in DEVICES])
+OS_CHOICES = {device[0]: Weighted(device[3], [o[1] for o in device[3]]) for device in DEVICES}
+COUNTRY_CHOICE = Weighted(COUNTRIES, [c[1] for c in COUNTRIES])
+EVENT_CHOICE = Weighted(EVENT_TYPES, [e[2] for e in EVENT_TYPES])
+HOUR_CHOICE = Weighted(range(24), HOUR_WEIGHTS)
+
+
+def build_catalog(seed, size=250):
+    # Products shared by every worker; prices are log-normal, in USD
+    rng = random.Random(seed)
+    adjectives = ['Classic', 'Ultra', 'Eco', 'Pro', 'Mini', 'Smart', 'Vintage', 'Sport', 'Urban', 'Travel']
+    nouns = ['Sneakers', 'Headphones', 'Backpack', 'Watch', 'Jacket', 'Mug', 'Lamp', 'Speaker',
+             'Bottle', 'Sunglasses', 'Mat', 'Grinder', 'Wallet', 'Hoodie', 'Charger']
+    catalog = []
+    for i in range(size):
+        name = f"{rng.choice(adjectives)} {rng.choice(nouns)} {rng.randint(1, 9)}"
+        catalog.append((f"prod_{i:05d}", name, round(min(2000.0, rng.lognormvariate(3.6, 0.8)), 2)))
+    # Zipf-like popularity: a few products get most of the attention
+    return Weighted(catalog, [1.0 / (rank + 1) ** 0.9 for rank in range(size)])
+
+
+def new_id(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def session_rows(rng, index, config, catalog, rows):
+    start = config['start']
+    # More traffic on recent days, as a growing site would see
+    day = int(config['days'] * rng.random() ** 0.85)
+    created = start + datetime.timedelta(days=day, hours=HOUR_CHOICE.pick(rng), minutes=rng.randrange(60),
+                                         seconds=rng.randrange(60))
+
+    # A share of sessions come from returning visitors; logged-in visitors have a userId
+    if rng.random() < 0.3 and index > 0:
+        visitor = rng.randrange(max(1, index // 3))
+    else:
+        visitor = index
+    tracking_id = f"trk_{(visitor * 2654435761) % (1 << 48):012x}"
+    user_id = f"user_{visitor}" if rng.random() < 0.35 else "anonymous"
+
+    source, medium, _, campaigns, source_multiplier = SOURCE_CHOICE.pick(rng)
+    campaign = rng.choice(campaigns) if campaigns else None
+    device, _, device_multiplier, _ = DEVICE_CHOICE.pick(rng)
+    os_name, _, browsers = OS_CHOICES[device].pick(rng)
+    country, _, currency, cities = COUNTRY_CHOICE.pick(rng)
+    city, latitude, longitude = rng.choice(cities)
+    rate = CURRENCY_RATES[currency]
+
+    session_id = new_id(rng)
+    cursor_seconds = 0
+
+    def step(max_gap):
+        nonlocal cursor_seconds
+        cursor_seconds += rng.randint(2, max_gap)
+        return created + datetime.timedelta(seconds=cursor_seconds)
+
+    def product():
+        product_id, name, price_usd = catalog.pick(rng)
+        return product_id, name, round(price_usd * rate, 2)
+
+    for _ in range(rng.randint(1, 4) if rng.random() < 0.55 else 0):
+        product_id, name, cost = product()
+        rows['feature_products'].append((new_id(rng), session_id, product_id, cost, currency, name, user_id, step(40)))
+    if rng.random() < 0.3:
+        for _ in range(rng.randint(1, 3)):
+            rows['search_bar'].append((new_id(rng), session_id, user_id, rng.choice(SEARCH_TERMS), step(60)))
+    if rng.random() < 0.07:
+        product_id, name, _ = product()
+        rows['add_to_favourites'].append((new_id(rng), session_id, user_id, f"/products/{product_id}", name,
+                                          product_id, step(90)))
+    if rng.random() < 0.04:
+        user_id = f"user_{visitor}"
+        rows['signup'].append((new_id(rng), session_id, user_id, step(120)))
+
+    # Funnel stages, each reached by a decaying share of the previous one
+    funnel_depth = 0
+    if rng.random() < ADD_TO_CART_RATE * device_multiplier * source_multiplier:
+        funnel_depth = 1
+        cart = [product() for _ in range(rng.choice((1, 1, 1, 2, 2, 3)))]
+        for product_id, name, cost in cart:
+            rows['add_to_cart'].append((new_id(rng), session_id, product_id, cost, currency, name, user_id, step(120)))
+        cart_value = round(sum(cost for _, _, cost in cart), 2)
+        product_ids = ','.join(product_id for product_id, _, _ in cart)
+        product_names = ', '.join(name for _, name, _ in cart)
+        if rng.random() < CHECKOUT_RATE:
+            funnel_depth = 2
+            rows['proceed_to_checkout'].append((new_id(rng), session_id, product_ids, cart_value, currency,
+                                                product_names, user_id, step(180)))
+            if rng.random() < PAYMENT_RATE:
+                funnel_depth = 3
+                paid_at = step(240)
+                rows['proceed_to_payment'].append((new_id(rng), session_id, product_ids, cart_value, currency,
+                                                   product_names, user_id, paid_at, paid_at, paid_at))
+                if rng.random() < CONVERSION_RATE:
+                    funnel_depth = 4
+                    converted_at = step(60)
+                    rows['conversions'].append((new_id(rng), session_id, 'Purchase', cart_value, converted_at,
+                                                converted_at, converted_at))
+
+    # Generic interaction events; deeper sessions are busier
+    event_count = 1 + int(rng.expovariate(1.0 / max(1.0, config['events_per_session'] - 1)) * (1 + 0.3 * funnel_depth))
+    event_seconds = max(cursor_seconds, 10)
+    for _ in range(event_count):
+        name, event_type, _ = EVENT_CHOICE.pick(rng)
+        at = created + datetime.timedelta(seconds=rng.randrange(event_seconds + 1))
+        data = json.dumps({'page': rng.choice(PAGES)}) if event_type in ('Navigation', 'UI Interaction') else None
+        rows['events'].append((new_id(rng), session_id, name, event_type, data, at, at, at))
+
+    time_spent = max(cursor_seconds, int(rng.lognormvariate(4.2, 1.0)))
+    entry_page = rng.choice(PAGES)
+    exit_page = '/checkout/complete' if funnel_depth == 4 else rng.choice(PAGES)
+    rows['sessions'].append((
+        session_id, tracking_id, entry_page, exit_page, time_spent, source, medium,
+        campaign, f"cmp_{zlib.crc32(campaign.encode()) % 100000}" if campaign else None,
+        rng.choice(SEARCH_TERMS) if medium == 'cpc' else None,
+        f"ad_{rng.randint(1, 12)}" if medium in ('cpc', 'paid_social') else None,
+        os_name, device, rng.choice(browsers),
+        round(longitude + rng.uniform(-0.2, 0.2), 5), round(latitude + rng.uniform(-0.2, 0.2), 5),
+        city, country, created, created + datetime.timedelta(seconds=time_spent),
+    ))
+
+
+def generate_chunk(config, chunk):
+    # Deterministic per chunk, so chunks can be generated in any order or process
+    rng = random.Random(config['seed'] * 1000003 + chunk)
+    catalog = build_catalog(config['seed'])
+    rows = {table: [] for table in COLUMNS}
+    start = chunk * config['chunk_size']
+    for index in range(start, min(start + config['chunk_size'], config['sessions'])):
+        session_rows(rng, index, config, catalog, rows)
+    return rows
+
+
+# --- Loading -----------------------------------------------------------------
+
+def insert_sql(table, placeholder):
+    columns = ', '.join(f"`{name}`" if placeholder == '%s' else f'"{name}"' for name, _ in COLUMNS[table])
+    values = ', '.join([placeholder] * len(COLUMNS[table]))
+    return f"INSERT INTO {table} ({columns}) VALUES ({values})"
+
+
+def sqlite_type(column_type):
+    for prefix, affinity in (('INT', 'INTEGER'), ('DOUBLE', 'REAL'), ('DECIMAL', 'NUMERIC')):
+        if column_type.startswith(prefix):
+            return column_type.replace(column_type.split()[0], affinity, 1)
+    return column_type.replace(column_type.split()[0], 'TEXT', 1)
+
+
+def create_statements(dialect):
+    statements = []
+    for table, columns in COLUMNS.items():
+        if dialect == 'mysql':
+            body = ', '.join(f"`{name}` {column_type}" for name, column_type in columns)
+            statements.append(f"CREATE TABLE IF NOT EXISTS {table} ({body}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+        else:
+            body = ', '.join(f'"{name}" {sqlite_type(column_type)}' for name, column_type in columns)
+            statements.append(f"CREATE TABLE IF NOT EXISTS {table} ({body})")
+    return statements
+
+
+def index_statements(dialect):
+    statements = []
+    for table, indexes in INDEXES.items():
+        for columns in indexes:
+            name = f"idx_{table}_{'_'.join(columns)}"
+            quoted = ', '.join(f"`{c}`" if dialect == 'mysql' else f'"{c}"' for c in columns)
+            if dialect == 'mysql':
+                statements.append(f"CREATE INDEX {name} ON {table} ({quoted})")
+            else:
+                statements.append(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({quoted})")
+    return statements
+
+
+def mysql_connection(database):
+    if database == os.getenv('DB_NAME'):
+        raise ValueError(f"Refusing to load synthetic data into the tracker database {database!r}")
+    return db.get_database_connection(db=database, local_infile=True, autocommit=False)
+
+
+def tsv_value(value):
+    # LOAD DATA's default format: tab separated, backslash escapes, \N for NULL
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    text = str(value)
+    if any(c in text for c in '\\\t\n'):
+        text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+    return text
+
+
+def load_data(conn, table, rows):
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8') as f:
+        for row in rows:
+            f.write('\t'.join(tsv_value(v) for v in row) + '\n')
+        path = f.name
+    try:
+        columns = ', '.join(f"`{name}`" for name, _ in COLUMNS[table])
+        with conn.cursor() as cursor:
+            cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 ({columns})", (path,))
+    finally:
+        os.remove(path)
+
+
+def insert_rows(conn, table, rows, placeholder='%s'):
+    # pymysql turns executemany on a plain INSERT ... VALUES into multi-row INSERTs
+    statement = insert_sql(table, placeholder)
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(rows), DATAGEN_BATCH_SIZE):
+            cursor.executemany(statement, rows[start:start + DATAGEN_BATCH_SIZE])
+    finally:
+        cursor.close()
+
+
+_worker_conn = None
+
+
+def mysql_worker(config, chunk):
+    # Each worker process generates a chunk and loads it over its own connection
+    global _worker_conn
+    if _worker_conn is None:
+        _worker_conn = mysql_connection(config['database'])
+        with _worker_conn.cursor() as cursor:
+            cursor.execute("SET SESSION unique_checks = 0, SESSION foreign_key_checks = 0")
+    rows = generate_chunk(config, chunk)
+    for table, table_rows in rows.items():
+        if not table_rows:
+            continue
+        if config['method'] == 'load-data':
+            load_data(_worker_conn, table, table_rows)
+        else:
+            insert_rows(_worker_conn, table, table_rows)
+    _worker_conn.commit()
+    return {table: len(table_rows) for table, table_rows in rows.items()}
+
+
+# Stored as 'YYYY-MM-DD HH:MM:SS' text, the format MySQL-style SQL compares against
+sqlite3.register_adapter(datetime.datetime, str)
+
+
+def sqlite_connection(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    return conn
+
+
+def run_chunks(pool, fn, config, chunks):
+    return pool.imap_unordered(_call, ((fn, config, chunk) for chunk in chunks))
+
+
+def _call(args):
+    fn, config, chunk = args
+    return fn(config, chunk)
+
+
+def generate(config, target, workers):
+    chunks = range((config['sessions'] + config['chunk_size'] - 1) // config['chunk_size'])
+    totals = dict.fromkeys(COLUMNS, 0)
+    started = time.monotonic()
+
+    if target == 'mysql':
+        conn = db.get_database_connection(db=None)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{config['database']}`")
+        finally:
+            conn.close()
+        conn = mysql_connection(config['database'])
+        with conn.cursor() as cursor:
+            for statement in create_statements('mysql'):
+                cursor.execute(statement)
+        conn.commit()
+    else:
+        conn = sqlite_connection(config['sqlite_path'])
+        for statement in create_statements('sqlite'):
+            conn.execute(statement)
+        conn.commit()
+
+    with multiprocessing.Pool(workers) as pool:
+        # SQLite allows one writer, so workers only generate and this process loads
+        fn = mysql_worker if target == 'mysql' else generate_chunk
+        for done, result in enumerate(run_chunks(pool, fn, config, chunks), 1):
+            if target == 'sqlite':
+                for table, table_rows in result.items():
+                    if table_rows:
+                        conn.executemany(insert_sql(table, '?'), table_rows)
+                conn.commit()
+                result = {table: len(table_rows) for table, table_rows in result.items()}
+            for table, count in result.items():
+                totals[table] += count
+            if done % 10 == 0 or done == len(chunks):
+                elapsed = time.monotonic() - started
+                loaded = sum(totals.values())
+                print(f"{done}/{len(chunks)} chunks, {loaded:,} rows, {loaded / elapsed:,.0f} rows/s")
+
+    print("Building indexes...")
+    index_started = time.monotonic()
+    for statement in index_statements(target):
+        try:
+            if target == 'mysql':
+                with conn.cursor() as cursor:
+                    cursor.execute(statement)
+            else:
+                conn.execute(statement)
+        except Exception as e:
+            # Re-running against an existing database: the index is already there
+            print(f"Skipped index: {e}")
+    conn.commit()
+    conn.close()
+    return {'rows': totals, 'seconds': round(time.monotonic() - started, 1),
+            'index_seconds': round(time.monotonic() - index_started, 1)}
+
+
+# --- Benchmarking ------------------------------------------------------------
+
+def load_benchmark_queries(args):
+    queries = []
+    if args.sql_file:
+        with open(args.sql_file, encoding='utf-8') as f:
+            queries.extend({'question': None, 'sql': part.strip()} for part in f.read().split(';') if part.strip())
+    if args.from_feedback:
+        # The SQL users approved in the app
+        conn = db.get_read_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(db.APPROVED_QUERIES_SQL, (args.from_feedback,))
+                queries.extend({'question': q, 'sql': s} for q, s in cursor.fetchall())
+        finally:
+            conn.close()
+    if args.questions:
+        # Freshly generated SQL, exactly as the app would produce it
+        from llm import get_sql_query
+        with open(args.questions, encoding='utf-8') as f:
+            for question in (line.strip() for line in f if line.strip()):
+                queries.append({'question': question, 'sql': get_sql_query(question)})
+    return queries
+
+
+def bench(args):
+    queries = load_benchmark_queries(args)
+    if not queries:
+        raise SystemExit("No queries: pass --sql-file, --from-feedback or --questions")
+    if args.target == 'mysql':
+        conn = mysql_connection(args.database)
+        db.set_execution_time(conn, args.timeout * 1000)
+    else:
+        conn = sqlite_connection(args.sqlite_path)
+
+    results = []
+    for query in queries:
+        result = {'question': query['question'], 'sql': query['sql']}
+        if not sql_utils.is_read_only(query['sql']):
+            result['error'] = "not a read-only query"
+            results.append(result)
+            continue
+        timings = []
+        try:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                cursor = conn.cursor()
+                cursor.execute(query['sql'])
+                rows = cursor.fetchall()
+                cursor.close()
+                timings.append(time.perf_counter() - started)
+            result.update(rows=len(rows), min_ms=round(min(timings) * 1000, 1),
+                          median_ms=round(statistics.median(timings) * 1000, 1))
+        except Exception as e:
+            result['error'] = str(e)
+        results.append(result)
+        label = query['question'] or query['sql'][:60].replace('\n', ' ')
+        print(f"{result.get('median_ms', '-'):>10} ms  {result.get('rows', '-'):>8} rows  {label}"
+              + (f"  ERROR: {result['error']}" if 'error' in result else ''))
+    conn.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic tracker data and benchmark SQL against it")
+    parser.add_argument('--target', choices=['mysql', 'sqlite'], default='sqlite')
+    parser.add_argument('--database', default=DATAGEN_DATABASE, help="MySQL database to create and fill")
+    parser.add_argument('--sqlite-path', default=DATAGEN_SQLITE_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="Create the tables and load synthetic data")
+    generate_parser.add_argument('--sessions', type=int, default=100000)
+    generate_parser.add_argument('--events-per-session', type=float, default=20.0,
+                                 help="mean events rows per session; sessions x this is the events table size")
+    generate_parser.add_argument('--days', type=int, default=90)
+    generate_parser.add_argument('--end-date', default=datetime.date.today().isoformat())
+    generate_parser.add_argument('--chunk-size', type=int, default=5000, help="sessions per work unit")
+    generate_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    generate_parser.add_argument('--method', choices=['insert', 'load-data'], default='insert',
+                                 help="MySQL loading: multi-row INSERTs or LOAD DATA LOCAL INFILE")
+    generate_parser.add_argument('--seed', type=int, default=42)
+
+    bench_parser = subparsers.add_parser('bench', help="Time queries against the synthetic data")
+    bench_parser.add_argument('--sql-file', help="semicolon-separated SQL statements")
+    bench_parser.add_argument('--from-feedback', type=int, metavar='N', help="latest N approved queries")
+    bench_parser.add_argument('--questions', help="one question per line, turned into SQL by the app's LLM")
+    bench_parser.add_argument('--repeat', type=int, default=3)
+    bench_parser.add_argument('--timeout', type=int, default=300, help="per-query limit in seconds (MySQL)")
+    bench_parser.add_argument('--output', help="write results as JSON lines")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        end = datetime.datetime.fromisoformat(args.end_date)
+        config = {
+            'sessions': args.sessions,
+            'events_per_session': args.events_per_session,
+            'days': args.days,
+            'start': end - datetime.timedelta(days=args.days),
+            'chunk_size': args.chunk_size,
+            'seed': args.seed,
+            'method': args.method,
+            'database': args.database,
+            'sqlite_path': args.sqlite_path,
+        }
+        print(json.dumps(generate(config, args.target, args.workers), indent=2))
+    else:
+        bench(args)
@@ -0,0 +1,329 @@
+import hashlib
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+import pymysql.cursors
+from dotenv import load_dotenv
+
+import sql_utils
+
+# Load environment variables at startup
+load_dotenv()
+
+INSERT_FEEDBACK_SQL = (
+    "INSERT INTO query_feedback (question, question_hash, sql_query, feedback) VALUES (%s, %s, %s, %s)"
+)
+# Most recent SQL approved for a question and never marked bad. Served by
+# idx_question_hash, so it reads only the rows for that one question.
+VERIFIED_QUERY_SQL = """
+    SELECT sql_query,
+           SUM(feedback = 1) AS approvals,
+           MAX(CASE WHEN feedback = 1 THEN auto_id END) AS last_approved
+    FROM query_feedback
+    WHERE question_hash = %s
+    GROUP BY sql_query
+    HAVING approvals > 0 AND SUM(feedback = 0) = 0
+    ORDER BY last_approved DESC
+    LIMIT 1
+"""
+# Latest approved SQL per question, newest first (the dashboard tiles and
+# datagen's benchmark)
+APPROVED_QUERIES_SQL = """
+    SELECT q.question, q.sql_query
+    FROM query_feedback q
+    JOIN (
+        SELECT question, MAX(auto_id) AS auto_id
+        FROM query_feedback
+        WHERE feedback = 1
+        GROUP BY question
+    ) latest ON latest.auto_id = q.auto_id
+    ORDER BY q.auto_id DESC
+    LIMIT %s
+"""
+MIGRATE_FEEDBACK_STATEMENTS = [
+    "ALTER TABLE query_feedback ADD COLUMN question_hash CHAR(64) NULL AFTER question",
+    "ALTER TABLE query_feedback ADD INDEX idx_question_hash (question_hash, feedback)",
+]
+
+# Comma-separated host[:port] list for generated (read-only) SQL; falls back
+# to the primary when unset.
+DB_REPLICA_HOSTS = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+# Server-side budget for a single read query, in milliseconds
+DB_MAX_EXECUTION_MS = int(os.getenv('DB_MAX_EXECUTION_MS', '30000'))
+# Connect timeout for the side connection that sends KILL QUERY, in seconds;
+# short, since a kill that can't get through quickly is no longer useful
+DB_KILL_CONNECT_TIMEOUT = float(os.getenv('DB_KILL_CONNECT_TIMEOUT', '5'))
+# JSON lines record of executed generated SQL and its runtime, read by
+# index_advisor.py; set to an empty string to disable
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', 'query_log.jsonl')
+# Past this size the log is moved to <path>.1 (replacing the previous one),
+# so at most twice this much is kept on disk
+QUERY_LOG_MAX_BYTES = int(os.getenv('QUERY_LOG_MAX_BYTES', str(20 * 1024 * 1024)))
+
+
+class ReadOnlyViolation(ValueError):
+    pass
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+def get_connection_params():
+    return {
+        'host': os.getenv('DB_HOST'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'db': os.getenv('DB_NAME')
+    }
+
+
+def get_database_connection(**overrides):
+    # Primary connection; only feedback writes should use this directly
+    connection_params = get_connection_params()
+    connection_params.update(overrides)
+    return pymysql.connect(**connection_params)
+
+
+get_write_connection = get_database_connection
+
+_replica_cycle = itertools.cycle(DB_REPLICA_HOSTS) if DB_REPLICA_HOSTS else None
+_replica_lock = threading.Lock()
+
+
+def get_replica_params():
+    connection_params = get_connection_params()
+    if os.getenv('DB_REPLICA_USER'):
+        connection_params['user'] = os.getenv('DB_REPLICA_USER')
+        connection_params['password'] = os.getenv('DB_REPLICA_PASSWORD')
+    if _replica_cycle is not None:
+        with _replica_lock:
+            host = next(_replica_cycle)
+        host, _, port = host.partition(':')
+        connection_params['host'] = host
+        if port:
+            connection_params['port'] = int(port)
+    return connection_params
+
+
+def get_read_connection(max_execution_ms=None, **overrides):
+    connection_params = get_replica_params()
+    connection_params.update(overrides)
+    # Enforced by the server, so even SQL that slips past is_read_only()
+    # cannot write, and runaway SELECTs are aborted after the budget.
+    connection_params['init_command'] = (
+        "SET SESSION transaction_read_only = 1, "
+        f"SESSION max_execution_time = {int(max_execution_ms or DB_MAX_EXECUTION_MS)}"
+    )
+    return pymysql.connect(**connection_params)
+
+
+def check_read_only(sql_query):
+    if not sql_utils.is_read_only(sql_query):
+        raise ReadOnlyViolation("Only a single read-only SELECT statement can be executed")
+
+
+def execution_budget_ms(remaining_ms):
+    # A request deadline can only tighten the runaway-query cap, never lift it
+    return max(1, min(int(remaining_ms), DB_MAX_EXECUTION_MS))
+
+
+def set_execution_time(conn, max_execution_ms):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SET SESSION max_execution_time = {max(1, int(max_execution_ms))}")
+
+
+def kill_query(conn):
+    # KILL QUERY has to come from a second connection to the same server,
+    # as the same account, otherwise with the usual connection settings
+    connection_params = get_connection_params()
+    connection_params.update(host=conn.host, port=conn.port, user=conn.user, password=conn.password,
+                             connect_timeout=DB_KILL_CONNECT_TIMEOUT)
+    killer = pymysql.connect(**connection_params)
+    try:
+        with killer.cursor() as cursor:
+            cursor.execute("KILL QUERY %s", (conn.thread_id(),))
+    finally:
+        killer.close()
+
+
+def run_cancellable(conn, fn, should_cancel=None, poll_interval=0.2):
+    # Runs fn() on a worker thread. While it runs the caller polls
+    # should_cancel(); if that returns True or raises (a passed deadline, or
+    # Streamlit stopping the script), the statement is killed server-side.
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = fn()
+        except BaseException as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(poll_interval)
+            if worker.is_alive() and should_cancel is not None and should_cancel():
+                raise QueryCancelled("Query cancelled")
+    except BaseException:
+        try:
+            kill_query(conn)
+        except Exception as e:
+            print("Failed to kill query:", e)
+        worker.join(5)
+        raise
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+class ConnectionPool:
+    # Small thread-safe pool so long-lived processes (Streamlit, the API)
+    # reuse connections instead of paying a TCP + auth handshake per query.
+    def __init__(self, max_size=None, connect=None):
+        self.max_size = max_size or int(os.getenv('DB_POOL_SIZE', '4'))
+        self.connect = connect or get_database_connection
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.max_size)
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+                conn.ping(reconnect=True)
+            except queue.Empty:
+                conn = self.connect()
+            try:
+                yield conn
+            except BaseException:
+                # Connection state is unknown after a failure, don't reuse it
+                conn.close()
+                raise
+            self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def normalize_question(question):
+    # Case, surrounding punctuation and whitespace don't change the question
+    return re.sub(r"\s+", " ", question).strip().strip("?!.").strip().lower()
+
+
+def question_hash(question):
+    return hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()
+
+
+def find_verified_query(question, conn):
+    with conn.cursor() as cursor:
+        cursor.execute(VERIFIED_QUERY_SQL, (question_hash(question),))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def migrate_feedback_table(conn, batch_size=1000):
+    # Adds the hash column and index to an existing table, then backfills
+    # rows written before it existed. Safe to re-run.
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                       "AND TABLE_NAME = 'query_feedback' AND COLUMN_NAME = 'question_hash'")
+        if not cursor.fetchone()[0]:
+            for statement in MIGRATE_FEEDBACK_STATEMENTS:
+                cursor.execute(statement)
+        backfilled = 0
+        while True:
+            cursor.execute("SELECT auto_id, question FROM query_feedback WHERE question_hash IS NULL LIMIT %s",
+                           (batch_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany("UPDATE query_feedback SET question_hash = %s WHERE auto_id = %s",
+                               [(question_hash(question), auto_id) for auto_id, question in rows])
+            conn.commit()
+            backfilled += len(rows)
+    conn.commit()
+    return backfilled
+
+
+_query_log_lock = threading.Lock()
+
+
+def log_execution(sql_query, seconds, rows=None, error=None, source=None):
+    if not QUERY_LOG_PATH:
+        return
+    entry = {'at': time.time(), 'source': source, 'sql': sql_query, 'seconds': round(seconds, 4),
+             'rows': rows, 'error': error}
+    try:
+        with _query_log_lock:
+            if QUERY_LOG_MAX_BYTES and os.path.exists(QUERY_LOG_PATH) \
+                    and os.path.getsize(QUERY_LOG_PATH) >= QUERY_LOG_MAX_BYTES:
+                os.replace(QUERY_LOG_PATH, QUERY_LOG_PATH + '.1')
+            with open(QUERY_LOG_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print("Could not write query log:", e)
+
+
+def save_query(question, query, is_good, conn=None):
+    owns_connection = conn is None
+    if owns_connection:
+        conn = get_write_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(INSERT_FEEDBACK_SQL, (question, question_hash(question), query, 1 if is_good else 0))
+        conn.commit()
+    finally:
+        if owns_connection:
+            conn.close()
+    return True
+
+
+def open_streaming_cursor(sql_query, max_execution_ms=None, should_cancel=None):
+    # Unbuffered server-side cursor on a replica: rows stay on the server
+    # until fetched, so callers can page through large results with fetchmany().
+    # With should_cancel, the statement is killed if that turns true while
+    # MySQL is still working on it (see run_cancellable).
+    check_read_only(sql_query)
+    conn = get_read_connection(max_execution_ms, cursorclass=pymysql.cursors.SSCursor)
+    try:
+        cursor = conn.cursor()
+        if should_cancel is None:
+            cursor.execute(sql_query)
+        else:
+            run_cancellable(conn, lambda: cursor.execute(sql_query), should_cancel)
+    except BaseException:
+        conn.close()
+        raise
+    columns = [col[0] for col in cursor.description or []]
+    return conn, cursor, columns
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('migrate-feedback', help="Add and backfill query_feedback.question_hash")
+    args = parser.parse_args()
+
+    conn = get_write_connection()
+    try:
+        print(f"Backfilled {migrate_feedback_table(conn)} rows")
+    finally:
+        conn.close()
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+# Load environment variables at startup
+load_dotenv()
+
+# Upper bound on a whole user request (enhance + generate, or execute)
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '60'))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class Deadline:
+    # Shared time budget for one request. Each stage asks for remaining()
+    # and blocking waits call tick() periodically, which raises once the
+    # budget is spent or cancel() has been called from elsewhere.
+
+    def __init__(self, seconds=None, on_tick=None, owner=None, priority=None):
+        self.budget = seconds if seconds is not None else REQUEST_DEADLINE_SECONDS
+        self.started = time.monotonic()
+        self.expires_at = self.started + self.budget
+        # Called on every tick; in Streamlit this redraws a status line, which
+        # is also where Streamlit interrupts a script the user has stopped.
+        self.on_tick = on_tick
+        self._cancelled = threading.Event()
+        # Who the request is for and how urgent it is: the LLM admission
+        # queue shares capacity between owners and serves interactive work first
+        self.owner = owner
+        self.priority = priority
+        # What the request is currently waiting on, for on_tick to show
+        self.waiting = None
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self):
+        return int(self.remaining() * 1000)
+
+    def allows(self, seconds):
+        # Whether an optional stage needing `seconds` still fits
+        return not self.cancelled and self.remaining() >= seconds
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled("Request cancelled")
+        if self.expired:
+            raise DeadlineExceeded(f"Request exceeded its {self.budget:.0f}s budget")
+
+    def tick(self):
+        if self.on_tick is not None:
+            self.on_tick(self)
+        self.check()
+        return False
@@ -4,6 +4,8 @@ from langchain_community.document_loaders import TextLoader
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 
+import chroma_index
+
 # Define the directory containing the text file and the persistent directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 file_path = os.path.join(current_dir, "documents", "lord_of_the_rings.txt")
@@ -41,8 +43,10 @@ if not os.path.exists(persistent_directory):
 
     # Create the vector store and persist it automatically
     print("\n--- Creating vector store ---")
+    # HNSW settings come from chroma_index.json; see chroma_index.py to rebuild
     db = Chroma.from_documents(
-        docs, embeddings, persist_directory=persistent_directory)
+        docs, embeddings, persist_directory=persistent_directory,
+        collection_metadata=chroma_index.collection_metadata(persistent_directory))
     print("\n--- Finished creating vector store ---")
 
 else:
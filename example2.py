@@ -2,6 +2,8 @@ import os
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 
+from retrieval_cache import CachedRetriever
+
 # Define the persistent directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 persistent_directory = os.path.join(current_dir, "db", "chroma_db")
@@ -17,9 +19,12 @@ db = Chroma(persist_directory=persistent_directory,
 query = "Where does Gandalf meet Frodo?"
 
 # Retrieve relevant documents based on the query
-retriever = db.as_retriever(
+# Cached by query and collection version; re-running a question skips the embedding call
+retriever = CachedRetriever(
+    db,
+    persist_directory=persistent_directory,
     search_type="similarity_score_threshold",
-    search_kwargs={"k": 10, "score_threshold": 0.9}, 
+    search_kwargs={"k": 10, "score_threshold": 0.9},
 )
 relevant_docs = retriever.invoke(query)
 
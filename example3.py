@@ -2,14 +2,20 @@ import os
 
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.document_loaders import TextLoader
-from langchain_community.vectorstores import Chroma
+from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 
+import chroma_index
+import partitions
+
 # Define the directory containing the text files and the persistent directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 books_dir = os.path.join(current_dir, "documents")
 db_dir = os.path.join(current_dir, "db")
 persistent_directory = os.path.join(db_dir, "chroma_db_with_metadata")
+# Optional per-source collections, searched by example4.py when present
+partitioned_directory = os.path.join(db_dir, "chroma_db_partitioned")
+partition_by_source = os.getenv("PARTITION_BY_SOURCE", "false").lower() in ("1", "true", "yes")
 
 print(f"Books directory: {books_dir}")
 print(f"Persistent directory: {persistent_directory}")
@@ -55,9 +61,20 @@ if not os.path.exists(persistent_directory):
 
     # Create the vector store and persist it
     print("\n--- Creating and persisting vector store ---")
+    # HNSW settings come from chroma_index.json; see chroma_index.py to rebuild
     db = Chroma.from_documents(
-        docs, embeddings, persist_directory=persistent_directory)
+        docs, embeddings, persist_directory=persistent_directory,
+        collection_metadata=chroma_index.collection_metadata(persistent_directory))
     print("\n--- Finished creating and persisting vector store ---")
 
 else:
-    print("Vector store already exists. No need to initialize.")
\ No newline at end of file
+    print("Vector store already exists. No need to initialize.")
+
+# Partitions are copied from the main store, so they can be added to an
+# existing store later without embedding anything again
+if partition_by_source and not os.path.exists(partitioned_directory):
+    print("\n--- Creating per-source partitions ---")
+    partitions.build(persistent_directory, partitioned_directory)
+    print("\n--- Finished creating per-source partitions ---")
+elif partition_by_source:
+    print("Partitioned store already exists. No need to initialize.")
@@ -2,30 +2,42 @@ import os
 
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
+
+from partitions import PartitionedSearch, load_manifest
+from retrieval_cache import CachedRetriever
 
 # Define the persistent directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 db_dir = os.path.join(current_dir, "db")
 persistent_directory = os.path.join(db_dir, "chroma_db_with_metadata")
+partitioned_directory = os.path.join(db_dir, "chroma_db_partitioned")
 
 # Define the embedding model
 embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
 
-# Load the existing vector store with the embedding function
-db = Chroma(persist_directory=persistent_directory,
-            embedding_function=embeddings)
-
 # Define the user's question
 query = "Where is Dracula's castle located?"
 
-# Retrieve relevant documents based on the query
-retriever = db.as_retriever(
-    search_type="similarity_score_threshold",
-    search_kwargs={"k": 3, "score_threshold": 0.2},
-)
+search_kwargs = {"k": 3, "score_threshold": 0.2}
+if load_manifest(partitioned_directory) is not None:
+    # Per-source collections from example3.py: only the partitions the
+    # question is about are searched
+    retriever = PartitionedSearch(partitioned_directory, embeddings, search_kwargs=search_kwargs)
+else:
+    # Load the existing vector store with the embedding function
+    db = Chroma(persist_directory=persistent_directory,
+                embedding_function=embeddings)
+
+    # Cached by query and collection version; re-running a question skips the embedding call
+    retriever = CachedRetriever(
+        db,
+        persist_directory=persistent_directory,
+        search_type="similarity_score_threshold",
+        search_kwargs=search_kwargs,
+    )
 relevant_docs = retriever.invoke(query)
+if isinstance(retriever, PartitionedSearch):
+    print(f"Searched partitions: {retriever.last_route}")
 
 # Display the relevant results with metadata
 print("\n--- Relevant Documents ---")
@@ -43,6 +55,8 @@ for i, doc in enumerate(relevant_docs, 1):
 # )
 
 # # Create a ChatOpenAI model
+# from langchain_openai import ChatOpenAI
+# from langchain.schema import HumanMessage, SystemMessage
 # model = ChatOpenAI(model="gpt-4o")
 
 # # Define the messages for the model
@@ -0,0 +1,259 @@
+import argparse
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import os
+import re
+import tempfile
+import time
+
+from dotenv import load_dotenv
+from pymysql.constants import FIELD_TYPE
+
+import db
+
+# Load environment variables at startup
+load_dotenv()
+
+# Rows fetched from the server-side cursor per round trip; for parquet this is
+# also the row group size, so it bounds the memory an export can use.
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '50000'))
+# Exports stream for much longer than interactive queries
+EXPORT_MAX_EXECUTION_MS = int(os.getenv('EXPORT_MAX_EXECUTION_MS', '1800000'))
+
+# Exports prepared by the app are written here and downloaded through the
+# API's /exports/{id}/download, so both processes must see this directory
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'sql-exports'))
+# Base URL of the API as the user's browser reaches it
+EXPORT_DOWNLOAD_URL = os.getenv('EXPORT_DOWNLOAD_URL', 'http://localhost:8080')
+
+FORMATS = {
+    'csv': {'extension': '.csv', 'mime': 'text/csv'},
+    'csv.gz': {'extension': '.csv.gz', 'mime': 'application/gzip'},
+    'parquet': {'extension': '.parquet', 'mime': 'application/vnd.apache.parquet'},
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def prepared_path(export_id, output_format):
+    # export_id is a random hex token; anything else never names a file
+    if not re.fullmatch(r"[0-9a-f]{32}", export_id or '') or output_format not in FORMATS:
+        raise ValueError("Invalid export id")
+    return os.path.join(EXPORT_DIR, export_id + FORMATS[output_format]['extension'])
+
+
+def find_prepared(export_id):
+    # (path, format) of a prepared export, or None
+    for output_format in FORMATS:
+        try:
+            path = prepared_path(export_id, output_format)
+        except ValueError:
+            return None
+        if os.path.exists(path):
+            return path, output_format
+    return None
+
+
+def download_url(export_id):
+    return f"{EXPORT_DOWNLOAD_URL.rstrip('/')}/exports/{export_id}/download"
+
+
+class ExportProgress:
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+        # Set from another thread to stop the export at its next write
+        self.cancelled = False
+
+    def as_dict(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'seconds': round(elapsed, 1),
+            'rows_per_second': round(self.rows / elapsed) if elapsed else 0,
+            'done': self.finished is not None,
+            'error': self.error,
+        }
+
+
+class CountingSink(io.RawIOBase):
+    # Wraps the destination so bytes written are tracked for progress reporting;
+    # pyarrow also needs tell() on non-seekable outputs. Closing the sink
+    # leaves the caller's destination open.
+    def __init__(self, raw, progress):
+        super().__init__()
+        self.raw = raw
+        self.progress = progress
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.progress.cancelled:
+            raise ExportCancelled("Export cancelled")
+        self.raw.write(data)
+        self.position += len(data)
+        self.progress.bytes = self.position
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        if hasattr(self.raw, 'flush'):
+            self.raw.flush()
+
+
+def iter_batches(sql_query, batch_size=None, progress=None):
+    # Yields the cursor description, then lists of rows, never holding more
+    # than one batch in memory. Cancelling the progress kills the statement
+    # even before the first row arrives.
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    should_cancel = (lambda: progress.cancelled) if progress is not None else None
+    try:
+        conn, cursor, _ = db.open_streaming_cursor(sql_query, max_execution_ms=EXPORT_MAX_EXECUTION_MS,
+                                                   should_cancel=should_cancel)
+    except db.QueryCancelled:
+        raise ExportCancelled("Export cancelled")
+    try:
+        yield cursor.description
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        conn.close()
+
+
+def csv_value(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def export_csv(sql_query, destination, compress=False, progress=None, batch_size=None):
+    progress = progress or ExportProgress()
+    sink = CountingSink(destination, progress)
+    binary = gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=6) if compress else sink
+    text = io.TextIOWrapper(binary, encoding='utf-8', newline='', write_through=True)
+    try:
+        batches = iter_batches(sql_query, batch_size, progress)
+        writer = csv.writer(text)
+        writer.writerow([col[0] for col in next(batches)])
+        for rows in batches:
+            writer.writerows([csv_value(v) for v in row] for row in rows)
+            progress.rows += len(rows)
+        text.flush()
+    except Exception as e:
+        progress.error = str(e)
+        raise
+    finally:
+        # Don't let the wrapper close the caller's destination
+        text.detach()
+    if compress:
+        # Writes the gzip trailer; the destination itself stays open
+        binary.close()
+    progress.finished = time.monotonic()
+    return progress
+
+
+def arrow_type(pa, field):
+    name, type_code, _, _, precision, scale, _ = field
+    if type_code in (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24,
+                     FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR):
+        return pa.int64()
+    if type_code in (FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE):
+        return pa.float64()
+    if type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL):
+        # precision is the display width, so it over-counts digits; that only
+        # errs towards the wider type. MySQL allows up to 65 digits, more
+        # than decimal128 holds; without decimal256 they are written as text.
+        scale = int(scale or 0)
+        if int(precision or 0) <= 38:
+            return pa.decimal128(38, scale)
+        if hasattr(pa, 'decimal256'):
+            return pa.decimal256(76, scale)
+        return pa.string()
+    if type_code in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+        return pa.date32()
+    if type_code in (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP):
+        return pa.timestamp('us')
+    if type_code == FIELD_TYPE.TIME:
+        return pa.duration('us')
+    if type_code == FIELD_TYPE.BIT:
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_value(value, type_is_string):
+    if type_is_string and isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    if type_is_string and isinstance(value, (decimal.Decimal, datetime.date, datetime.timedelta)):
+        return str(value)
+    return value
+
+
+def export_parquet(sql_query, destination, compression='zstd', progress=None, batch_size=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    progress = progress or ExportProgress()
+    sink = CountingSink(destination, progress)
+    writer = None
+    try:
+        batches = iter_batches(sql_query, batch_size, progress)
+        description = next(batches)
+        schema = pa.schema([(field[0], arrow_type(pa, field)) for field in description])
+        string_columns = [pa.types.is_string(field.type) for field in schema]
+        writer = pq.ParquetWriter(sink, schema, compression=compression)
+        for rows in batches:
+            # Each fetched batch becomes one row group
+            columns = [
+                pa.array([arrow_value(row[i], string_columns[i]) for row in rows], type=schema.field(i).type)
+                for i in range(len(schema))
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            progress.rows += len(rows)
+        writer.close()
+        writer = None
+        progress.finished = time.monotonic()
+    except Exception as e:
+        progress.error = str(e)
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+    return progress
+
+
+def export(sql_query, destination, output_format, progress=None, batch_size=None):
+    if output_format == 'parquet':
+        return export_parquet(sql_query, destination, progress=progress, batch_size=batch_size)
+    if output_format in ('csv', 'csv.gz'):
+        return export_csv(sql_query, destination, compress=output_format == 'csv.gz',
+                          progress=progress, batch_size=batch_size)
+    raise ValueError(f"Unsupported export format: {output_format}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a query result to a CSV or Parquet file")
+    parser.add_argument('sql')
+    parser.add_argument('output')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    args = parser.parse_args()
+
+    progress = ExportProgress()
+    with open(args.output, 'wb') as f:
+        export(args.sql, f, args.format, progress=progress)
+    print(progress.as_dict())
@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+from dotenv import load_dotenv
+
+import db
+import sql_utils
+from schema import COLUMNS, MODEL_INDEXES
+
+# Load environment variables at startup
+load_dotenv()
+
+# Composite indexes wider than this rarely pay for their write cost
+MAX_INDEX_COLUMNS = int(os.getenv('INDEX_ADVISOR_MAX_COLUMNS', '3'))
+# Ignore candidates carrying less than this share of the total workload weight
+MIN_WEIGHT_SHARE = float(os.getenv('INDEX_ADVISOR_MIN_SHARE', '0.02'))
+
+RESERVED = {'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'ON', 'USING', 'GROUP', 'ORDER',
+            'LIMIT', 'HAVING', 'UNION', 'AS', 'SET', 'STRAIGHT_JOIN', 'NATURAL', 'WINDOW', 'FOR'}
+
+TABLE_ALIAS_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+(?:`?\w+`?\.)?`?([A-Za-z_]\w*)`?(?:\s+(?:AS\s+)?`?([A-Za-z_]\w*)`?)?", re.I)
+REF = r"(?:`?([A-Za-z_]\w*)`?\s*\.\s*)?`?([A-Za-z_]\w*)`?"
+JOIN_PATTERN = re.compile(rf"{REF}\s*=\s*{REF}")
+EQUALITY_PATTERN = re.compile(rf"{REF}\s*(?:=|<=>|\bIN\s*\(|\bIS\s+NULL\b)", re.I)
+RANGE_PATTERN = re.compile(rf"{REF}\s*(?:<=|>=|<>|!=|<|>|\bBETWEEN\b|\bLIKE\b)", re.I)
+# DATE(ts) = '...' or YEAR(ts) >= ... still narrows on ts
+FUNCTION_RANGE_PATTERN = re.compile(
+    rf"\b(?:DATE|YEAR|MONTH|DAY|WEEK|HOUR|DATE_FORMAT|UNIX_TIMESTAMP)\s*\(\s*{REF}[^()]*\)\s*(?:=|<|>|\bBETWEEN\b|\bIN\b)",
+    re.I)
+GROUP_BY_PATTERN = re.compile(r"\bGROUP\s+BY\s+(.*?)(?=\bHAVING\b|\bORDER\b|\bLIMIT\b|\bWINDOW\b|\)|;|$)", re.I | re.S)
+CLAUSE_PATTERN = re.compile(r"\b(?:ON|WHERE|AND|OR|HAVING|WHEN|NOT)\b|\(", re.I)
+
+SCHEMA_COLUMNS = {table: {name.lower(): name for name, _ in columns} for table, columns in COLUMNS.items()}
+
+
+class QueryShape:
+    # Columns one query uses per table, by role
+    def __init__(self):
+        self.equality = defaultdict(set)
+        self.range = defaultdict(set)
+        self.group = defaultdict(list)
+
+
+def alias_map(text):
+    aliases = {}
+    for table, alias in TABLE_ALIAS_PATTERN.findall(text):
+        table = table.lower()
+        if table not in SCHEMA_COLUMNS:
+            continue
+        aliases[table] = table
+        if alias and alias.upper() not in RESERVED:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def resolve(qualifier, column, aliases):
+    column = column.lower()
+    if qualifier:
+        table = aliases.get(qualifier.lower())
+        if table and column in SCHEMA_COLUMNS[table]:
+            return table, SCHEMA_COLUMNS[table][column]
+        return None
+    # Unqualified: only if exactly one table in the query has the column
+    owners = {table for table in aliases.values() if column in SCHEMA_COLUMNS[table]}
+    if len(owners) == 1:
+        table = owners.pop()
+        return table, SCHEMA_COLUMNS[table][column]
+    return None
+
+
+def predicate_text(text):
+    # Only the parts of the query after ON/WHERE/HAVING; select lists and
+    # GROUP BY are handled separately
+    parts = re.split(r"\b(?:ON|WHERE|HAVING)\b", text, flags=re.I)
+    return ' AND '.join(parts[1:])
+
+
+def extract(sql_query):
+    text = sql_utils.normalize(sql_query)
+    aliases = alias_map(text)
+    shape = QueryShape()
+    if not aliases:
+        return shape
+    predicates = predicate_text(text)
+
+    for left_q, left_c, right_q, right_c in JOIN_PATTERN.findall(predicates):
+        left = resolve(left_q, left_c, aliases)
+        right = resolve(right_q, right_c, aliases)
+        # Column = column is a join; each side is probed with equality
+        if left and right:
+            shape.equality[left[0]].add(left[1])
+            shape.equality[right[0]].add(right[1])
+    for qualifier, column in EQUALITY_PATTERN.findall(predicates):
+        ref = resolve(qualifier, column, aliases)
+        if ref:
+            shape.equality[ref[0]].add(ref[1])
+    for pattern in (RANGE_PATTERN, FUNCTION_RANGE_PATTERN):
+        for qualifier, column in pattern.findall(predicates):
+            ref = resolve(qualifier, column, aliases)
+            if ref and ref[1] not in shape.equality[ref[0]]:
+                shape.range[ref[0]].add(ref[1])
+
+    for group_list in GROUP_BY_PATTERN.findall(text):
+        for item in sql_utils.split_top_level(group_list, group_list, re.compile(',')):
+            match = re.fullmatch(rf"\s*(?:\w+\s*\(\s*)?{REF}\s*\)?\s*", item)
+            if not match:
+                continue
+            ref = resolve(match.group(1), match.group(2), aliases)
+            if ref and ref[1] not in shape.group[ref[0]]:
+                shape.group[ref[0]].append(ref[1])
+    return shape
+
+
+def load_workload(conn=None, log_path=None, include_feedback=True):
+    # (sql, weight) pairs. Each logged execution counts once plus its runtime
+    # in seconds, so slow queries pull harder; approved feedback SQL counts once.
+    workload = []
+    log_path = log_path or db.QUERY_LOG_PATH
+    # The rotated-out log (see QUERY_LOG_MAX_BYTES) is still recent workload
+    for path in (log_path + '.1', log_path) if log_path else ():
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('sql') and not entry.get('error'):
+                    workload.append((entry['sql'], 1.0 + float(entry.get('seconds') or 0)))
+    if include_feedback and conn is not None:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT sql_query FROM query_feedback WHERE feedback = 1")
+            workload.extend((sql_query, 1.0) for (sql_query,) in cursor.fetchall())
+    return [(sql_query, weight) for sql_query, weight in workload if sql_utils.is_read_only(sql_query)]
+
+
+def existing_indexes(conn=None):
+    if conn is None:
+        return {table: list(indexes) for table, indexes in MODEL_INDEXES.items()}
+    indexes = defaultdict(lambda: defaultdict(list))
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT LOWER(TABLE_NAME), INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX")
+        for table, index_name, column in cursor.fetchall():
+            indexes[table][index_name].append(column)
+    return {table: [tuple(columns) for columns in by_name.values()] for table, by_name in indexes.items()}
+
+
+def covered(columns, indexes):
+    # An index whose leading columns are these (in any order for the
+    # equality part) already serves the same lookups
+    lowered = [c.lower() for c in columns]
+    for index in indexes:
+        prefix = [c.lower() for c in index[:len(lowered)]]
+        if len(prefix) == len(lowered) and set(prefix[:-1]) == set(lowered[:-1]) and prefix[-1] == lowered[-1]:
+            return True
+    return False
+
+
+def propose(workload, indexes=None):
+    indexes = indexes or {}
+    frequency = Counter()
+    shapes = []
+    for sql_query, weight in workload:
+        shape = extract(sql_query)
+        shapes.append((sql_query, weight, shape))
+        for table, columns in shape.equality.items():
+            for column in columns:
+                frequency[(table, column)] += weight
+
+    candidates = defaultdict(lambda: {'weight': 0.0, 'queries': 0, 'example': None})
+    total = sum(weight for _, weight in workload) or 1.0
+    for sql_query, weight, shape in shapes:
+        for table in set(shape.equality) | set(shape.range) | set(shape.group):
+            # Equality columns first (most common first), then one range
+            # column, the usual composite index ordering rule
+            equality = sorted(shape.equality.get(table, ()), key=lambda c: (-frequency[(table, c)], c))
+            equality = [c for c in equality if c != 'id']
+            ranges = sorted(shape.range.get(table, ()))
+            keys = []
+            if equality or ranges:
+                keys.append(tuple(equality[:MAX_INDEX_COLUMNS - 1] + ranges[:1])[:MAX_INDEX_COLUMNS])
+            group = [c for c in shape.group.get(table, ()) if c not in equality]
+            if group:
+                keys.append(tuple(equality + group)[:MAX_INDEX_COLUMNS])
+            # A range key and a group key can come out the same; count the query once
+            for key in dict.fromkeys(keys):
+                if not key:
+                    continue
+                candidate = candidates[(table, key)]
+                candidate['weight'] += weight
+                candidate['queries'] += 1
+                candidate['example'] = candidate['example'] or sql_query
+
+    # A candidate that is a prefix of a heavier one is served by it
+    proposals = []
+    for (table, key), info in sorted(candidates.items(), key=lambda item: -item[1]['weight']):
+        if covered(key, indexes.get(table, [])):
+            continue
+        absorbed = False
+        for proposal in proposals:
+            if proposal['table'] == table and proposal['columns'][:len(key)] == key:
+                proposal['weight'] += info['weight']
+                proposal['queries'] += info['queries']
+                absorbed = True
+                break
+        if absorbed or info['weight'] / total < MIN_WEIGHT_SHARE:
+            continue
+        proposals.append({'table': table, 'columns': key, **info})
+    for proposal in proposals:
+        proposal['share'] = round(proposal['weight'] / total, 3)
+    return proposals
+
+
+def index_name(table, columns):
+    return f"idx_{table}_{'_'.join(c.lower() for c in columns)}"[:64]
+
+
+def ddl(proposal):
+    columns = ', '.join(f"`{c}`" for c in proposal['columns'])
+    return f"CREATE INDEX {index_name(proposal['table'], proposal['columns'])} ON {proposal['table']} ({columns});"
+
+
+def explain_cost(conn, sql_query):
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN FORMAT=JSON " + sql_query)
+        plan = json.loads(cursor.fetchone()[0])
+    return float(plan['query_block'].get('cost_info', {}).get('query_cost', 0))
+
+
+def validate(conn, proposal, workload):
+    # Builds the index, compares optimizer cost for the queries that wanted
+    # it, then drops it again. Meant for a copy of the data such as the
+    # datagen database, not the live tracker.
+    queries = [sql_query for sql_query, _ in workload if proposal['table'] in sql_utils.referenced_tables(sql_query)]
+    queries = list(dict.fromkeys(queries))[:20]
+    before = {}
+    for sql_query in queries:
+        try:
+            before[sql_query] = explain_cost(conn, sql_query)
+        except Exception:
+            continue
+    name = index_name(proposal['table'], proposal['columns'])
+    columns = ', '.join(f"`{c}`" for c in proposal['columns'])
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE INDEX {name} ON {proposal['table']} ({columns})")
+    try:
+        after = {sql_query: explain_cost(conn, sql_query) for sql_query in before}
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP INDEX {name} ON {proposal['table']}")
+    cost_before = sum(before.values())
+    cost_after = sum(after.values())
+    return {
+        'explained': len(before),
+        'cost_before': round(cost_before, 1),
+        'cost_after': round(cost_after, 1),
+        'improvement': round(1 - cost_after / cost_before, 3) if cost_before else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose indexes from the SQL the app generates and runs")
+    parser.add_argument('--log', default=db.QUERY_LOG_PATH, help="query log written by the app and API")
+    parser.add_argument('--no-feedback', action='store_true', help="skip SQL stored in query_feedback")
+    parser.add_argument('--offline', action='store_true',
+                        help="don't connect; use the log and the indexes declared in model.txt")
+    parser.add_argument('--validate-database', metavar='DB',
+                        help="build each index in this database (e.g. the datagen copy) and compare EXPLAIN costs")
+    parser.add_argument('--ddl', metavar='FILE', help="write CREATE INDEX statements to FILE")
+    args = parser.parse_args()
+
+    conn = None if args.offline else db.get_read_connection()
+    try:
+        workload = load_workload(conn, args.log, include_feedback=not args.no_feedback)
+        proposals = propose(workload, existing_indexes(conn))
+    finally:
+        if conn is not None:
+            conn.close()
+
+    print(f"{len(workload)} queries analysed, {len(proposals)} indexes proposed")
+    validation_conn = None
+    if args.validate_database:
+        if args.validate_database == os.getenv('DB_NAME'):
+            raise SystemExit("Refusing to build trial indexes in the tracker database")
+        validation_conn = db.get_database_connection(db=args.validate_database)
+    try:
+        for proposal in proposals:
+            print(f"\n{proposal['table']}({', '.join(proposal['columns'])})  "
+                  f"share={proposal['share']}  queries={proposal['queries']}")
+            print(f"  {ddl(proposal)}")
+            if validation_conn is not None:
+                print(f"  explain: {validate(validation_conn, proposal, workload)}")
+    finally:
+        if validation_conn is not None:
+            validation_conn.close()
+
+    if args.ddl:
+        with open(args.ddl, 'w', encoding='utf-8') as f:
+            for proposal in proposals:
+                f.write(ddl(proposal) + '\n')
+        print(f"\nWrote {len(proposals)} statements to {args.ddl}")
@@ -1,19 +1,147 @@
-from langchain_openai import ChatOpenAI
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
+
+import admission
+import db
+import model_router
+from deadline import DeadlineExceeded, RequestCancelled
 
 # Load environment variables at startup
 load_dotenv()
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
-
+# Enhancement is optional: skip it unless this much of the request budget is left
+ENHANCE_MIN_REMAINING_SECONDS = float(os.getenv('ENHANCE_MIN_REMAINING_SECONDS', '20'))
+# and never let it take more than this
+ENHANCE_TIMEOUT_SECONDS = float(os.getenv('ENHANCE_TIMEOUT_SECONDS', '8'))
+# How often a waiting caller checks its deadline
+TICK_SECONDS = 0.25
+# Answer questions that already have approved SQL from query_feedback
+VERIFIED_LOOKUP_ENABLED = os.getenv('VERIFIED_LOOKUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+VERIFIED_LOOKUP_TIMEOUT_MS = int(os.getenv('VERIFIED_LOOKUP_TIMEOUT_MS', '2000'))
+# Retries inside the client fire straight back at the provider and turn a
+# burst into a storm, so they are off by default; throttled calls are
+# retried through the admission queue instead.
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '0'))
+LLM_THROTTLE_RETRIES = int(os.getenv('LLM_THROTTLE_RETRIES', '2'))
+
+@lru_cache(maxsize=None)
+def get_llm(model=None):
+    # Built once per process and model, and shared by every caller. The SDK
+    # import is the slowest part of loading this module, so it waits until
+    # a client is actually needed.
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=model or model_router.TIERS[model_router.STANDARD]['model'],
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=LLM_MAX_RETRIES,
+        # other params...
+    )
+
+def warm_up():
+    # Called in the background once the UI is up, so the first question
+    # doesn't pay for the imports and client construction
+    try:
+        get_llm(model_router.TIERS[model_router.FAST]['model'])
+        get_llm(model_router.TIERS[model_router.STANDARD]['model'])
+    except Exception as e:
+        print("LLM warm-up failed:", e)
+
+@lru_cache(maxsize=None)
+def _feedback_pool():
+    # A couple of warm replica connections, so a lookup is a single round trip
+    # Socket timeouts keep an unreachable replica from stalling generation
+    timeout = VERIFIED_LOOKUP_TIMEOUT_MS / 1000
+    return db.ConnectionPool(max_size=2,
+                             connect=lambda: db.get_read_connection(VERIFIED_LOOKUP_TIMEOUT_MS,
+                                                                    connect_timeout=timeout,
+                                                                    read_timeout=timeout,
+                                                                    write_timeout=timeout))
+
+def lookup_verified_query(question, deadline=None):
+    if not VERIFIED_LOOKUP_ENABLED:
+        return None
+    if deadline is not None and not deadline.allows(VERIFIED_LOOKUP_TIMEOUT_MS / 1000):
+        # Not enough budget left to risk a slow lookup before generating
+        return None
+    try:
+        with _feedback_pool().connection() as conn:
+            return db.find_verified_query(question, conn)
+    except Exception as e:
+        # The lookup is only a shortcut; fall back to generating
+        print("Verified query lookup failed:", e)
+        return None
+
+@lru_cache(maxsize=None)
+def _llm_loop():
+    # One long-lived event loop for async LLM calls, so the async client stays
+    # bound to a single loop and in-flight requests can be cancelled.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='llm-loop', daemon=True).start()
+    return loop
+
+def invoke_llm(messages, deadline=None, timeout=None, tier=model_router.STANDARD):
+    # Every call is admitted by the process-wide controller for its model,
+    # which keeps all sessions together under the provider's quota
+    model = model_router.TIERS[tier]['model']
+    gate = admission.controller(model)
+    owner = deadline.owner if deadline is not None else None
+    priority = (deadline.priority if deadline is not None else None) or admission.INTERACTIVE
+    tokens = admission.estimate_tokens(messages)
+    started = time.monotonic()
+    response = None
+    try:
+        for attempt in range(LLM_THROTTLE_RETRIES + 1):
+            ticket = gate.acquire(tokens, owner, priority, deadline)
+            try:
+                response = _invoke(get_llm(model), messages, deadline, timeout)
+            except Exception as e:
+                if not admission.is_throttled(e) or attempt == LLM_THROTTLE_RETRIES:
+                    raise
+                print(f"{model} throttled, retrying through the queue:", e)
+                gate.record_throttle()
+                continue
+            finally:
+                ticket.settle(response)
+            gate.record_success()
+            return response
+    finally:
+        model_router.stats.record_call(tier, time.monotonic() - started, response, error=response is None)
+
+def _invoke(client, messages, deadline, timeout):
+    if deadline is None and timeout is None:
+        return client.invoke(messages)
+
+    budget = deadline.remaining() if deadline is not None else timeout
+    if timeout is not None:
+        budget = min(budget, timeout)
+    if budget <= 0:
+        raise DeadlineExceeded("No time left for the LLM call")
+
+    future = asyncio.run_coroutine_threadsafe(client.ainvoke(messages), _llm_loop())
+    ends_at = time.monotonic() + budget
+    try:
+        while True:
+            try:
+                return future.result(timeout=min(TICK_SECONDS, max(0.0, ends_at - time.monotonic())))
+            except FutureTimeout:
+                if deadline is not None:
+                    deadline.tick()
+                if time.monotonic() >= ends_at:
+                    raise DeadlineExceeded(f"LLM call exceeded its {budget:.1f}s budget")
+    except BaseException:
+        # Cancelling the task aborts the HTTP request to the provider
+        future.cancel()
+        raise
+
+# from langchain_openai import ChatOpenAI
 # llm = ChatOpenAI(
 #     model="gpt-4o-mini",
 #     temperature=0,
@@ -249,7 +377,10 @@ This schema **enables comprehensive user journey tracking**, supporting analytic
 
 """
 
-def enhance_question(question):
+def enhance_question(question, deadline=None):
+    if deadline is not None and not deadline.allows(ENHANCE_MIN_REMAINING_SECONDS):
+        print("Skipping question enhancement, remaining budget is", deadline.remaining())
+        return question
     messages = [
         ("system", """You are an expert at reformulating questions to be more precise and SQL-friendly. 
         Enhance the given question to be more specific and detailed, while maintaining its core intent.
@@ -257,15 +388,64 @@ def enhance_question(question):
         ("human", question)
     ]
     try:
-        response = llm.invoke(messages)
+        # A rewrite never needs more than the cheapest model
+        response = invoke_llm(messages, deadline,
+                              timeout=ENHANCE_TIMEOUT_SECONDS if deadline is not None else None,
+                              tier=model_router.FAST)
         return response.content.strip()
+    except RequestCancelled:
+        raise
     except Exception as e:
-        # If enhancement fails, return original question
+        # If enhancement fails or runs out of time, return original question
         return question
 
-def get_sql_query(question):
+def clean_sql(content):
+    # Strip the prefixes and code fences models like to wrap SQL in
+    sql_query = content.strip()
+    if sql_query.upper().startswith('SQL:'):
+        sql_query = sql_query[4:].strip()
+    if sql_query.startswith('```sql'):
+        sql_query = sql_query[6:].strip()
+    if sql_query.startswith('```'):
+        sql_query = sql_query[3:].strip()
+    if sql_query.endswith('```'):
+        sql_query = sql_query[:-3].strip()
+    return sql_query
+
+def generate_sql(messages, tier, deadline=None, escalated=False):
+    # Starts at the routed tier and moves up only while the generated SQL
+    # fails local validation, so easy questions stay on the cheap model
+    sql_query = None
+    while True:
+        try:
+            sql_query = clean_sql(invoke_llm(messages, deadline, tier=tier).content)
+        except DeadlineExceeded:
+            if sql_query is None:
+                raise
+            # Out of time: hand back the earlier attempt and let execution decide
+            break
+        problem = model_router.validate_sql(sql_query)
+        next_tier = model_router.escalate(tier)
+        if problem is None or next_tier == tier:
+            break
+        print(f"Escalating from {model_router.TIERS[tier]['name']} tier:", problem)
+        model_router.stats.record_escalation('validation', first=not escalated)
+        escalated = True
+        tier = next_tier
+    model_router.stats.remember(sql_query, tier)
+    return sql_query
+
+def get_sql_query(question, deadline=None):
+    # A question users already approved SQL for needs no model call
+    verified = lookup_verified_query(question, deadline)
+    if verified is not None:
+        model_router.stats.record_verified()
+        return verified
+
+    tier = model_router.classify(question)
+    model_router.stats.record_request()
     # First enhance the question
-    enhanced_question = enhance_question(question)
+    enhanced_question = enhance_question(question, deadline)
     print("enhanced_question",enhanced_question)
     messages = [
         ("system", f"You are an SQL expert. Generate ONLY the SQL query that works for mysql dialect without using any fancy function, this sql query will be executed and the result will  be directly shown to a user so make the response insighful, or without any text or 'SQL:' prefix. {SCHEMA}"),
@@ -273,27 +453,16 @@ def get_sql_query(question):
     ]
     
     try:
-        print("messages is", messages)
-        response = llm.invoke(messages)
-        # Clean and extract just the SQL query
-        sql_query = response.content.strip()
-        
-        if sql_query.upper().startswith('SQL:'):
-            sql_query = sql_query[4:].strip()
-
-        print("sql_nmxbcmxz1", sql_query)
-        if sql_query.startswith('```sql'):
-            sql_query = sql_query[6:].strip()
-        if sql_query.startswith('```'):
-            sql_query = sql_query[3:].strip()
-        if sql_query.endswith('```'):
-            sql_query = sql_query[:-3].strip()
+        print("messages is", messages, "tier", model_router.TIERS[tier]['name'])
+        sql_query = generate_sql(messages, tier, deadline)
         print("sql_nmxbcmxz2", sql_query)    
         return sql_query
+    except (DeadlineExceeded, RequestCancelled):
+        raise
     except Exception as e:
         raise Exception(f"Error generating SQL query: {str(e)}")
 
-def get_improved_sql_query(question, original_query, error_message=None):
+def get_improved_sql_query(question, original_query, error_message=None, deadline=None):
     error_context = f"\nPrevious error: {error_message}" if error_message else ""
     
     messages = [
@@ -305,25 +474,23 @@ def get_improved_sql_query(question, original_query, error_message=None):
         {SCHEMA}"""),
         ("human", "Please generate an improved version of this SQL query.")
     ]
+
+    # Retry on the tier that wrote the original; a query that failed to
+    # execute goes one tier up
+    tier = model_router.stats.origin(original_query)
+    if tier is None:
+        tier = model_router.classify(question)
+    model_router.stats.record_request()
+    escalated = bool(error_message) and model_router.escalate(tier) != tier
+    if escalated:
+        model_router.stats.record_escalation('execution')
+        tier = model_router.escalate(tier)
     
     try:
-        response = llm.invoke(messages)
-        sql_query = response.content.strip()
-        
-        # Remove any SQL: prefix
-        print("sql_nmxbcmxz0", sql_query)
-        if sql_query.upper().startswith('SQL:'):
-            sql_query = sql_query[4:].strip()
-            
-        # Handle code blocks
-        print("sql_nmxbcmxz1", sql_query)
-        if sql_query.startswith('```sql'):
-            sql_query = sql_query[6:].strip()
-        if sql_query.startswith('```'):
-            sql_query = sql_query[3:].strip()
-        if sql_query.endswith('```'):
-            sql_query = sql_query[:-3].strip()
+        sql_query = generate_sql(messages, tier, deadline, escalated)
         print("sql_nmxbcmxz2", sql_query)    
         return sql_query
+    except (DeadlineExceeded, RequestCancelled):
+        raise
     except Exception as e:
         raise Exception(f"Error generating improved SQL query: {str(e)}")
\ No newline at end of file
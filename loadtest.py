@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+# Load test for api.py: N concurrent clients hammer one endpoint for a fixed
+# duration and we report throughput, latency percentiles and shed load.
+#
+#   python api.py &
+#   python loadtest.py --clients 150 --duration 30 --endpoint execute --sql "SELECT 1"
+#   python loadtest.py --clients 150 --duration 60 --endpoint generate --output loadtest_results.jsonl
+#
+# Latency percentiles cover 200 responses only, so a run against a server
+# without its database or LLM reports no latencies at all. Record numbers
+# from a deployment that has both.
+
+DEFAULT_PAYLOADS = {
+    'execute': lambda args: {'sql': args.sql, 'format': 'ndjson'},
+    'generate': lambda args: {'question': args.question, 'priority': args.priority},
+    'feedback': lambda args: {'question': args.question, 'sql': args.sql, 'is_good': True},
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def client(session, url, payload, stop_at, results):
+    while time.monotonic() < stop_at:
+        started = time.monotonic()
+        try:
+            async with session.post(url, json=payload) as response:
+                # Drain the full (possibly streamed) body so timing covers it
+                await response.read()
+                status = response.status
+        except Exception:
+            status = 'error'
+        results.append((status, time.monotonic() - started))
+
+
+async def run(args):
+    url = f"{args.base_url.rstrip('/')}/{args.endpoint}"
+    payload = DEFAULT_PAYLOADS[args.endpoint](args)
+    results = []
+    connector = aiohttp.TCPConnector(limit=args.clients)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.monotonic()
+        stop_at = started + args.duration
+        await asyncio.gather(*(client(session, url, payload, stop_at, results)
+                               for _ in range(args.clients)))
+        elapsed = time.monotonic() - started
+
+    ok_latencies = [latency for status, latency in results if status == 200]
+    by_status = {}
+    for status, _ in results:
+        by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+    return {
+        'endpoint': args.endpoint,
+        'clients': args.clients,
+        'duration_seconds': round(elapsed, 2),
+        'requests': len(results),
+        'successful': len(ok_latencies),
+        'throughput_rps': round(len(ok_latencies) / elapsed, 1) if elapsed else 0.0,
+        'status_counts': by_status,
+        'latency_ms': {
+            'mean': round(statistics.mean(ok_latencies) * 1000, 1) if ok_latencies else 0.0,
+            'p50': round(percentile(ok_latencies, 50) * 1000, 1),
+            'p95': round(percentile(ok_latencies, 95) * 1000, 1),
+            'p99': round(percentile(ok_latencies, 99) * 1000, 1),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test for the SQL API")
+    parser.add_argument('--base-url', default='http://localhost:8080')
+    parser.add_argument('--endpoint', choices=sorted(DEFAULT_PAYLOADS), default='execute')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--sql', default='SELECT COUNT(*) FROM sessions')
+    parser.add_argument('--question', default='How many sessions were there yesterday?')
+    parser.add_argument('--priority', choices=['interactive', 'batch'], default='interactive',
+                        help="admission priority for generate requests")
+    parser.add_argument('--output', help="append the result, with a timestamp, to this JSON lines file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        # One line per run, so results can be compared across changes
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), **result}) + '\n')
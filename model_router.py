@@ -0,0 +1,192 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import sql_utils
+
+# Load environment variables at startup
+load_dotenv()
+
+# Cheapest first. Prices are USD per million tokens and only feed the cost
+# estimate in RouterStats; override them when the provider's pricing changes.
+TIERS = [
+    {
+        'name': 'fast',
+        'model': os.getenv('ROUTER_FAST_MODEL', 'gemini-2.0-flash-lite'),
+        'input_cost': float(os.getenv('ROUTER_FAST_INPUT_COST', '0.075')),
+        'output_cost': float(os.getenv('ROUTER_FAST_OUTPUT_COST', '0.30')),
+    },
+    {
+        'name': 'standard',
+        'model': os.getenv('ROUTER_STANDARD_MODEL', 'gemini-2.0-flash'),
+        'input_cost': float(os.getenv('ROUTER_STANDARD_INPUT_COST', '0.10')),
+        'output_cost': float(os.getenv('ROUTER_STANDARD_OUTPUT_COST', '0.40')),
+    },
+    {
+        'name': 'strong',
+        'model': os.getenv('ROUTER_STRONG_MODEL', 'gemini-2.5-pro'),
+        'input_cost': float(os.getenv('ROUTER_STRONG_INPUT_COST', '1.25')),
+        'output_cost': float(os.getenv('ROUTER_STRONG_OUTPUT_COST', '10.0')),
+    },
+]
+FAST, STANDARD, STRONG = range(len(TIERS))
+
+# Set to false to send everything to the standard tier, as before the router
+ROUTER_ENABLED = os.getenv('ROUTER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Difficulty scores at or above these thresholds go to the standard / strong tier
+STANDARD_THRESHOLD = int(os.getenv('ROUTER_STANDARD_THRESHOLD', '2'))
+STRONG_THRESHOLD = int(os.getenv('ROUTER_STRONG_THRESHOLD', '5'))
+
+SCHEMA_TABLES = ('sessions', 'signup', 'search_bar', 'proceed_to_payment', 'proceed_to_checkout',
+                 'feature_products', 'events', 'conversions', 'add_to_favourites', 'add_to_cart')
+
+# Words in a question that point at each table
+TABLE_HINTS = {
+    'sessions': r"sessions?|visits?|visitors?|traffic|utm|campaigns?|devices?|browsers?|countr(?:y|ies)|cit(?:y|ies)|time spent|landing|entry page|exit page",
+    'signup': r"sign ?ups?|registrations?|registered",
+    'search_bar': r"search(?:es|ed)?|search terms?|keywords?",
+    'proceed_to_payment': r"payments?|paid|purchases?|orders?|revenue",
+    'proceed_to_checkout': r"checkouts?|check out",
+    'feature_products': r"featured|feature products?|promoted",
+    'events': r"events?|clicks?|scrolls?|interactions?",
+    'conversions': r"conversions?|converted|leads?",
+    'add_to_favourites': r"favou?rites?|wishlists?",
+    'add_to_cart': r"carts?|add to cart|added to cart|basket",
+}
+TABLE_HINT_PATTERNS = {table: re.compile(rf"\b(?:{hint})\b", re.I) for table, hint in TABLE_HINTS.items()}
+
+FUNNEL_PATTERN = re.compile(
+    r"\bfunnel|drop[ -]?offs?|conversion rates?|journey|step[ -]by[ -]step|abandon|through to", re.I)
+WINDOW_PATTERN = re.compile(
+    r"\b(?:rank(?:ed|ing|s)?|top \d+ (?:\w+ )?(?:per|by|for each|in each)|running total|cumulative|"
+    r"moving average|rolling|previous|prior|week[ -]over[ -]week|month[ -]over[ -]month|day[ -]over[ -]day|"
+    r"growth|retention|cohorts?|returning|percentiles?|medians?|first (?:time|visit|purchase)|time between|"
+    r"sequences?|lags?|lead time)\b", re.I)
+COMPARISON_PATTERN = re.compile(r"\bcompare|versus|\bvs\.?\b|ratio|share of|percentage|% of|breakdown", re.I)
+
+
+def difficulty(question):
+    # Rough proxy for how hard the SQL will be: tables that need joining,
+    # funnel stages, and window-style logic each add to the score
+    tables = [table for table, pattern in TABLE_HINT_PATTERNS.items() if pattern.search(question)]
+    score = max(0, len(tables) - 1)
+    if FUNNEL_PATTERN.search(question):
+        score += 2
+    if WINDOW_PATTERN.search(question):
+        score += 3
+    if COMPARISON_PATTERN.search(question):
+        score += 1
+    return score, tables
+
+
+def classify(question):
+    if not ROUTER_ENABLED:
+        return STANDARD
+    score, _ = difficulty(question)
+    if score >= STRONG_THRESHOLD:
+        return STRONG
+    if score >= STANDARD_THRESHOLD:
+        return STANDARD
+    return FAST
+
+
+def escalate(tier):
+    return min(tier + 1, STRONG) if ROUTER_ENABLED else tier
+
+
+def validate_sql(sql_query):
+    # Cheap local checks run before a query is handed back; a failure here
+    # sends the question to the next tier instead of to the database
+    if not sql_query or not sql_query.strip():
+        return "empty response"
+    if not sql_utils.is_read_only(sql_query):
+        return "not a single read-only statement"
+    masked = sql_utils.normalize(sql_query)
+    if masked.count('(') != masked.count(')'):
+        return "unbalanced parentheses"
+    unknown = [table for table in sql_utils.referenced_tables(sql_query) if table not in SCHEMA_TABLES]
+    if unknown:
+        return "unknown tables: " + ", ".join(unknown)
+    return None
+
+
+class RouterStats:
+    # Process-wide counters, read by the sidebar in app.py and /health in api.py
+
+    def __init__(self, remembered=1000):
+        self.lock = threading.Lock()
+        self.tiers = {tier['name']: {'calls': 0, 'errors': 0, 'seconds': 0.0,
+                                     'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+                      for tier in TIERS}
+        self.requests = 0
+        # Questions answered from approved SQL without calling a model
+        self.verified = 0
+        self.escalations = {'validation': 0, 'execution': 0}
+        # Requests that escalated at least once; one request can escalate twice
+        self.escalated_requests = 0
+        # Which tier produced each recent query, so a failing one escalates from there
+        self.origins = OrderedDict()
+        self.remembered = remembered
+
+    def record_call(self, tier, seconds, response=None, error=False):
+        usage = getattr(response, 'usage_metadata', None) or {}
+        input_tokens = usage.get('input_tokens', 0)
+        output_tokens = usage.get('output_tokens', 0)
+        spec = TIERS[tier]
+        with self.lock:
+            stats = self.tiers[spec['name']]
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['seconds'] += seconds
+            stats['input_tokens'] += input_tokens
+            stats['output_tokens'] += output_tokens
+            stats['cost'] += (input_tokens * spec['input_cost'] + output_tokens * spec['output_cost']) / 1e6
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_verified(self):
+        with self.lock:
+            self.verified += 1
+
+    def record_escalation(self, reason, first=True):
+        with self.lock:
+            self.escalations[reason] += 1
+            self.escalated_requests += int(first)
+
+    def remember(self, sql_query, tier):
+        with self.lock:
+            self.origins.pop(sql_query.strip(), None)
+            self.origins[sql_query.strip()] = tier
+            while len(self.origins) > self.remembered:
+                self.origins.popitem(last=False)
+
+    def origin(self, sql_query):
+        with self.lock:
+            return self.origins.get(sql_query.strip())
+
+    def snapshot(self):
+        with self.lock:
+            tiers = {}
+            for tier in TIERS:
+                stats = dict(self.tiers[tier['name']])
+                stats['model'] = tier['model']
+                stats['avg_latency_ms'] = round(stats['seconds'] / stats['calls'] * 1000) if stats['calls'] else None
+                stats['seconds'] = round(stats['seconds'], 1)
+                stats['cost'] = round(stats['cost'], 6)
+                tiers[tier['name']] = stats
+            return {
+                'requests': self.requests,
+                'verified': self.verified,
+                'escalations': dict(self.escalations),
+                # Share of requests that escalated, so it stays within 0..1
+                'escalation_rate': round(self.escalated_requests / self.requests, 3) if self.requests else None,
+                'tiers': tiers,
+            }
+
+
+stats = RouterStats()
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import chroma_index
+import retrieval_cache
+
+# Load environment variables at startup
+load_dotenv()
+
+# Sources larger than this many chunks are split into several shards
+PARTITION_MAX_CHUNKS = int(os.getenv('PARTITION_MAX_CHUNKS', '20000'))
+# Classifier routing: search every partition scoring within this margin of the best one
+PARTITION_ROUTE_MARGIN = float(os.getenv('PARTITION_ROUTE_MARGIN', '0.05'))
+PARTITION_MAX_FANOUT = int(os.getenv('PARTITION_MAX_FANOUT', '3'))
+
+MANIFEST = 'partitions.json'
+STOPWORDS = {'the', 'of', 'a', 'an', 'and', 'in', 'on', 'to', 'txt', 'md', 'pdf'}
+
+
+def source_words(source):
+    # "lord_of_the_rings.txt" -> ["lord", "rings"]
+    name = os.path.splitext(os.path.basename(source))[0]
+    return [word for word in re.split(r"[^a-z0-9]+", name.lower()) if word and word not in STOPWORDS]
+
+
+def collection_name(source, shard=0):
+    # Chroma names: 3-63 characters of [a-zA-Z0-9._-], alphanumeric at both ends
+    # The hash keeps "notes.txt" and "notes.md" apart
+    base = '_'.join(source_words(source)) or 'source'
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:6]
+    return f"src_{base[:40]}_{digest}_{shard}"
+
+
+def centroid(vectors):
+    dims = len(vectors[0])
+    total = [0.0] * dims
+    for vector in vectors:
+        for i, value in enumerate(vector):
+            total[i] += value
+    mean = [value / len(vectors) for value in total]
+    norm = sum(value * value for value in mean) ** 0.5 or 1.0
+    return [value / norm for value in mean]
+
+
+def cosine(a, b):
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
+
+
+def build(source_directory, persist_directory, source_collection=chroma_index.DEFAULT_COLLECTION):
+    # One collection per source (split into shards past PARTITION_MAX_CHUNKS),
+    # plus a manifest with each partition's source and embedding centroid.
+    # Records are copied from the main store with their vectors, the same way
+    # chroma_index.rebuild does, so partitioning makes no embedding calls.
+    import chromadb
+
+    source_client = chromadb.PersistentClient(path=source_directory)
+    batch_size = source_client.get_max_batch_size() if hasattr(source_client, 'get_max_batch_size') else 5000
+    ids, embeddings, documents, metadatas = chroma_index.read_all(
+        source_client.get_collection(source_collection), batch_size)
+
+    by_source = defaultdict(list)
+    for record in zip(ids, embeddings, documents, metadatas):
+        by_source[(record[3] or {}).get('source', 'unknown')].append(record)
+
+    os.makedirs(persist_directory, exist_ok=True)
+    client = chromadb.PersistentClient(path=persist_directory)
+    manifest = {}
+    for source, records in sorted(by_source.items()):
+        for shard, start in enumerate(range(0, len(records), PARTITION_MAX_CHUNKS)):
+            name = collection_name(source, shard)
+            shard_records = records[start:start + PARTITION_MAX_CHUNKS]
+            # Rebuilding replaces a partition instead of appending duplicates
+            try:
+                client.delete_collection(name)
+            except Exception:
+                pass
+            collection = client.create_collection(name, metadata=chroma_index.collection_metadata(persist_directory))
+            for offset in range(0, len(shard_records), batch_size):
+                batch_ids, vectors, texts, batch_metadatas = zip(*shard_records[offset:offset + batch_size])
+                collection.add(ids=list(batch_ids), embeddings=list(vectors),
+                               documents=list(texts), metadatas=list(batch_metadatas))
+            manifest[name] = {
+                'source': source,
+                'words': source_words(source),
+                'count': len(shard_records),
+                'centroid': centroid([record[1] for record in shard_records]),
+            }
+            print(f"Partition {name}: {len(shard_records)} chunks from {source}")
+
+    with open(os.path.join(persist_directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    retrieval_cache.invalidate()
+    return manifest
+
+
+def load_manifest(persist_directory):
+    path = os.path.join(persist_directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class PartitionRouter:
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def by_metadata(self, query):
+        # A source named in the question ("... in Dracula") settles it
+        words = set(re.findall(r"[a-z0-9]+", query.lower()))
+        matches = []
+        for name, partition in self.manifest.items():
+            title = partition['words']
+            if title and sum(word in words for word in title) >= max(1, (len(title) + 1) // 2):
+                matches.append(name)
+        return matches
+
+    def by_centroid(self, query_embedding):
+        scored = sorted(((cosine(query_embedding, partition['centroid']), name)
+                         for name, partition in self.manifest.items()), reverse=True)
+        if not scored:
+            return []
+        best = scored[0][0]
+        return [name for score, name in scored[:PARTITION_MAX_FANOUT] if score >= best - PARTITION_ROUTE_MARGIN]
+
+    def route(self, query, query_embedding):
+        matches = self.by_metadata(query)
+        if matches:
+            # Every shard of a named source is searched
+            return matches, 'metadata'
+        return self.by_centroid(query_embedding), 'centroid'
+
+
+class PartitionedSearch:
+    # Embeds the question once, routes it to the relevant partitions and
+    # searches only those, merging hits by relevance score. Results go
+    # through the same cache as CachedRetriever, keyed by the partitioned
+    # store's version.
+
+    def __init__(self, persist_directory, embeddings, search_kwargs=None):
+        from langchain_chroma import Chroma
+
+        self.manifest = load_manifest(persist_directory)
+        if self.manifest is None:
+            raise ValueError(f"No partition manifest in {persist_directory}")
+        self.router = PartitionRouter(self.manifest)
+        self.persist_directory = persist_directory
+        self.embeddings = embeddings
+        self.search_kwargs = dict(search_kwargs or {})
+        self.stores = {name: Chroma(collection_name=name, persist_directory=persist_directory,
+                                    embedding_function=embeddings)
+                       for name in self.manifest}
+        self.executor = ThreadPoolExecutor(max_workers=PARTITION_MAX_FANOUT, thread_name_prefix='partition')
+        self.last_route = None
+        self.last_timings = {}
+
+    def embed(self, query):
+        key = (getattr(self.embeddings, 'model', type(self.embeddings).__name__), query)
+        embedding = retrieval_cache.embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+            retrieval_cache.embedding_cache.put(key, embedding)
+        return embedding
+
+    def search_partition(self, name, embedding, k):
+        store = self.stores[name]
+        relevance = store._select_relevance_score_fn()
+        results = store.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        return [(doc, relevance(distance)) for doc, distance in results]
+
+    def invoke(self, query):
+        started = time.perf_counter()
+        query = retrieval_cache.normalize_query(query)
+        store = next(iter(self.stores.values()), None)
+        version = retrieval_cache.collection_version(store, self.persist_directory)
+        key = ('partitions', self.persist_directory, version, query,
+               tuple(sorted((k, repr(v)) for k, v in self.search_kwargs.items())))
+        cached = retrieval_cache.result_cache.get(key)
+        if cached is None:
+            cached = self.search(query)
+            retrieval_cache.result_cache.put(key, cached)
+            self.last_timings = {'cached': False, 'seconds': time.perf_counter() - started}
+        else:
+            self.last_timings = {'cached': True, 'seconds': time.perf_counter() - started}
+        docs, self.last_route = cached
+        return list(docs)
+
+    def search(self, query):
+        k = self.search_kwargs.get('k', 4)
+        threshold = self.search_kwargs.get('score_threshold', 0.0)
+        embedding = self.embed(query)
+        names, method = self.router.route(query, embedding)
+
+        if len(names) == 1:
+            hits = self.search_partition(names[0], embedding, k)
+        else:
+            hits = [hit for result in self.executor.map(lambda name: self.search_partition(name, embedding, k), names)
+                    for hit in result]
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        docs = [doc for doc, score in hits[:k] if score >= threshold]
+        return docs, {'partitions': names, 'method': method}
@@ -7,13 +7,10 @@ load_dotenv()
 if not os.getenv('OPENAI_API_KEY'):
     raise ValueError("OPENAI_API_KEY not found in environment variables")
 
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain.schema import HumanMessage, SystemMessage
+# langchain and Chroma are imported where they are used: loading them takes
+# longer than everything else here, and not every path needs all of them
+import chroma_index
+import retrieval_cache
 
 class RAGApp:
     def __init__(self):
@@ -22,14 +19,26 @@ class RAGApp:
         self.db_dir = os.path.join(self.current_dir, "db")
         self.persistent_directory = os.path.join(self.db_dir, "chroma_db_with_metadata")
         
-        # Initialize embeddings with API key from environment
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",
-            openai_api_key=os.getenv('OPENAI_API_KEY')
-        )
+        self._embeddings = None
         self.vectorstore = None
+
+    @property
+    def embeddings(self):
+        # Built on first use with the API key from environment
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+
+            self._embeddings = OpenAIEmbeddings(
+                model="text-embedding-3-small",
+                openai_api_key=os.getenv('OPENAI_API_KEY')
+            )
+        return self._embeddings
         
     def process_text(self, text, source_name="input.txt"):
+        from langchain.text_splitter import CharacterTextSplitter
+        from langchain_community.document_loaders import TextLoader
+        from langchain_chroma import Chroma
+
         # Create temporary file
         temp_file = os.path.join(self.current_dir, "temp.txt")
         with open(temp_file, "w", encoding="utf-8") as f:
@@ -49,18 +58,25 @@ class RAGApp:
         )
         docs = text_splitter.split_documents(documents)
         
-        # Create and persist vector store
+        # Create and persist vector store. Appending fragments the HNSW
+        # index over time; `python chroma_index.py` re-packs it.
         os.makedirs(self.db_dir, exist_ok=True)
         self.vectorstore = Chroma.from_documents(
             docs,
             self.embeddings,
-            persist_directory=self.persistent_directory
+            persist_directory=self.persistent_directory,
+            collection_metadata=chroma_index.collection_metadata(self.persistent_directory)
         )
+        # Results cached before this ingestion are stale now
+        retrieval_cache.invalidate()
         
         # Clean up
         os.remove(temp_file)
         
     def get_answer(self, question: str) -> str:
+        from langchain_chroma import Chroma
+        from langchain.prompts import PromptTemplate
+
         if not self.vectorstore:
             if os.path.exists(self.persistent_directory):
                 self.vectorstore = Chroma(
@@ -70,8 +86,11 @@ class RAGApp:
             else:
                 raise ValueError("No vector store found. Please process some text first.")
         
-        # Set up retriever with similarity search
-        retriever = self.vectorstore.as_retriever(
+        # Set up retriever with similarity search; repeat questions are
+        # answered from the cache without embedding or searching again
+        retriever = retrieval_cache.CachedRetriever(
+            self.vectorstore,
+            persist_directory=self.persistent_directory,
             search_type="similarity_score_threshold",
             search_kwargs={"k": 3, "score_threshold": 0.2},
         )
@@ -97,6 +116,8 @@ class RAGApp:
         )
         
         # # Create QA chain with API key from environment
+        # from langchain.chains import RetrievalQA
+        # from langchain_openai import ChatOpenAI
         # qa_chain = RetrievalQA.from_chain_type(
         #     llm=ChatOpenAI(
         #         model="gpt-4",
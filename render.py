@@ -0,0 +1,365 @@
+import datetime
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import pymysql
+from dotenv import load_dotenv
+
+import sql_utils
+
+# Load environment variables at startup
+load_dotenv()
+
+# Rows per table page fetched from the database
+TABLE_PAGE_SIZE = int(os.getenv('TABLE_PAGE_SIZE', '100'))
+# Maximum number of points sent to the browser for a chart
+CHART_POINT_BUDGET = int(os.getenv('CHART_POINT_BUDGET', '1000'))
+# Categories shown individually before the remainder is folded into "Other"
+CHART_TOP_N = int(os.getenv('CHART_TOP_N', '20'))
+# Upper bound on raw rows pulled for time-series downsampling
+CHART_FETCH_LIMIT = int(os.getenv('CHART_FETCH_LIMIT', '200000'))
+# Rows read per round trip when a result has to be streamed instead of paged
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+
+OTHER_LABEL = "Other"
+
+
+def strip_sql(sql_query):
+    return sql_query.strip().rstrip(';').strip()
+
+
+def quote_identifier(name):
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+# Limits are inlined as ints rather than passed as parameters: pymysql
+# %-formats the whole statement when params are given, which would break
+# generated SQL containing LIKE '%...%'.
+
+def page_sql(sql_query, limit, offset=0, order_columns=0):
+    # Wrapping the query lets MySQL apply the LIMIT server-side, so only one
+    # page ever crosses the wire. Unordered queries are sorted on every
+    # output column so consecutive pages neither overlap nor skip rows; an
+    # ORDER BY inside the query carries through the wrapper.
+    order_by = ""
+    if order_columns:
+        order_by = " ORDER BY " + ", ".join(str(i) for i in range(1, order_columns + 1))
+    return (f"SELECT * FROM ({strip_sql(sql_query)}) AS page_source{order_by} "
+            f"LIMIT {int(limit)} OFFSET {int(offset)}")
+
+
+def summary_sql(sql_query, y_cols=(), x_value=None):
+    # Row count, column totals and the x range in a single pass over the result
+    sums = "".join(f", SUM({quote_identifier(col)}) AS {quote_identifier(col)}" for col in y_cols)
+    x_range = f", MIN({x_value}) AS `__x_low`, MAX({x_value}) AS `__x_high`" if x_value else ""
+    return f"SELECT COUNT(*) AS row_count{sums}{x_range} FROM ({strip_sql(sql_query)}) AS summary_source"
+
+
+def x_value_sql(first_page):
+    # The x column as a number to bucket on; dates become seconds
+    x_col = first_page.columns[0]
+    if pd.api.types.is_datetime64_any_dtype(first_page[x_col]):
+        return f"TO_SECONDS({quote_identifier(x_col)})"
+    return quote_identifier(x_col)
+
+
+def series_sql(sql_query, x_col, y_cols, x_value, low, high, buckets):
+    # Equal-width buckets over the whole x range, each averaged to one point,
+    # so every row counts towards the chart and no part of the range is lost
+    width = (float(high) - float(low)) / buckets or 1.0
+    averages = ", ".join(f"AVG({quote_identifier(col)}) AS {quote_identifier(col)}" for col in y_cols)
+    return (
+        f"SELECT MIN({quote_identifier(x_col)}) AS {quote_identifier(x_col)}, {averages} "
+        f"FROM ({strip_sql(sql_query)}) AS chart_source "
+        f"WHERE {quote_identifier(x_col)} IS NOT NULL "
+        f"GROUP BY FLOOR(({x_value} - {float(low)!r}) / {width!r}) ORDER BY 1"
+    )
+
+
+def top_n_sql(sql_query, x_col, y_cols, top_n):
+    sums = ", ".join(f"SUM({quote_identifier(col)}) AS {quote_identifier(col)}" for col in y_cols)
+    return (
+        f"SELECT {quote_identifier(x_col)}, {sums} "
+        f"FROM ({strip_sql(sql_query)}) AS chart_source "
+        f"GROUP BY {quote_identifier(x_col)} "
+        f"ORDER BY SUM({quote_identifier(y_cols[0])}) DESC LIMIT {int(top_n)}"
+    )
+
+
+def has_order_by(sql_query):
+    masked = sql_utils.blank_literals(sql_utils.blank_comments(sql_query))
+    depths = sql_utils.paren_depths(masked)
+    return any(depths[m.start()] == 0 for m in re.finditer(r"\bORDER\s+BY\b", masked, re.I))
+
+
+def paging_plan(conn, sql_query):
+    # Only a plain SELECT with unique output names can be wrapped in a
+    # derived table; SHOW/DESCRIBE/EXPLAIN, and joins selecting a.id and
+    # b.id, are streamed instead. A LIMIT 0 probe settles it without
+    # running the query.
+    statement = sql_utils.normalize(sql_query)
+    if not re.match(r"^(SELECT|WITH)\b", statement, re.I):
+        return {'wrap': False, 'order_columns': 0}
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(page_sql(sql_query, 0))
+            columns = len(cursor.description or ())
+    except pymysql.MySQLError:
+        # Duplicate names, or a real error the streamed run will report
+        return {'wrap': False, 'order_columns': 0}
+    return {'wrap': True, 'order_columns': 0 if has_order_by(sql_query) else columns}
+
+
+def unique_names(names):
+    # "id", "id" -> "id", "id (2)"; duplicates would break the table and parquet
+    seen = {}
+    unique = []
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        unique.append(name if seen[name] == 1 else f"{name} ({seen[name]})")
+    return unique
+
+
+def stream(conn, sql_query):
+    # Unbuffered cursor: rows arrive in batches rather than all at once
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    cursor.execute(strip_sql(sql_query))
+    columns = unique_names([d[0] for d in cursor.description or ()])
+    return cursor, columns
+
+
+def fetch_page(conn, sql_query, page, page_size=None, plan=None):
+    page_size = page_size or TABLE_PAGE_SIZE
+    plan = plan or paging_plan(conn, sql_query)
+    if plan['wrap']:
+        return coerce_dates(pd.read_sql_query(
+            page_sql(sql_query, page_size, page * page_size, plan['order_columns']), conn))
+    cursor, columns = stream(conn, sql_query)
+    try:
+        skipped = 0
+        while skipped < page * page_size:
+            batch = cursor.fetchmany(min(STREAM_BATCH_SIZE, page * page_size - skipped))
+            if not batch:
+                break
+            skipped += len(batch)
+        rows = cursor.fetchmany(page_size)
+    finally:
+        cursor.close()
+    return coerce_dates(pd.DataFrame(list(rows), columns=columns))
+
+
+def coerce_dates(df):
+    # DATE() columns come back from pymysql as datetime.date objects, which
+    # pandas leaves as object dtype; treat them as datetimes for charting.
+    for col in df.columns:
+        if df[col].dtype == object:
+            sample = df[col].dropna().head(20)
+            if len(sample) and all(isinstance(v, (datetime.date, datetime.datetime)) for v in sample):
+                df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def numeric_columns(df):
+    return [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])
+            and not pd.api.types.is_bool_dtype(df[col])]
+
+
+def chart_kind(df):
+    # First column is the x axis, remaining numeric columns are the series
+    if df.empty or len(df.columns) < 2:
+        return None
+    x_col = df.columns[0]
+    y_cols = [col for col in numeric_columns(df) if col != x_col]
+    if not y_cols:
+        return None
+    if pd.api.types.is_datetime64_any_dtype(df[x_col]) or pd.api.types.is_numeric_dtype(df[x_col]):
+        return 'series'
+    return 'categorical'
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that preserve the shape of y over x."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    # Buckets exclude the fixed first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs(
+            (x[previous] - avg_x) * (bucket_y - y[previous])
+            - (x[previous] - bucket_x) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas)) if len(areas) else start
+        selected[i + 1] = previous
+    return np.unique(selected)
+
+
+def downsample_series(df, budget=None):
+    budget = budget or CHART_POINT_BUDGET
+    if len(df) <= budget:
+        return df
+    x_col = df.columns[0]
+    y_cols = [col for col in numeric_columns(df) if col != x_col]
+    df = df.dropna(subset=[x_col]).sort_values(x_col).reset_index(drop=True)
+    x = df[x_col]
+    x = (x.astype('int64') if pd.api.types.is_datetime64_any_dtype(x) else x).to_numpy(dtype=float)
+
+    # Split the budget across series and keep the union of the points each
+    # series needs, so peaks in any series survive.
+    per_series = max(3, budget // len(y_cols))
+    keep = set()
+    for col in y_cols:
+        y = df[col].fillna(0).to_numpy(dtype=float)
+        keep.update(lttb(x, y, per_series).tolist())
+    return df.iloc[sorted(keep)].reset_index(drop=True)
+
+
+def top_n_with_other(df, top_n=None):
+    # In-memory fallback of the SQL pushdown, used when the data is already local
+    top_n = top_n or CHART_TOP_N
+    x_col = df.columns[0]
+    y_cols = [col for col in numeric_columns(df) if col != x_col]
+    grouped = df.groupby(x_col, dropna=False)[y_cols].sum().sort_values(y_cols[0], ascending=False)
+    if len(grouped) <= top_n:
+        return grouped.reset_index()
+    head = grouped.iloc[:top_n]
+    other = grouped.iloc[top_n:].sum().to_frame().T
+    other.index = [OTHER_LABEL]
+    result = pd.concat([head, other])
+    result.index.name = x_col
+    return result.reset_index()
+
+
+def chart_columns(df):
+    return [col for col in numeric_columns(df) if col != df.columns[0]]
+
+
+def local_chart(kind, df):
+    if kind == 'series':
+        return 'series', downsample_series(df)
+    return 'categorical', top_n_with_other(df)
+
+
+def fetch_chart_data(conn, sql_query, first_page, row_count, summary=None):
+    kind = chart_kind(first_page)
+    if kind is None:
+        return None, None
+
+    if row_count <= len(first_page):
+        # Whole result is already local
+        return local_chart(kind, first_page)
+
+    x_col = first_page.columns[0]
+    y_cols = chart_columns(first_page)
+    if kind == 'categorical':
+        # Aggregate in the database: top N categories plus one "Other" row,
+        # against totals that came with the row count
+        top = pd.read_sql_query(top_n_sql(sql_query, x_col, y_cols, CHART_TOP_N), conn)
+        other = pd.Series([summary[col] for col in y_cols], index=y_cols, dtype=float) \
+            - top[y_cols].astype(float).sum()
+        if (other.abs() > 1e-9).any():
+            other_row = pd.DataFrame([[OTHER_LABEL, *other.tolist()]], columns=[x_col, *y_cols])
+            top = pd.concat([top.astype({x_col: str}), other_row], ignore_index=True)
+        return 'categorical', top
+
+    # No x values at all, so nothing to plot
+    if pd.isna(summary['__x_low']):
+        return None, None
+    chart = pd.read_sql_query(series_sql(sql_query, x_col, y_cols, x_value_sql(first_page),
+                                         summary['__x_low'], summary['__x_high'], CHART_POINT_BUDGET), conn)
+    return 'series', coerce_dates(chart)
+
+
+def load_streamed_result_set(conn, sql_query, page_size):
+    # One pass over a result that can't be wrapped: the first page, the row
+    # count, and up to CHART_FETCH_LIMIT rows for the chart. Past that there
+    # is no chart, since it would only show part of the result.
+    started = time.monotonic()
+    cursor, columns = stream(conn, sql_query)
+    kept = []
+    row_count = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not batch:
+                break
+            row_count += len(batch)
+            if len(kept) < CHART_FETCH_LIMIT:
+                kept.extend(batch[:CHART_FETCH_LIMIT - len(kept)])
+    finally:
+        cursor.close()
+    seconds = time.monotonic() - started
+    rows = coerce_dates(pd.DataFrame(kept, columns=columns))
+    first = rows.iloc[:page_size]
+    kind = chart_kind(first)
+    kind, chart = local_chart(kind, rows) if kind and row_count == len(rows) else (None, None)
+    return {
+        'row_count': row_count,
+        'page_size': page_size,
+        'first_page': first,
+        'chart_kind': kind,
+        'chart': chart,
+        'chart_bucketed': False,
+        'seconds': seconds,
+    }
+
+
+def load_result_set(conn, sql_query, page_size=None):
+    """Fetches the first page, the total row count and bounded chart data for a query.
+
+    'seconds' is the time taken by the query itself (its first page), without
+    the count and chart queries that follow.
+    """
+    page_size = page_size or TABLE_PAGE_SIZE
+    plan = paging_plan(conn, sql_query)
+    if not plan['wrap']:
+        result_set = load_streamed_result_set(conn, sql_query, page_size)
+        result_set['plan'] = plan
+        return result_set
+
+    # Ask for one extra row so small results need no separate count
+    started = time.monotonic()
+    first = coerce_dates(pd.read_sql_query(
+        page_sql(sql_query, page_size + 1, 0, plan['order_columns']), conn))
+    seconds = time.monotonic() - started
+    summary = None
+    if len(first) <= page_size:
+        row_count = len(first)
+    else:
+        first = first.iloc[:page_size]
+        kind = chart_kind(first)
+        y_cols = chart_columns(first) if kind == 'categorical' else []
+        x_value = x_value_sql(first) if kind == 'series' else None
+        summary = pd.read_sql_query(summary_sql(sql_query, y_cols, x_value), conn).iloc[0]
+        row_count = int(summary['row_count'])
+
+    kind, chart = fetch_chart_data(conn, sql_query, first, row_count, summary)
+    return {
+        'row_count': row_count,
+        'page_size': page_size,
+        'first_page': first,
+        'chart_kind': kind,
+        'chart': chart,
+        # Series of more than one page are averaged into buckets by MySQL
+        'chart_bucketed': kind == 'series' and row_count > len(first),
+        'plan': plan,
+        'seconds': seconds,
+    }
@@ -0,0 +1,167 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+# Load environment variables at startup
+load_dotenv()
+
+# Upper bound on what the cache may hold, in (estimated) bytes
+RETRIEVAL_CACHE_MAX_BYTES = int(os.getenv('RETRIEVAL_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv('RETRIEVAL_CACHE_MAX_ENTRIES', '10000'))
+
+
+def normalize_query(query):
+    # Only whitespace is normalized; case can change the embedding
+    return ' '.join(query.split())
+
+
+def collection_version(vectorstore, persist_directory=None):
+    # Chroma writes every ingestion to chroma.sqlite3 (and its WAL), so the
+    # file stamps change whenever the collection does. Checking them is a
+    # couple of stat() calls; in-memory stores fall back to the row count.
+    if persist_directory:
+        stamps = []
+        for name in ('chroma.sqlite3', 'chroma.sqlite3-wal'):
+            try:
+                stat = os.stat(os.path.join(persist_directory, name))
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        if stamps[0] is not None:
+            return tuple(stamps)
+    return vectorstore._collection.count()
+
+
+def estimate_size(value):
+    # Good enough for a memory cap: vectors, document text and metadata dominate
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if hasattr(value, 'page_content'):
+        return estimate_size(value.page_content) + estimate_size(value.metadata)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    # Thread-safe LRU bounded by entry count and estimated size
+
+    def __init__(self, max_bytes=None, max_entries=None):
+        self.max_bytes = max_bytes or RETRIEVAL_CACHE_MAX_BYTES
+        self.max_entries = max_entries or RETRIEVAL_CACHE_MAX_ENTRIES
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+# Shared by every retriever in the process. Embeddings depend only on the
+# model and the text, so they survive re-ingestion; results do not.
+embedding_cache = LRUCache()
+result_cache = LRUCache()
+
+
+class CachedRetriever:
+    # Drop-in for vectorstore.as_retriever(...).invoke(query) that remembers
+    # query embeddings and top-k results. Results are keyed by the collection
+    # version, so anything cached before an ingestion is never served after it.
+
+    def __init__(self, vectorstore, persist_directory=None, search_type="similarity", search_kwargs=None):
+        self.vectorstore = vectorstore
+        self.persist_directory = persist_directory
+        self.search_type = search_type
+        self.search_kwargs = dict(search_kwargs or {})
+        self.collection = vectorstore._collection.name
+        embeddings = vectorstore.embeddings
+        self.embedding_model = getattr(embeddings, 'model', type(embeddings).__name__)
+        self.last_timings = {}
+
+    def embed(self, query):
+        key = (self.embedding_model, query)
+        embedding = embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+            embedding_cache.put(key, embedding)
+        return embedding
+
+    def search(self, embedding):
+        k = self.search_kwargs.get('k', 4)
+        search_filter = self.search_kwargs.get('filter')
+        if self.search_type == "similarity":
+            return self.vectorstore.similarity_search_by_vector(embedding, k=k, filter=search_filter)
+        if self.search_type == "similarity_score_threshold":
+            # Same scoring as the stock retriever: distances mapped to relevance
+            relevance = self.vectorstore._select_relevance_score_fn()
+            results = self.vectorstore.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=search_filter)
+            threshold = self.search_kwargs.get('score_threshold', 0.0)
+            return [doc for doc, distance in results if relevance(distance) >= threshold]
+        if self.search_type == "mmr":
+            return self.vectorstore.max_marginal_relevance_search_by_vector(
+                embedding, k=k, fetch_k=self.search_kwargs.get('fetch_k', 20),
+                lambda_mult=self.search_kwargs.get('lambda_mult', 0.5), filter=search_filter)
+        raise ValueError(f"Unsupported search_type: {self.search_type}")
+
+    def invoke(self, query):
+        started = time.perf_counter()
+        query = normalize_query(query)
+        version = collection_version(self.vectorstore, self.persist_directory)
+        key = (self.collection, version, query, self.search_type,
+               tuple(sorted((k, repr(v)) for k, v in self.search_kwargs.items())))
+        docs = result_cache.get(key)
+        if docs is None:
+            docs = self.search(self.embed(query))
+            result_cache.put(key, docs)
+            self.last_timings = {'cached': False, 'seconds': time.perf_counter() - started}
+        else:
+            self.last_timings = {'cached': True, 'seconds': time.perf_counter() - started}
+        # Callers get their own list so they can't mutate the cached one
+        return list(docs)
+
+
+def invalidate():
+    # Ingestion already changes the version; this frees the memory right away
+    result_cache.clear()
+
+
+def stats():
+    return {'embeddings': embedding_cache.stats(), 'results': result_cache.stats()}
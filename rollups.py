@@ -0,0 +1,621 @@
+import argparse
+import datetime
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import sql_utils
+
+# Load environment variables at startup
+load_dotenv()
+
+# Days re-aggregated on every incremental refresh to pick up late events and
+# sessions that reach a later funnel stage after the day they started
+ROLLUP_LOOKBACK_DAYS = int(os.getenv('ROLLUP_LOOKBACK_DAYS', '2'))
+# Queries are only routed to the rollups if they were refreshed this recently
+ROLLUP_MAX_STALENESS_MINUTES = int(os.getenv('ROLLUP_MAX_STALENESS_MINUTES', '60'))
+ROLLUPS_ENABLED = os.getenv('ROLLUPS_ENABLED', '1') == '1'
+
+DIMENSIONS = ('utm_source', 'device', 'country')
+
+# Event-grain rollup: one row per (day of the event, stage, session dimensions)
+EVENT_ROLLUP = 'rollup_funnel_daily'
+# Session-grain rollup: sessions created per day and which stages they reached
+SESSION_ROLLUP = 'rollup_session_funnel_daily'
+STATE_TABLE = 'rollup_state'
+
+# Funnel tables, the value column summed for each, and the session rollup flag
+STAGES = {
+    'add_to_cart': {'value': 'productCost', 'reached': 'reached_add_to_cart'},
+    'proceed_to_checkout': {'value': 'cartValue', 'reached': 'reached_checkout'},
+    'proceed_to_payment': {'value': 'cartValue', 'reached': 'reached_payment'},
+    'conversions': {'value': 'conversionValue', 'reached': 'converted'},
+}
+
+CREATE_STATEMENTS = [
+    f"""CREATE TABLE IF NOT EXISTS {EVENT_ROLLUP} (
+        day DATE NOT NULL,
+        stage VARCHAR(32) NOT NULL,
+        utm_source VARCHAR(255) NOT NULL DEFAULT '',
+        device VARCHAR(64) NOT NULL DEFAULT '',
+        country VARCHAR(128) NOT NULL DEFAULT '',
+        events BIGINT NOT NULL,
+        sessions BIGINT NOT NULL,
+        value DECIMAL(20,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (stage, day, utm_source, device, country)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS {SESSION_ROLLUP} (
+        day DATE NOT NULL,
+        utm_source VARCHAR(255) NOT NULL DEFAULT '',
+        device VARCHAR(64) NOT NULL DEFAULT '',
+        country VARCHAR(128) NOT NULL DEFAULT '',
+        sessions BIGINT NOT NULL,
+        time_spent BIGINT NOT NULL DEFAULT 0,
+        reached_add_to_cart BIGINT NOT NULL DEFAULT 0,
+        reached_checkout BIGINT NOT NULL DEFAULT 0,
+        reached_payment BIGINT NOT NULL DEFAULT 0,
+        converted BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, utm_source, device, country)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        rollup_name VARCHAR(64) NOT NULL,
+        refreshed_at DATETIME NOT NULL,
+        PRIMARY KEY (rollup_name)
+    )""",
+]
+
+
+# --- Maintenance -------------------------------------------------------------
+
+def event_rollup_insert(stage):
+    value_column = STAGES[stage]['value']
+    return f"""INSERT INTO {EVENT_ROLLUP}
+        (day, stage, utm_source, device, country, events, sessions, value)
+        SELECT DATE(e.timestamp), '{stage}',
+               COALESCE(s.utm_source, ''), COALESCE(s.device, ''), COALESCE(s.country, ''),
+               COUNT(*), COUNT(DISTINCT e.sessionId), COALESCE(SUM(e.{value_column}), 0)
+        FROM {stage} e
+        LEFT JOIN sessions s ON s.id = e.sessionId
+        WHERE e.timestamp >= %s
+        GROUP BY DATE(e.timestamp), COALESCE(s.utm_source, ''), COALESCE(s.device, ''),
+                 COALESCE(s.country, '')"""
+
+
+def session_rollup_insert():
+    reached = ",\n               ".join(
+        f"SUM(EXISTS (SELECT 1 FROM {stage} x WHERE x.sessionId = s.id))"
+        for stage in STAGES
+    )
+    columns = ", ".join(info['reached'] for info in STAGES.values())
+    return f"""INSERT INTO {SESSION_ROLLUP}
+        (day, utm_source, device, country, sessions, time_spent, {columns})
+        SELECT DATE(s.createdAt),
+               COALESCE(s.utm_source, ''), COALESCE(s.device, ''), COALESCE(s.country, ''),
+               COUNT(*), COALESCE(SUM(s.timeSpent), 0),
+               {reached}
+        FROM sessions s
+        WHERE s.createdAt >= %s
+        GROUP BY DATE(s.createdAt), COALESCE(s.utm_source, ''), COALESCE(s.device, ''),
+                 COALESCE(s.country, '')"""
+
+
+def create_tables(conn):
+    with conn.cursor() as cursor:
+        for statement in CREATE_STATEMENTS:
+            cursor.execute(statement)
+    conn.commit()
+
+
+def get_refreshed_at(conn, rollup_name):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT refreshed_at FROM {STATE_TABLE} WHERE rollup_name = %s", (rollup_name,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def refresh(conn, full=False):
+    # Re-aggregates every day from the last refresh (minus the lookback
+    # window) onwards; older days are left untouched.
+    create_tables(conn)
+    report = {}
+    for rollup_name in (EVENT_ROLLUP, SESSION_ROLLUP):
+        started = time.monotonic()
+        refreshed_at = None if full else get_refreshed_at(conn, rollup_name)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT NOW()")
+            now = cursor.fetchone()[0]
+            if refreshed_at is None:
+                since = datetime.date(1970, 1, 1)
+            else:
+                since = refreshed_at.date() - datetime.timedelta(days=ROLLUP_LOOKBACK_DAYS)
+
+            cursor.execute(f"DELETE FROM {rollup_name} WHERE day >= %s", (since,))
+            if rollup_name == EVENT_ROLLUP:
+                for stage in STAGES:
+                    cursor.execute(event_rollup_insert(stage), (since,))
+            else:
+                cursor.execute(session_rollup_insert(), (since,))
+            cursor.execute(
+                f"REPLACE INTO {STATE_TABLE} (rollup_name, refreshed_at) VALUES (%s, %s)",
+                (rollup_name, now),
+            )
+        conn.commit()
+        report[rollup_name] = {
+            'since': str(since),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+    return report
+
+
+# --- Query rewriting -----------------------------------------------------------
+
+class NotRewritable(Exception):
+    pass
+
+
+CLAUSE_PATTERN = re.compile(r"\b(SELECT|FROM|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT)\b", re.I)
+UNSUPPORTED_PATTERN = re.compile(r"\b(UNION|OVER|WITH|HAVING|INTO|CASE|DISTINCTROW)\b|\(\s*SELECT\b", re.I)
+IDENT = r"`?[A-Za-z_]\w*`?"
+COLUMN_PATTERN = re.compile(rf"^(?:({IDENT})\.)?({IDENT})$")
+KEYWORDS = {'ON', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'JOIN', 'CROSS', 'WHERE', 'GROUP', 'ORDER', 'LIMIT', 'AS'}
+JOIN_PATTERN = re.compile(
+    rf"\s*(?:(LEFT|INNER)(?:\s+OUTER)?\s+)?JOIN\s+({IDENT})(?:\s+(?:AS\s+)?(?!ON\b)({IDENT}))?"
+    rf"\s+ON\s+({IDENT}\.{IDENT})\s*=\s*({IDENT}\.{IDENT})\s*",
+    re.I,
+)
+AGGREGATE_PATTERN = re.compile(r"\b(COUNT|SUM|AVG)\s*\(\s*(DISTINCT\s+)?([^()]*?)\s*\)", re.I)
+DAY_LITERAL = r"'\d{4}-\d{2}-\d{2}(?:\s+00:00(?::00)?)?'"
+DAY_EXPRESSION = re.compile(
+    rf"^(?:{DAY_LITERAL}"
+    r"|CURDATE\(\)|CURRENT_DATE(?:\(\))?"
+    r"|(?:CURDATE\(\)|CURRENT_DATE(?:\(\))?)\s*[-+]\s*INTERVAL\s+\d+\s+(?:DAY|WEEK|MONTH|YEAR)"
+    r"|DATE_(?:SUB|ADD)\(\s*(?:CURDATE\(\)|CURRENT_DATE(?:\(\))?)\s*,\s*INTERVAL\s+\d+\s+(?:DAY|WEEK|MONTH|YEAR)\s*\))$",
+    re.I,
+)
+ARITHMETIC_LEFTOVER = re.compile(r"^(?:[\s\d.+\-*/(),]|\bROUND\b|\bNULLIF\b|\bCOALESCE\b|\bIFNULL\b|@@\d+@@)*$", re.I)
+
+
+def unquote(identifier):
+    return identifier.strip('`') if identifier else identifier
+
+
+def split_clauses(sql_query):
+    text = sql_utils.blank_comments(sql_query).strip().rstrip(';').strip()
+    masked = sql_utils.blank_literals(text)
+    if UNSUPPORTED_PATTERN.search(masked) or ';' in masked:
+        raise NotRewritable("unsupported construct")
+    depths = sql_utils.paren_depths(masked)
+    matches = [m for m in CLAUSE_PATTERN.finditer(masked) if depths[m.start()] == 0]
+    if not matches or matches[0].start() != 0 or matches[0].group(1).upper() != 'SELECT':
+        raise NotRewritable("not a plain SELECT")
+    clauses = {}
+    for i, match in enumerate(matches):
+        name = ' '.join(match.group(1).upper().split())
+        if name in clauses:
+            raise NotRewritable(f"repeated {name}")
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        clauses[name] = (text[match.end():end].strip(), masked[match.end():end].strip())
+    if 'FROM' not in clauses:
+        raise NotRewritable("no FROM clause")
+    return clauses
+
+
+def split_list(text, masked, separator=r","):
+    pattern = re.compile(separator, re.I)
+    parts = sql_utils.split_top_level(text, masked, pattern)
+    masked_parts = sql_utils.split_top_level(masked, masked, pattern)
+    return [(p.strip(), m.strip()) for p, m in zip(parts, masked_parts)]
+
+
+class QueryShape:
+    # Resolved FROM/JOIN structure of a candidate query
+
+    def __init__(self, from_text):
+        match = re.match(rf"^\s*({IDENT})(?:\s+(?:AS\s+)?({IDENT}))?", from_text, re.I)
+        if not match:
+            raise NotRewritable("unparseable FROM")
+        base = unquote(match.group(1)).lower()
+        if match.group(2) and match.group(2).upper() not in KEYWORDS:
+            base_alias = unquote(match.group(2))
+            rest = from_text[match.end():]
+        else:
+            base_alias = None
+            rest = from_text[match.end(1):]
+
+        self.base = base
+        self.aliases = {(base_alias or base).lower(): base}
+        self.joins = {}
+
+        position = 0
+        while position < len(rest.strip()) and rest[position:].strip():
+            join = JOIN_PATTERN.match(rest, position)
+            if not join:
+                raise NotRewritable("unsupported join")
+            kind = (join.group(1) or 'INNER').upper()
+            table = unquote(join.group(2)).lower()
+            alias = unquote(join.group(3) or join.group(2)).lower()
+            if alias in self.aliases:
+                raise NotRewritable("table joined twice")
+            self.aliases[alias] = table
+            self.joins[table] = {'kind': kind, 'alias': alias, 'on': (join.group(4), join.group(5))}
+            position = join.end()
+
+        if base == 'sessions':
+            self.mode = 'session'
+            for table, join in self.joins.items():
+                if table not in STAGES or join['kind'] != 'LEFT':
+                    raise NotRewritable("session funnels need LEFT JOINs to funnel tables")
+                self.check_join_keys(join, (table, 'sessionid'), ('sessions', 'id'))
+        elif base in STAGES:
+            self.mode = 'event'
+            for table, join in self.joins.items():
+                if table != 'sessions':
+                    raise NotRewritable("event queries may only join sessions")
+                if join['kind'] != 'LEFT':
+                    # The event rollup keeps events without a session row,
+                    # which an inner join would drop
+                    raise NotRewritable("event queries must LEFT JOIN sessions")
+                self.check_join_keys(join, ('sessions', 'id'), (base, 'sessionid'))
+        else:
+            raise NotRewritable(f"{base} has no rollup")
+
+    def check_join_keys(self, join, side_a, side_b):
+        sides = {self.resolve(ref) for ref in join['on']}
+        if sides != {side_a, side_b}:
+            raise NotRewritable("join is not on sessionId")
+
+    def resolve(self, reference):
+        # Returns (table, lower-case column) for a column reference
+        match = COLUMN_PATTERN.match(reference.strip())
+        if not match:
+            raise NotRewritable(f"not a column: {reference}")
+        qualifier, column = unquote(match.group(1)), unquote(match.group(2)).lower()
+        if qualifier:
+            table = self.aliases.get(qualifier.lower())
+            if table is None:
+                raise NotRewritable(f"unknown alias {qualifier}")
+            return table, column
+        # Unqualified: session dimensions live on sessions, everything else on the base table
+        if column in DIMENSIONS or column in ('createdat', 'timespent'):
+            if 'sessions' in self.aliases.values():
+                return 'sessions', column
+        if self.joins and self.mode == 'session' and column != 'id':
+            raise NotRewritable(f"ambiguous column {column}")
+        return self.base, column
+
+    @property
+    def time_column(self):
+        return ('sessions', 'createdat') if self.mode == 'session' else (self.base, 'timestamp')
+
+    def dimension(self, expression):
+        # Maps a grouping expression to a rollup column, or None
+        inner = re.match(r"^DATE\s*\((.*)\)$", expression.strip(), re.I)
+        if inner:
+            return 'day' if self.resolve(inner.group(1)) == self.time_column else None
+        try:
+            table, column = self.resolve(expression)
+        except NotRewritable:
+            return None
+        if table == 'sessions' and column in DIMENSIONS:
+            return column
+        return None
+
+    def measure(self, function, distinct, argument):
+        # Maps an aggregate call to an expression over the rollup
+        function = function.upper()
+        argument = argument.strip()
+        if self.mode == 'event':
+            stage_value = STAGES[self.base]['value'].lower()
+            if function == 'COUNT' and not distinct and (argument == '*' or self.resolve(argument) == (self.base, 'id')):
+                return "SUM(events)", False
+            if function == 'COUNT' and distinct and self.resolve(argument) in ((self.base, 'sessionid'), ('sessions', 'id')):
+                # Distinct sessions only add up within a single day
+                return "SUM(sessions)", True
+            if function == 'SUM' and not distinct and self.resolve(argument) == (self.base, stage_value):
+                return "SUM(value)", False
+            if function == 'AVG' and not distinct and self.resolve(argument) == (self.base, stage_value):
+                return "(SUM(value) / NULLIF(SUM(events), 0))", False
+            raise NotRewritable(f"unsupported aggregate {function}({argument})")
+
+        if function == 'COUNT' and distinct and self.resolve(argument) == ('sessions', 'id'):
+            return "SUM(sessions)", False
+        if function == 'COUNT' and distinct:
+            table, column = self.resolve(argument)
+            if table in STAGES and column == 'sessionid':
+                return f"SUM({STAGES[table]['reached']})", False
+        if not self.joins:
+            # Without joins each row is one session
+            if function == 'COUNT' and not distinct and (argument == '*' or self.resolve(argument) == ('sessions', 'id')):
+                return "SUM(sessions)", False
+            if function == 'SUM' and not distinct and self.resolve(argument) == ('sessions', 'timespent'):
+                return "SUM(time_spent)", False
+            if function == 'AVG' and not distinct and self.resolve(argument) == ('sessions', 'timespent'):
+                return "(SUM(time_spent) / NULLIF(SUM(sessions), 0))", False
+        raise NotRewritable(f"unsupported aggregate {function}({argument})")
+
+
+def map_aggregates(shape, expression):
+    # Replaces every aggregate call in expression with its rollup equivalent;
+    # returns None if the expression is not purely aggregate arithmetic.
+    replacements = []
+    needs_day = False
+
+    def substitute(match):
+        nonlocal needs_day
+        mapped, day_only = shape.measure(match.group(1), bool(match.group(2)), match.group(3))
+        needs_day = needs_day or day_only
+        replacements.append(mapped)
+        return f"@@{len(replacements) - 1}@@"
+
+    placeholder = AGGREGATE_PATTERN.sub(substitute, expression)
+    if not replacements:
+        return None
+    if not ARITHMETIC_LEFTOVER.match(placeholder):
+        raise NotRewritable(f"unsupported expression {expression}")
+    mapped = re.sub(r"@@(\d+)@@", lambda m: replacements[int(m.group(1))], placeholder)
+    return mapped, needs_day
+
+
+def map_condition(shape, condition):
+    condition = condition.strip()
+    while condition.startswith('(') and condition.endswith(')') and \
+            0 not in sql_utils.paren_depths(condition):
+        condition = condition[1:-1].strip()
+    if re.search(r"\bOR\b", sql_utils.blank_literals(condition), re.I):
+        raise NotRewritable("OR conditions")
+
+    between = re.match(r"^(.+?)\s+BETWEEN\s+(.+)\s+AND\s+(.+)$", condition, re.I | re.S)
+    if between:
+        left, low, high = between.groups()
+        if shape.dimension(left) == 'day':
+            return f"day BETWEEN {low} AND {high}"
+        raise NotRewritable("BETWEEN on a raw timestamp")
+
+    null_check = re.match(r"^(.+?)\s+IS\s+(NOT\s+)?NULL$", condition, re.I)
+    if null_check:
+        column = shape.dimension(null_check.group(1))
+        if column in DIMENSIONS:
+            # NULL dimensions are stored as ''
+            return f"{column} {'<>' if null_check.group(2) else '='} ''"
+        raise NotRewritable("NULL check")
+
+    membership = re.match(r"^(.+?)\s+(NOT\s+)?IN\s*(\(.*\))$", condition, re.I | re.S)
+    if membership:
+        column = shape.dimension(membership.group(1))
+        if column == 'day':
+            return f"day {'NOT IN' if membership.group(2) else 'IN'} {membership.group(3)}"
+        if column in DIMENSIONS:
+            if re.search(r"''", membership.group(3)):
+                raise NotRewritable("empty string is indistinguishable from NULL in the rollup")
+            if membership.group(2):
+                return f"{column} NOT IN {membership.group(3)} AND {column} <> ''"
+            return f"{column} IN {membership.group(3)}"
+        raise NotRewritable("IN on a non-dimension")
+
+    comparison = re.match(r"^(.+?)\s*(>=|<=|<>|!=|=|<|>)\s*(.+)$", condition, re.S)
+    if not comparison:
+        raise NotRewritable(f"unsupported condition {condition}")
+    left, operator, right = comparison.groups()
+    column = shape.dimension(left)
+    if column in DIMENSIONS:
+        if not right.strip().startswith("'"):
+            raise NotRewritable("dimension compared to a non-literal")
+        if right.strip() == "''":
+            raise NotRewritable("empty string is indistinguishable from NULL in the rollup")
+        if operator == '=':
+            return f"{column} = {right.strip()}"
+        # NULL dimensions are stored as '': a raw comparison with NULL is
+        # never true, so that bucket has to be excluded explicitly
+        return f"{column} {operator} {right.strip()} AND {column} <> ''"
+    if column == 'day':
+        # DATE(ts) is exactly the rollup day, so any comparison carries over
+        return f"day {operator} {right.strip()}"
+    try:
+        is_time = shape.resolve(left) == shape.time_column
+    except NotRewritable:
+        is_time = False
+    if is_time and operator in ('>=', '<') and DAY_EXPRESSION.match(right.strip()):
+        # ts >= midnight / ts < midnight select whole days
+        return f"day {operator} DATE({right.strip()})"
+    raise NotRewritable(f"condition not aligned to the rollup grain: {condition}")
+
+
+def rewrite(sql_query):
+    """Rewrites a funnel query to read from the rollup tables; raises NotRewritable otherwise."""
+    clauses = split_clauses(sql_query)
+    select_text, select_masked = clauses['SELECT']
+    if re.match(r"^(DISTINCT|ALL)\b", select_masked, re.I):
+        raise NotRewritable("SELECT DISTINCT")
+    shape = QueryShape(clauses['FROM'][0])
+
+    select_items = []
+    dimensions = []
+    needs_day = False
+    for item, _ in split_list(select_text, select_masked):
+        expression, alias = split_alias(item)
+        if alias is None:
+            # Unaliased columns are named after their text, or the bare column name
+            column_ref = COLUMN_PATTERN.match(expression.strip())
+            alias = column_ref.group(2) if column_ref else expression.strip()
+        alias = "`" + unquote(alias.strip("'")).replace("`", "``") + "`"
+
+        dimension = shape.dimension(expression)
+        if dimension:
+            dimensions.append(dimension)
+            output = dimension if dimension == 'day' else f"NULLIF({dimension}, '')"
+            select_items.append((expression.strip(), f"{output} AS {alias}"))
+            continue
+        mapped = map_aggregates(shape, expression)
+        if mapped is None:
+            raise NotRewritable(f"unsupported select item {expression}")
+        needs_day = needs_day or mapped[1]
+        select_items.append((expression.strip(), f"{mapped[0]} AS {alias}"))
+
+    group_dimensions = []
+    if 'GROUP BY' in clauses:
+        for item, _ in split_list(*clauses['GROUP BY']):
+            if item.isdigit():
+                index = int(item) - 1
+                if index >= len(select_items):
+                    raise NotRewritable("bad GROUP BY position")
+                dimension = shape.dimension(select_items[index][0])
+            else:
+                dimension = shape.dimension(item)
+                if dimension is None:
+                    # May be a select alias
+                    for expression, rendered in select_items:
+                        if rendered.endswith(f"AS `{unquote(item)}`"):
+                            dimension = shape.dimension(expression)
+            if dimension is None:
+                raise NotRewritable(f"GROUP BY {item} has no rollup column")
+            group_dimensions.append(dimension)
+    if set(dimensions) - set(group_dimensions):
+        raise NotRewritable("selected column missing from GROUP BY")
+    if needs_day and 'day' not in group_dimensions:
+        raise NotRewritable("distinct sessions need a per-day grouping")
+
+    conditions = []
+    if shape.mode == 'event':
+        conditions.append(f"stage = '{shape.base}'")
+    if 'WHERE' in clauses:
+        for condition in split_conditions(*clauses['WHERE']):
+            conditions.append(map_condition(shape, condition))
+
+    table = EVENT_ROLLUP if shape.mode == 'event' else SESSION_ROLLUP
+    sql = f"SELECT {', '.join(rendered for _, rendered in select_items)} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if group_dimensions:
+        sql += " GROUP BY " + ", ".join(dict.fromkeys(group_dimensions))
+    if 'ORDER BY' in clauses:
+        sql += " ORDER BY " + map_order_by(shape, clauses['ORDER BY'], select_items)
+    if 'LIMIT' in clauses:
+        limit = clauses['LIMIT'][0]
+        if not re.match(r"^\d+(\s*(,|OFFSET)\s*\d+)?$", limit, re.I):
+            raise NotRewritable("unsupported LIMIT")
+        sql += f" LIMIT {limit}"
+    return sql
+
+
+def split_alias(item):
+    explicit = re.match(rf"^(.*?)\s+AS\s+({IDENT}|'[^']*')$", item, re.I | re.S)
+    if explicit:
+        return explicit.group(1), explicit.group(2)
+    implicit = re.match(rf"^(.*[\w)`])\s+({IDENT})$", item, re.S)
+    if implicit and unquote(implicit.group(2)).upper() not in KEYWORDS:
+        return implicit.group(1), implicit.group(2)
+    return item, None
+
+
+def split_conditions(text, masked):
+    # Top-level AND split, gluing "x BETWEEN a" back onto its "b"
+    conditions = []
+    for part, masked_part in split_list(text, masked, separator=r"\bAND\b"):
+        if conditions and re.search(r"\bBETWEEN\b", conditions[-1][1], re.I) and \
+                not re.search(r"\bAND\b", conditions[-1][1], re.I):
+            previous, previous_masked = conditions.pop()
+            part, masked_part = f"{previous} AND {part}", f"{previous_masked} AND {masked_part}"
+        conditions.append((part, masked_part))
+    return [part for part, _ in conditions]
+
+
+def map_order_by(shape, clause, select_items):
+    items = []
+    for item, _ in split_list(*clause):
+        direction = ''
+        match = re.match(r"^(.*?)\s+(ASC|DESC)$", item, re.I | re.S)
+        if match:
+            item, direction = match.group(1), ' ' + match.group(2).upper()
+        item = item.strip()
+        if item.isdigit():
+            items.append(item + direction)
+            continue
+        for expression, rendered in select_items:
+            alias = rendered.rsplit(' AS ', 1)[1]
+            if unquote(item) == unquote(alias) or item == expression:
+                items.append(alias + direction)
+                break
+        else:
+            dimension = shape.dimension(item)
+            mapped = dimension or (map_aggregates(shape, item) or (None,))[0]
+            if mapped is None:
+                raise NotRewritable(f"ORDER BY {item}")
+            items.append(mapped + direction)
+    return ", ".join(items)
+
+
+_freshness = {'checked_at': 0.0, 'fresh': False}
+_freshness_lock = threading.Lock()
+
+
+def rollups_fresh(conn=None):
+    # Cached for a minute so routing adds no query to most executions
+    with _freshness_lock:
+        if time.monotonic() - _freshness['checked_at'] < 60:
+            return _freshness['fresh']
+    owns_connection = conn is None
+    try:
+        if owns_connection:
+            import db
+            conn = db.get_read_connection()
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT MIN(refreshed_at) >= NOW() - INTERVAL %s MINUTE, COUNT(*) FROM {STATE_TABLE}",
+                (ROLLUP_MAX_STALENESS_MINUTES,),
+            )
+            fresh, count = cursor.fetchone()
+        fresh = bool(fresh) and count == 2
+    except Exception:
+        fresh = False
+    finally:
+        if owns_connection and conn is not None:
+            conn.close()
+    with _freshness_lock:
+        _freshness.update(checked_at=time.monotonic(), fresh=fresh)
+    return fresh
+
+
+def route(sql_query, conn=None):
+    # Returns (sql to run, True if served from a rollup)
+    if not ROLLUPS_ENABLED:
+        return sql_query, False
+    try:
+        rewritten = rewrite(sql_query)
+    except NotRewritable:
+        return sql_query, False
+    if not rollups_fresh(conn):
+        return sql_query, False
+    return rewritten, True
+
+
+if __name__ == "__main__":
+    import db
+
+    parser = argparse.ArgumentParser(description="Maintain and test the funnel rollup tables")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('create', help="Create the rollup tables")
+    refresh_parser = subparsers.add_parser('refresh', help="Incrementally refresh the rollups")
+    refresh_parser.add_argument('--full', action='store_true', help="Rebuild from scratch")
+    rewrite_parser = subparsers.add_parser('rewrite', help="Show how a query would be rewritten")
+    rewrite_parser.add_argument('sql')
+    args = parser.parse_args()
+
+    if args.command == 'rewrite':
+        try:
+            print(rewrite(args.sql))
+        except NotRewritable as e:
+            print(f"Not rewritable: {e}")
+    else:
+        # Rollups are written on the primary and reach the replicas via replication
+        conn = db.get_write_connection()
+        try:
+            if args.command == 'create':
+                create_tables(conn)
+                print("Rollup tables created")
+            else:
+                print(refresh(conn, full=args.full))
+        finally:
+            conn.close()
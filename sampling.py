@@ -0,0 +1,517 @@
+import argparse
+import datetime
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import sql_utils
+
+# Load environment variables at startup
+load_dotenv()
+
+# Sessions kept in the preview samples, per thousand. Every tracker table is
+# sampled on the same CRC32 of the session id, so a sampled session keeps all
+# of its events and joins across the samples stay coherent.
+SAMPLE_PERMILLE = int(os.getenv('SAMPLE_PERMILLE', '10'))
+# Days re-copied on every incremental refresh, for late events and sessions
+# updated after the day they started
+SAMPLE_LOOKBACK_DAYS = int(os.getenv('SAMPLE_LOOKBACK_DAYS', '2'))
+# Incremental refreshes only add and overwrite recent rows: rows deleted from
+# the tracker stay in the samples, and changes older than the lookback are
+# never picked up. A refresh turns into a full rebuild once the last one is
+# this many days old, which bounds that drift; 0 leaves it to --full.
+SAMPLE_FULL_REFRESH_DAYS = int(os.getenv('SAMPLE_FULL_REFRESH_DAYS', '7'))
+
+SAMPLE_PREFIX = 'sample_'
+STATE_TABLE = 'sample_state'
+
+# Tracker tables: the column holding the session id, and the time column
+# incremental refreshes use
+TABLES = {
+    'sessions': ('id', 'createdAt'),
+    'signup': ('sessionId', 'timestamp'),
+    'search_bar': ('sessionId', 'timestamp'),
+    'feature_products': ('sessionId', 'timestamp'),
+    'add_to_favourites': ('sessionId', 'timestamp'),
+    'add_to_cart': ('sessionId', 'timestamp'),
+    'proceed_to_checkout': ('sessionId', 'timestamp'),
+    'proceed_to_payment': ('sessionId', 'timestamp'),
+    'conversions': ('sessionId', 'timestamp'),
+    'events': ('sessionId', 'timestamp'),
+}
+
+CREATE_STATE_TABLE = f"""CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+    table_name VARCHAR(64) NOT NULL,
+    permille INT NOT NULL,
+    refreshed_at DATETIME NOT NULL,
+    full_refreshed_at DATETIME NULL,
+    PRIMARY KEY (table_name)
+)"""
+
+
+# --- Maintenance -------------------------------------------------------------
+
+def sample_table(table):
+    return SAMPLE_PREFIX + table
+
+
+def sample_condition(table, permille):
+    # MOD rather than %, which pymysql would read as a placeholder
+    return f"MOD(CRC32({TABLES[table][0]}), 1000) < {int(permille)}"
+
+
+def ensure_state_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(CREATE_STATE_TABLE)
+        # State tables created before full_refreshed_at existed
+        cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                       "AND TABLE_NAME = %s AND COLUMN_NAME = 'full_refreshed_at'", (STATE_TABLE,))
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"ALTER TABLE {STATE_TABLE} ADD COLUMN full_refreshed_at DATETIME NULL")
+
+
+def get_state(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT table_name, permille, refreshed_at, full_refreshed_at FROM {STATE_TABLE}")
+        return {row[0]: {'permille': row[1], 'refreshed_at': row[2], 'full_refreshed_at': row[3]}
+                for row in cursor.fetchall()}
+
+
+def refresh(conn, full=False, permille=None):
+    # A full refresh builds every sample next to the live ones and swaps them
+    # in with a single RENAME, so readers never see a mix of old and new
+    # samples. Incremental refreshes re-copy recent rows in place; see
+    # SAMPLE_FULL_REFRESH_DAYS for what they miss.
+    permille = permille or SAMPLE_PERMILLE
+    ensure_state_table(conn)
+    state = get_state(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT NOW()")
+        now = cursor.fetchone()[0]
+    if any(state.get(table, {}).get('permille') != permille for table in TABLES):
+        full = True
+    if SAMPLE_FULL_REFRESH_DAYS > 0:
+        due = now - datetime.timedelta(days=SAMPLE_FULL_REFRESH_DAYS)
+        last_full = [state.get(table, {}).get('full_refreshed_at') for table in TABLES]
+        if any(refreshed is None or refreshed <= due for refreshed in last_full):
+            full = True
+
+    report = {}
+    with conn.cursor() as cursor:
+        for table in TABLES:
+            started = time.monotonic()
+            if full:
+                cursor.execute(f"DROP TABLE IF EXISTS {sample_table(table)}_new")
+                cursor.execute(f"CREATE TABLE {sample_table(table)}_new LIKE {table}")
+                cursor.execute(f"INSERT INTO {sample_table(table)}_new SELECT * FROM {table} "
+                               f"WHERE {sample_condition(table, permille)}")
+                since = None
+            else:
+                since = state[table]['refreshed_at'].date() - datetime.timedelta(days=SAMPLE_LOOKBACK_DAYS)
+                cursor.execute(f"REPLACE INTO {sample_table(table)} SELECT * FROM {table} "
+                               f"WHERE {TABLES[table][1]} >= %s AND {sample_condition(table, permille)}",
+                               (since,))
+            report[table] = {
+                'since': str(since) if since else 'full',
+                'rows': cursor.rowcount,
+                'seconds': round(time.monotonic() - started, 2),
+            }
+
+        if full:
+            for table in TABLES:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {sample_table(table)} LIKE {table}")
+            cursor.execute("RENAME TABLE " + ", ".join(
+                f"{sample_table(table)} TO {sample_table(table)}_old, "
+                f"{sample_table(table)}_new TO {sample_table(table)}" for table in TABLES))
+            cursor.execute("DROP TABLE " + ", ".join(f"{sample_table(table)}_old" for table in TABLES))
+        for table in TABLES:
+            cursor.execute(
+                f"INSERT INTO {STATE_TABLE} (table_name, permille, refreshed_at, full_refreshed_at) "
+                f"VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE permille = VALUES(permille), "
+                f"refreshed_at = VALUES(refreshed_at), "
+                f"full_refreshed_at = COALESCE(VALUES(full_refreshed_at), full_refreshed_at)",
+                (table, permille, now, now if full else None),
+            )
+    conn.commit()
+    return report
+
+
+# --- Query rewriting -----------------------------------------------------------
+
+class NotSampleable(Exception):
+    pass
+
+
+IDENT = r"`?[A-Za-z_]\w*`?"
+SUBQUERY_START = re.compile(r"\(\s*(?:SELECT|WITH)\b", re.I)
+CTE_NAME = re.compile(rf"({IDENT})\s+AS\s*$", re.I)
+SOURCE_PATTERN = re.compile(rf"\b(?:FROM|JOIN)\s+(?:(\()|({IDENT})(\s*\.\s*{IDENT})?)", re.I)
+ALIAS_PATTERN = re.compile(rf"\s+(?:AS\s+)?({IDENT})", re.I)
+CLAUSE_PATTERN = re.compile(r"\b(SELECT|FROM|WHERE|GROUP\s+BY|HAVING|WINDOW|ORDER\s+BY|LIMIT|UNION)\b", re.I)
+AGGREGATE_PATTERN = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX)\s*\(\s*(DISTINCT\s+)?", re.I)
+SESSION_KEY = re.compile(r"\bsessionid\b|(?:^|[\s.,(`])id\b", re.I)
+# id/sessionId compared with a literal (blanked to '___' in the masked text),
+# not with another column as in a join written in WHERE
+KEY_FILTER = re.compile(r"(?:^|[\s.,(])`?(?:sessionid|id)`?\s*(?:=|<=>|\bIN\s*\()\s*['\"\d]", re.I)
+ROW_KEY = re.compile(r"(?:^|\.)`?(?:id|sessionId)`?$", re.I)
+NOT_AN_ALIAS = {'ON', 'USING', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'STRAIGHT_JOIN',
+                'JOIN', 'WHERE', 'GROUP', 'HAVING', 'WINDOW', 'ORDER', 'LIMIT', 'UNION', 'FOR', 'LOCK'}
+Z_95 = 1.96
+
+
+def unquote(identifier):
+    return identifier.strip('`') if identifier else identifier
+
+
+def closing_paren(masked, depths, start):
+    # Position of the ')' matching the '(' at start
+    for i in range(start + 1, len(masked)):
+        if masked[i] == ')' and depths[i] == depths[start]:
+            return i
+    raise NotSampleable("unbalanced parentheses")
+
+
+class Block:
+    # One SELECT (or WITH ... SELECT) nested in parentheses, or the whole query
+
+    def __init__(self, start, end, parent=None):
+        self.start, self.end = start, end
+        self.children = []
+        self.kind = 'neutral'
+        if parent:
+            parent.children.append(self)
+
+
+def parse_blocks(masked):
+    depths = sql_utils.paren_depths(masked)
+    root = Block(0, len(masked))
+    stack = [root]
+    for match in SUBQUERY_START.finditer(masked):
+        end = closing_paren(masked, depths, match.start())
+        while stack[-1].end <= match.start():
+            stack.pop()
+        stack.append(Block(match.start() + 1, end, stack[-1]))
+    return root
+
+
+def own_text(masked, block):
+    # The block's text with its subqueries blanked, offsets kept
+    chars = list(masked[block.start:block.end])
+    for child in block.children:
+        for i in range(child.start - block.start, child.end - block.start):
+            chars[i] = ' '
+    return ''.join(chars)
+
+
+class Rewriter:
+    # Points tracker tables at their samples and scales COUNT/SUM back up to
+    # full-data estimates. Each SELECT is classified by what it reads: rows of
+    # a sample ('sample'), estimates already scaled ('scaled') or neither.
+    # Aggregates are scaled once, in the first SELECT that totals sample rows
+    # across sessions; per-session groups are exact and left alone.
+
+    def __init__(self, sql_query, permille):
+        self.text = sql_utils.blank_comments(sql_query).strip().rstrip(';').rstrip()
+        self.masked = sql_utils.blank_literals(self.text)
+        if not re.match(r"^\s*(SELECT|WITH)\b", self.masked, re.I) or ';' in self.masked:
+            raise NotSampleable("not a single SELECT")
+        if re.search(r"\bWITH\s+RECURSIVE\b", self.masked, re.I):
+            raise NotSampleable("recursive CTE")
+        self.permille = permille
+        self.factor = 1000 / permille
+        self.edits = []
+        self.notes = []
+        self.ctes = {}
+        self.sampled = set()
+        self.margins = []
+
+    def note(self, message):
+        if message not in self.notes:
+            self.notes.append(message)
+
+    def rewrite(self):
+        root = parse_blocks(self.masked)
+        for child in root.children:
+            # "WITH name AS (" or ", name AS (" opens a CTE body
+            cte = CTE_NAME.search(self.masked[:child.start - 1])
+            if cte and re.search(r"(\bWITH|,)$", self.masked[:cte.start()].rstrip(), re.I):
+                self.ctes[id(child)] = unquote(cte.group(1)).lower()
+        self.cte_names = set(self.ctes.values())
+        self.cte_kinds = {}
+        self.visit(root, is_root=True)
+        if not self.sampled:
+            raise NotSampleable("no tracker tables referenced")
+
+        # Applied back to front; insertions at the same point go scale, alias, margins
+        sql = self.text
+        for start, end, replacement, _ in sorted(self.edits, key=lambda edit: (edit[0], edit[1], edit[3]), reverse=True):
+            sql = sql[:start] + replacement + sql[end:]
+        return {
+            'sql': sql,
+            'permille': self.permille,
+            'factor': self.factor,
+            'margins': self.margins,
+            'notes': self.notes,
+        }
+
+    def visit(self, block, is_root=False):
+        for child in block.children:
+            self.visit(child)
+        own = own_text(self.masked, block)
+        depths = sql_utils.paren_depths(own)
+        unions = [m for m in re.finditer(r"\bUNION\b(?:\s+(?:ALL|DISTINCT)\b)?", own, re.I) if depths[m.start()] == 0]
+        bounds = [0] + [m.end() for m in unions]
+        ends = [m.start() for m in unions] + [len(own)]
+        kinds = [self.visit_branch(block, own, depths, start, end, is_root and not unions)
+                 for start, end in zip(bounds, ends)]
+        block.kind = 'scaled' if 'scaled' in kinds else 'sample' if 'sample' in kinds else 'neutral'
+        if id(block) in self.ctes:
+            self.cte_kinds[self.ctes[id(block)]] = block.kind
+
+    def visit_branch(self, block, own, depths, start, end, with_margins):
+        # The last top-level SELECT in the branch; anything before it is a WITH list
+        clauses = {}
+        select_at = None
+        for match in CLAUSE_PATTERN.finditer(own, start, end):
+            if depths[match.start()] != 0:
+                continue
+            name = ' '.join(match.group(1).upper().split())
+            if name == 'SELECT':
+                select_at = match
+                clauses = {}
+            elif select_at is not None:
+                clauses.setdefault(name, match)
+        if select_at is None:
+            raise NotSampleable("no SELECT")
+
+        sources = self.sources(block, own, depths, clauses, end)
+        aggregates = self.aggregates(block, own, depths, select_at.end(), end)
+        group_by = self.clause_text(own, clauses, 'GROUP BY', end)
+        per_session = bool(group_by and SESSION_KEY.search(group_by))
+        where = self.clause_text(own, clauses, 'WHERE', end)
+        if 'sample' in sources and where and KEY_FILTER.search(where):
+            # Picks out particular sessions or rows, which the sample most
+            # likely doesn't hold; scaling their counts would be meaningless
+            raise NotSampleable("filters on specific sessions")
+        additive = [a for a in aggregates if a['function'] in ('COUNT', 'SUM')]
+
+        if 'sample' in sources and additive and not per_session:
+            for aggregate in additive:
+                self.scale(aggregate)
+            if with_margins:
+                self.add_margins(block, own, select_at, clauses, aggregates)
+            return 'scaled'
+        if 'sample' in sources and (aggregates or group_by) and not per_session:
+            # AVG/MIN/MAX over the sample estimate the full-data value as is
+            if any(a['function'] in ('MIN', 'MAX') for a in aggregates):
+                self.note("MIN/MAX come from the sample and can miss the true extremes.")
+            return 'scaled'
+        if 'sample' in sources:
+            return 'sample'
+        return 'scaled' if 'scaled' in sources else 'neutral'
+
+    def clause_text(self, own, clauses, name, end):
+        if name not in clauses:
+            return None
+        start = clauses[name].end()
+        following = [m.start() for m in clauses.values() if m.start() > start]
+        return own[start:min(following, default=end)]
+
+    def sources(self, block, own, depths, clauses, end):
+        if 'FROM' not in clauses:
+            return []
+        from_text = self.clause_text(own, clauses, 'FROM', end)
+        from_depths = sql_utils.paren_depths(from_text)
+        if any(char == ',' and from_depths[i] == 0 for i, char in enumerate(from_text)):
+            raise NotSampleable("comma-separated FROM list")
+
+        kinds = []
+        for match in SOURCE_PATTERN.finditer(own, clauses['FROM'].start(), clauses['FROM'].end() + len(from_text)):
+            if depths[match.start()] != 0:
+                continue
+            if match.group(1):
+                position = block.start + match.start(1) + 1
+                child = next((c for c in block.children if c.start == position), None)
+                kinds.append(child.kind if child else 'neutral')
+                continue
+            if match.group(3):
+                # schema.table: left as is
+                kinds.append('neutral')
+                continue
+            table = unquote(match.group(2)).lower()
+            if table in self.cte_names:
+                kinds.append(self.cte_kinds.get(table, 'neutral'))
+            elif table in TABLES:
+                self.rename(block, own, match, table)
+                kinds.append('sample')
+            else:
+                kinds.append('neutral')
+        return kinds
+
+    def rename(self, block, own, match, table):
+        start, end = block.start + match.start(2), block.start + match.end(2)
+        alias = ALIAS_PATTERN.match(own, match.end(2))
+        replacement = sample_table(table)
+        if not alias or unquote(alias.group(1)).upper() in NOT_AN_ALIAS:
+            # Keeps table-qualified column references working
+            replacement += f" AS {unquote(match.group(2))}"
+        self.edits.append((start, end, replacement, 0))
+        self.sampled.add(table)
+
+    def aggregates(self, block, own, depths, start, end):
+        found = []
+        for match in AGGREGATE_PATTERN.finditer(own, start, end):
+            open_at = own.index('(', match.start())
+            close_at = closing_paren(own, depths, open_at)
+            if re.match(r"\s*OVER\b", own[close_at + 1:]):
+                self.note(f"{match.group(1).upper()}() OVER (...) is computed on the sample and not scaled.")
+                continue
+            argument = self.text[block.start + match.end():block.start + close_at].strip()
+            found.append({
+                'function': match.group(1).upper(),
+                'distinct': bool(match.group(2)),
+                'argument': argument,
+                'start': block.start + match.start(),
+                'end': block.start + close_at + 1,
+            })
+        return found
+
+    def scale(self, aggregate):
+        if aggregate['distinct'] and not (aggregate['function'] == 'COUNT' and ROW_KEY.search(aggregate['argument'])):
+            # Distinct values other than row or session ids don't grow linearly with the data
+            self.note(f"{aggregate['function']}(DISTINCT {aggregate['argument']}) is a sample value, not scaled.")
+            aggregate['scaled'] = False
+            return
+        self.edits.append((aggregate['start'], aggregate['start'], "(", 0))
+        self.edits.append((aggregate['end'], aggregate['end'], f" * {self.factor:g})", 0))
+        aggregate['scaled'] = True
+
+    def margin(self, aggregate):
+        # 95% margin of the Horvitz-Thompson total under Bernoulli sampling:
+        # Var = (1 - p) / p^2 * sum(y^2). Rows are treated as independent, so
+        # totals over many events per session come out somewhat optimistic.
+        p = self.permille / 1000
+        distinct = 'DISTINCT ' if aggregate['distinct'] else ''
+        if aggregate['function'] == 'COUNT':
+            squares = f"COUNT({distinct}{aggregate['argument']})"
+        else:
+            squares = f"SUM(POW({aggregate['argument']}, 2))"
+        return f"ROUND({Z_95} * SQRT({1 - p:g} * {squares}) / {p:g}, 2)"
+
+    def add_margins(self, block, own, select_at, clauses, aggregates):
+        # A "<column> ±95%" column after the select list for every item that
+        # is a single scaled COUNT/SUM. Scaled items without an alias keep
+        # their original text as the column name.
+        if 'FROM' not in clauses:
+            return
+        list_start, list_end = block.start + select_at.end(), block.start + clauses['FROM'].start()
+        list_text = self.text[list_start:list_end]
+        items = sql_utils.split_top_level(list_text, self.masked[list_start:list_end], re.compile(','))
+        scaled = [a for a in aggregates if a.get('scaled')]
+        offset = list_start
+        columns = []
+        for item in items:
+            item_start = offset + len(item) - len(item.lstrip())
+            item_end = offset + len(item.rstrip())
+            offset += len(item) + 1
+            expression, alias = split_alias(item.strip())
+            inside = [a for a in scaled if item_start <= a['start'] < item_end]
+            if not inside:
+                continue
+            name = unquote(alias.strip("'")) if alias else expression.strip()
+            if alias is None:
+                self.edits.append((item_end, item_end, f" AS `{name.replace('`', '``')}`", 1))
+            if len(inside) == 1 and expression.strip() == self.text[inside[0]['start']:inside[0]['end']]:
+                label = f"{name} ±95%"
+                columns.append(f"{self.margin(inside[0])} AS `{label.replace('`', '``')}`")
+                self.margins.append({'column': name, 'margin_column': label})
+        if columns:
+            position = list_start + len(list_text.rstrip())
+            self.edits.append((position, position, ", " + ", ".join(columns), 2))
+
+
+def split_alias(item):
+    explicit = re.match(rf"^(.*?)\s+AS\s+({IDENT}|'[^']*')$", item, re.I | re.S)
+    if explicit:
+        return explicit.group(1), explicit.group(2)
+    implicit = re.match(rf"^(.*[\w)`])\s+({IDENT})$", item, re.S)
+    if implicit and unquote(implicit.group(2)).upper() not in NOT_AN_ALIAS | {'DISTINCT', 'END'}:
+        return implicit.group(1), implicit.group(2)
+    return item, None
+
+
+def rewrite(sql_query, permille=None):
+    """Rewrites a query to run on the session samples; raises NotSampleable otherwise."""
+    return Rewriter(sql_query, permille or SAMPLE_PERMILLE).rewrite()
+
+
+_state = {'checked_at': 0.0, 'state': None}
+_state_lock = threading.Lock()
+
+
+def sample_status(conn=None):
+    # The live sample rate and its refresh time, or None if the samples are
+    # missing or half-built. Cached for a minute like the rollup freshness check.
+    with _state_lock:
+        if time.monotonic() - _state['checked_at'] < 60:
+            return _state['state']
+    owns_connection = conn is None
+    try:
+        if owns_connection:
+            import db
+            conn = db.get_read_connection()
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(permille), MAX(permille), MIN(refreshed_at), COUNT(*) FROM {STATE_TABLE}")
+            low, high, refreshed_at, count = cursor.fetchone()
+        status = {'permille': low, 'refreshed_at': refreshed_at} if count == len(TABLES) and low == high else None
+    except Exception:
+        status = None
+    finally:
+        if owns_connection and conn is not None:
+            conn.close()
+    with _state_lock:
+        _state.update(checked_at=time.monotonic(), state=status)
+    return status
+
+
+def preview(sql_query, conn=None):
+    # The rewrite at the sample rate that is actually live
+    status = sample_status(conn)
+    if status is None:
+        raise NotSampleable("samples have not been built (python sampling.py refresh)")
+    result = rewrite(sql_query, status['permille'])
+    result['refreshed_at'] = status['refreshed_at']
+    return result
+
+
+if __name__ == "__main__":
+    import db
+
+    parser = argparse.ArgumentParser(description="Maintain and test the session-sampled preview tables")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    refresh_parser = subparsers.add_parser('refresh', help="Refresh the samples (first run builds them)")
+    refresh_parser.add_argument('--full', action='store_true',
+                                help="Rebuild from scratch (also happens every SAMPLE_FULL_REFRESH_DAYS)")
+    refresh_parser.add_argument('--permille', type=int, help="sessions kept per thousand")
+    rewrite_parser = subparsers.add_parser('rewrite', help="Show how a query would be previewed")
+    rewrite_parser.add_argument('sql')
+    args = parser.parse_args()
+
+    if args.command == 'rewrite':
+        try:
+            result = rewrite(args.sql)
+            print(result['sql'])
+            for note in result['notes']:
+                print(f"-- {note}")
+        except NotSampleable as e:
+            print(f"Not sampleable: {e}")
+    else:
+        # Samples are written on the primary and reach the replicas via replication
+        conn = db.get_write_connection()
+        try:
+            print(refresh(conn, full=args.full, permille=args.permille))
+        finally:
+            conn.close()
@@ -0,0 +1,74 @@
+# Tracker tables as declared in model.txt, shared by the synthetic data
+# generator and the index advisor. Ids are UUID strings.
+
+COLUMNS = {
+    'sessions': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('trackingId', 'VARCHAR(64) NOT NULL'),
+        ('entryPage', 'VARCHAR(255) NOT NULL'), ('exitPage', 'VARCHAR(255)'),
+        ('timeSpent', 'INT NOT NULL DEFAULT 0'), ('utm_source', 'VARCHAR(255)'),
+        ('utm_medium', 'VARCHAR(255)'), ('utm_campaign_name', 'VARCHAR(255)'),
+        ('utm_campaign_id', 'VARCHAR(255)'), ('utm_term', 'VARCHAR(255)'),
+        ('utm_content', 'VARCHAR(255)'), ('os', 'VARCHAR(64)'), ('device', 'VARCHAR(64)'),
+        ('browser', 'VARCHAR(64)'), ('longitude', 'DOUBLE'), ('latitude', 'DOUBLE'),
+        ('city', 'VARCHAR(128)'), ('country', 'VARCHAR(128)'),
+        ('createdAt', 'DATETIME'), ('updatedAt', 'DATETIME'),
+    ],
+    'signup': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('userId', 'VARCHAR(64) NOT NULL'), ('timestamp', 'DATETIME NOT NULL'),
+    ],
+    'search_bar': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('userId', 'VARCHAR(64) NOT NULL'), ('searchTerm', 'VARCHAR(255) NOT NULL'),
+        ('timestamp', 'DATETIME NOT NULL'),
+    ],
+    'proceed_to_payment': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('productIds', 'TEXT'), ('cartValue', 'DOUBLE NOT NULL'), ('currency', 'VARCHAR(8) NOT NULL'),
+        ('productName', 'TEXT NOT NULL'), ('userId', 'VARCHAR(64) NOT NULL'),
+        ('timestamp', 'DATETIME NOT NULL'), ('createdAt', 'DATETIME'), ('updatedAt', 'DATETIME'),
+    ],
+    'proceed_to_checkout': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('productIds', 'TEXT'), ('cartValue', 'DOUBLE NOT NULL'), ('currency', 'VARCHAR(8) NOT NULL'),
+        ('productName', 'TEXT NOT NULL'), ('userId', 'VARCHAR(64) NOT NULL'),
+        ('timestamp', 'DATETIME NOT NULL'),
+    ],
+    'feature_products': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('productId', 'VARCHAR(64) NOT NULL'), ('productCost', 'DOUBLE NOT NULL'),
+        ('currency', 'VARCHAR(8) NOT NULL'), ('productName', 'VARCHAR(255) NOT NULL'),
+        ('userId', 'VARCHAR(64) NOT NULL'), ('timestamp', 'DATETIME NOT NULL'),
+    ],
+    'events': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('eventName', 'VARCHAR(64) NOT NULL'), ('eventType', 'VARCHAR(64) NOT NULL'),
+        ('additionalData', 'JSON'), ('timestamp', 'DATETIME NOT NULL'),
+        ('createdAt', 'DATETIME'), ('updatedAt', 'DATETIME'),
+    ],
+    'conversions': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('conversionType', 'VARCHAR(64) NOT NULL'), ('conversionValue', 'DECIMAL(10,2) NOT NULL'),
+        ('timestamp', 'DATETIME NOT NULL'), ('createdAt', 'DATETIME'), ('updatedAt', 'DATETIME'),
+    ],
+    'add_to_favourites': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('userId', 'VARCHAR(64) NOT NULL'), ('pageUrl', 'VARCHAR(255) NOT NULL'),
+        ('productName', 'VARCHAR(255) NOT NULL'), ('productId', 'VARCHAR(64) NOT NULL'),
+        ('timestamp', 'DATETIME NOT NULL'),
+    ],
+    'add_to_cart': [
+        ('id', 'CHAR(36) NOT NULL PRIMARY KEY'), ('sessionId', 'CHAR(36) NOT NULL'),
+        ('productId', 'VARCHAR(64) NOT NULL'), ('productCost', 'DOUBLE NOT NULL'),
+        ('currency', 'VARCHAR(8) NOT NULL'), ('productName', 'VARCHAR(255) NOT NULL'),
+        ('userId', 'VARCHAR(64) NOT NULL'), ('timestamp', 'DATETIME NOT NULL'),
+    ],
+}
+
+# Indexes declared in model.txt; the index advisor falls back to these
+# when the live schema can't be read
+MODEL_INDEXES = {
+    'sessions': [('id',), ('trackingId',), ('createdAt',)],
+    'events': [('id',), ('sessionId',), ('timestamp',)],
+    'conversions': [('id',), ('sessionId',), ('timestamp',)],
+}
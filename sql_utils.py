@@ -0,0 +1,106 @@
+import re
+
+# Lightweight helpers for inspecting generated SQL text. These are not a full
+# parser; they only need to be good enough for routing and safety checks.
+
+READ_ONLY_KEYWORDS = ('SELECT', 'WITH', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN')
+
+COMMENT_PATTERN = re.compile(r"/\*.*?\*/|--[^\n]*|#[^\n]*", re.DOTALL)
+LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"", re.DOTALL)
+
+
+# Literals and comments are found in a single left-to-right pass, so
+# whichever starts first wins: '#1' and 'a -- b' are literals, and a quote
+# inside a comment doesn't open one.
+TOKEN_PATTERN = re.compile(rf"(?P<literal>{LITERAL_PATTERN.pattern})|(?P<comment>{COMMENT_PATTERN.pattern})",
+                           re.DOTALL)
+
+
+def scan(sql_query, literal=None, comment=None):
+    # Rewrites each literal and comment with the given function; None keeps it
+    def replace(match):
+        fn = literal if match.lastgroup == 'literal' else comment
+        return fn(match.group(0)) if fn else match.group(0)
+    return TOKEN_PATTERN.sub(replace, sql_query)
+
+
+def strip_comments(sql_query):
+    return scan(sql_query, comment=lambda text: ' ')
+
+
+def mask_literals(sql_query):
+    # Replace string literals so keywords or semicolons inside them are ignored
+    return scan(sql_query, literal=lambda text: "''")
+
+
+def blank_comments(sql_query):
+    # Same as strip_comments but keeps character offsets intact
+    return scan(sql_query, comment=lambda text: ' ' * len(text))
+
+
+def blank_literals(sql_query):
+    # Same as mask_literals but keeps character offsets intact, so positions
+    # found in the blanked text can be used to slice the original
+    return scan(sql_query, literal=lambda text: text[0] + '_' * (len(text) - 2) + text[-1])
+
+
+def paren_depths(text):
+    depths = []
+    depth = 0
+    for char in text:
+        if char == '(':
+            depth += 1
+        depths.append(depth)
+        if char == ')':
+            depth -= 1
+    return depths
+
+
+def split_top_level(text, masked, pattern):
+    # Splits text wherever pattern matches outside parentheses in masked
+    depths = paren_depths(masked)
+    parts = []
+    start = 0
+    for match in pattern.finditer(masked):
+        if depths[match.start()] == 0:
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def normalize(sql_query):
+    return ' '.join(scan(sql_query, literal=lambda text: "''", comment=lambda text: ' ').split())
+
+
+def statements(sql_query):
+    return [part.strip() for part in normalize(sql_query).split(';') if part.strip()]
+
+
+def is_read_only(sql_query):
+    parts = statements(sql_query)
+    if len(parts) != 1:
+        return False
+    first_word = parts[0].split(None, 1)[0].upper()
+    if first_word not in READ_ONLY_KEYWORDS:
+        return False
+    # SELECT ... INTO OUTFILE / FOR UPDATE still write or take locks
+    upper = parts[0].upper()
+    return not re.search(r"\bINTO\s+(OUTFILE|DUMPFILE)\b|\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", upper)
+
+
+TABLE_REFERENCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+(?:`?\w+`?\.)?`?([A-Za-z_]\w*)`?", re.I)
+
+
+def referenced_tables(sql_query):
+    # Base tables named after FROM/JOIN, minus CTE names defined in the query
+    text = normalize(sql_query)
+    # EXTRACT(DAY FROM ts), TRIM(x FROM y) etc. use FROM without naming a table
+    text = re.sub(r"\b(EXTRACT|TRIM|SUBSTRING|POSITION)\s*\([^()]*?\bFROM\b", r"\1(", text, flags=re.I)
+    cte_names = {name.lower() for name in re.findall(r"(?:\bWITH|,)\s+`?(\w+)`?\s+AS\s*\(", text, re.I)}
+    tables = []
+    for name in TABLE_REFERENCE_PATTERN.findall(text):
+        name = name.lower()
+        if name not in cte_names and name not in tables:
+            tables.append(name)
+    return tables
@@ -0,0 +1,63 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# What each entry point imports before it can do anything useful. app.py is
+# a Streamlit script, so its cost is measured through the modules it loads.
+DEFAULT_TARGETS = ['llm', 'db', 'rag', 'api', 'dashboard']
+
+
+def import_times(module):
+    # Runs the import in a fresh interpreter with -X importtime and returns
+    # (wall seconds, [(self_us, cumulative_us, depth, name)])
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=current_dir, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(f"import {module} failed: {error[-1] if error else result.returncode}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return wall, entries
+
+
+def by_package(entries):
+    # Own import time summed per top-level package, so nested imports are
+    # charged to the package that actually spent the time
+    totals = defaultdict(int)
+    for self_us, _, _, name in entries:
+        totals[name.split('.')[0]] += self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def profile(targets, top):
+    for module in targets:
+        try:
+            wall, entries = import_times(module)
+        except RuntimeError as e:
+            print(f"{module}: {e}")
+            continue
+        total = sum(self_us for self_us, _, _, _ in entries)
+        print(f"{module}: {wall:.2f}s wall, {total / 1e6:.2f}s importing {len(entries)} modules")
+        for package, self_us in by_package(entries)[:top]:
+            print(f"  {package:<32} {self_us / 1000:9.1f} ms  {self_us / max(total, 1):6.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import time per package for each entry point")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_TARGETS)
+    parser.add_argument('--top', type=int, default=10, help="packages to list per module")
+    args = parser.parse_args()
+    profile(args.modules, args.top)
@@ -0,0 +1,122 @@
+import pytest
+
+import rollups
+import sampling
+
+# (input SQL, expected rewrite) or (input SQL, exception raised)
+
+ROLLUP_CASES = [
+    ("SELECT utm_source, COUNT(*) FROM sessions GROUP BY utm_source",
+     "SELECT NULLIF(utm_source, '') AS `utm_source`, SUM(sessions) AS `COUNT(*)` "
+     "FROM rollup_session_funnel_daily GROUP BY utm_source"),
+    ("SELECT DATE(createdAt) AS day, COUNT(*) AS sessions FROM sessions WHERE country = 'India' "
+     "GROUP BY DATE(createdAt)",
+     "SELECT day AS `day`, SUM(sessions) AS `sessions` FROM rollup_session_funnel_daily "
+     "WHERE country = 'India' GROUP BY day"),
+    ("SELECT COUNT(*) FROM sessions WHERE createdAt >= '2024-01-01'",
+     "SELECT SUM(sessions) AS `COUNT(*)` FROM rollup_session_funnel_daily WHERE day >= DATE('2024-01-01')"),
+    ("SELECT country, AVG(timeSpent) FROM sessions GROUP BY country",
+     "SELECT NULLIF(country, '') AS `country`, (SUM(time_spent) / NULLIF(SUM(sessions), 0)) AS `AVG(timeSpent)` "
+     "FROM rollup_session_funnel_daily GROUP BY country"),
+    ("SELECT DATE(timestamp) AS day, SUM(conversionValue) AS revenue FROM conversions GROUP BY DATE(timestamp)",
+     "SELECT day AS `day`, SUM(value) AS `revenue` FROM rollup_funnel_daily "
+     "WHERE stage = 'conversions' GROUP BY day"),
+    ("SELECT s.country, COUNT(*) FROM add_to_cart a LEFT JOIN sessions s ON a.sessionId = s.id "
+     "GROUP BY s.country",
+     "SELECT NULLIF(country, '') AS `country`, SUM(events) AS `COUNT(*)` FROM rollup_funnel_daily "
+     "WHERE stage = 'add_to_cart' GROUP BY country"),
+    # NULL dimensions are stored as '' and must stay out of everything but = and IN
+    ("SELECT device, COUNT(*) FROM sessions WHERE device IN ('mobile', 'desktop') GROUP BY device",
+     "SELECT NULLIF(device, '') AS `device`, SUM(sessions) AS `COUNT(*)` FROM rollup_session_funnel_daily "
+     "WHERE device IN ('mobile', 'desktop') GROUP BY device"),
+    ("SELECT device, COUNT(*) FROM sessions WHERE device NOT IN ('mobile') GROUP BY device",
+     "SELECT NULLIF(device, '') AS `device`, SUM(sessions) AS `COUNT(*)` FROM rollup_session_funnel_daily "
+     "WHERE device NOT IN ('mobile') AND device <> '' GROUP BY device"),
+    ("SELECT device, COUNT(*) FROM sessions WHERE device > 'm' GROUP BY device",
+     "SELECT NULLIF(device, '') AS `device`, SUM(sessions) AS `COUNT(*)` FROM rollup_session_funnel_daily "
+     "WHERE device > 'm' AND device <> '' GROUP BY device"),
+    ("SELECT s.device, COUNT(*) FROM conversions c LEFT JOIN sessions s ON c.sessionId = s.id "
+     "WHERE s.device NOT IN ('mobile') GROUP BY s.device",
+     "SELECT NULLIF(device, '') AS `device`, SUM(events) AS `COUNT(*)` FROM rollup_funnel_daily "
+     "WHERE stage = 'conversions' AND device NOT IN ('mobile') AND device <> '' GROUP BY device"),
+    # Comment markers inside literals and quotes inside comments
+    ("SELECT country, COUNT(*) FROM sessions WHERE country = '#UK' GROUP BY country",
+     "SELECT NULLIF(country, '') AS `country`, SUM(sessions) AS `COUNT(*)` FROM rollup_session_funnel_daily "
+     "WHERE country = '#UK' GROUP BY country"),
+    ("SELECT COUNT(*) FROM sessions -- '#\n",
+     "SELECT SUM(sessions) AS `COUNT(*)` FROM rollup_session_funnel_daily"),
+    # Refused
+    ("SELECT device, COUNT(*) FROM sessions WHERE device = '' GROUP BY device", rollups.NotRewritable),
+    ("SELECT s.country, COUNT(*) FROM add_to_cart a JOIN sessions s ON a.sessionId = s.id GROUP BY s.country",
+     rollups.NotRewritable),
+    ("SELECT s.country, COUNT(e.id) FROM events e LEFT JOIN sessions s ON e.sessionId = s.id GROUP BY s.country",
+     rollups.NotRewritable),
+    ("SELECT device, COUNT(*) FROM sessions WHERE browser <> 'Chrome' GROUP BY device", rollups.NotRewritable),
+    ("SELECT country, COUNT(*) FROM sessions WHERE city LIKE 'Lon%' GROUP BY country", rollups.NotRewritable),
+    ("SELECT country, COUNT(*) FROM sessions GROUP BY country HAVING COUNT(*) > 10", rollups.NotRewritable),
+    ("SELECT DISTINCT country FROM sessions", rollups.NotRewritable),
+    ("SELECT * FROM sessions", rollups.NotRewritable),
+]
+
+SAMPLE_CASES = [
+    ("SELECT COUNT(*) FROM sessions",
+     "SELECT (COUNT(*) * 100) AS `COUNT(*)`, ROUND(1.96 * SQRT(0.99 * COUNT(*)) / 0.01, 2) AS `COUNT(*) ±95%` "
+     "FROM sample_sessions AS sessions"),
+    ("SELECT utm_source, COUNT(*) AS sessions FROM sessions GROUP BY utm_source",
+     "SELECT utm_source, (COUNT(*) * 100) AS sessions, ROUND(1.96 * SQRT(0.99 * COUNT(*)) / 0.01, 2) "
+     "AS `sessions ±95%` FROM sample_sessions AS sessions GROUP BY utm_source"),
+    ("SELECT SUM(cartValue) AS revenue FROM proceed_to_payment",
+     "SELECT (SUM(cartValue) * 100) AS revenue, ROUND(1.96 * SQRT(0.99 * SUM(POW(cartValue, 2))) / 0.01, 2) "
+     "AS `revenue ±95%` FROM sample_proceed_to_payment AS proceed_to_payment"),
+    ("SELECT COUNT(DISTINCT sessionId) FROM events",
+     "SELECT (COUNT(DISTINCT sessionId) * 100) AS `COUNT(DISTINCT sessionId)`, "
+     "ROUND(1.96 * SQRT(0.99 * COUNT(DISTINCT sessionId)) / 0.01, 2) AS `COUNT(DISTINCT sessionId) ±95%` "
+     "FROM sample_events AS events"),
+    # Averages and row lookups need no scaling
+    ("SELECT AVG(timeSpent) FROM sessions", "SELECT AVG(timeSpent) FROM sample_sessions AS sessions"),
+    ("SELECT id, timeSpent FROM sessions WHERE timeSpent > 600",
+     "SELECT id, timeSpent FROM sample_sessions AS sessions WHERE timeSpent > 600"),
+    # A join written in WHERE is not a session filter
+    ("SELECT COUNT(*) FROM events e JOIN sessions s ON e.sessionId = s.id "
+     "WHERE s.country = 'IN' AND e.sessionId = s.id",
+     "SELECT (COUNT(*) * 100) AS `COUNT(*)`, ROUND(1.96 * SQRT(0.99 * COUNT(*)) / 0.01, 2) AS `COUNT(*) ±95%` "
+     "FROM sample_events e JOIN sample_sessions s ON e.sessionId = s.id "
+     "WHERE s.country = 'IN' AND e.sessionId = s.id"),
+    ("SELECT COUNT(*) FROM sessions UNION ALL SELECT COUNT(*) FROM events",
+     "SELECT (COUNT(*) * 100) FROM sample_sessions AS sessions UNION ALL "
+     "SELECT (COUNT(*) * 100) FROM sample_events AS events"),
+    # Per-session groups inside a CTE are complete in the sample
+    ("WITH t AS (SELECT sessionId, COUNT(*) AS n FROM events GROUP BY sessionId) SELECT AVG(n) FROM t",
+     "WITH t AS (SELECT sessionId, COUNT(*) AS n FROM sample_events AS events GROUP BY sessionId) "
+     "SELECT AVG(n) FROM t"),
+    ("SELECT country, COUNT(*) FROM sessions WHERE city = '# -- x' GROUP BY country",
+     "SELECT country, (COUNT(*) * 100) AS `COUNT(*)`, ROUND(1.96 * SQRT(0.99 * COUNT(*)) / 0.01, 2) "
+     "AS `COUNT(*) ±95%` FROM sample_sessions AS sessions WHERE city = '# -- x' GROUP BY country"),
+    # Refused
+    ("SELECT s.country, COUNT(*) FROM sessions s, events e WHERE s.id = e.sessionId GROUP BY s.country",
+     sampling.NotSampleable),
+    ("SELECT COUNT(*) FROM query_feedback", sampling.NotSampleable),
+    # Questions about particular sessions or rows go to the exact path
+    ("SELECT COUNT(*) FROM events WHERE sessionId = 'abc'", sampling.NotSampleable),
+    ("SELECT COUNT(*) FROM events e WHERE e.sessionId IN ('abc', 'def')", sampling.NotSampleable),
+    ("SELECT id, timeSpent FROM sessions WHERE id = 'abc'", sampling.NotSampleable),
+    ("SHOW TABLES", sampling.NotSampleable),
+]
+
+
+@pytest.mark.parametrize('sql_query, expected', ROLLUP_CASES)
+def test_rollup_rewrite(sql_query, expected):
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            rollups.rewrite(sql_query)
+    else:
+        assert rollups.rewrite(sql_query) == expected
+
+
+@pytest.mark.parametrize('sql_query, expected', SAMPLE_CASES)
+def test_sample_rewrite(sql_query, expected):
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            sampling.rewrite(sql_query, permille=10)
+    else:
+        assert sampling.rewrite(sql_query, permille=10)['sql'] == expected